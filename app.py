@@ -1,96 +1,26 @@
-import pandas as pd
-from flask import Flask, request, render_template_string, send_file, redirect, url_for
-import io
+from flask import Flask, request, render_template, redirect, url_for, Response, jsonify
+import logging
 import os
 
-app = Flask(__name__)
-app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024 
-
-
-def process_data(df_imported, df_basis):
-   
-    df_imported.rename(columns={
-        'Category Name': 'Category Name (Old)',
-        'Rate': 'Rate (Original)'
-    }, inplace=True)
-
-
-    df_processed = df_imported[['Item Name', 'Category Name (Old)', 'Rate (Original)']].copy()
-
-    # --- Remove Duplicated Item Names ---
-    df_processed.drop_duplicates(subset=['Item Name'], keep='first', inplace=True)
-    
-   
-    df_basis_map = df_basis[[
-        'Pos Product Name', 
-        'Product Id', 
-        'Pos Categories'
-    ]].copy()
-    
-    df_basis_map.rename(columns={
-        'Pos Product Name': 'Item Name',
-        'Pos Categories': 'Category Name (New)'
-    }, inplace=True)
-    
-    df_basis_map.drop_duplicates(subset=['Item Name'], keep='first', inplace=True)
-    
-    
-    df_processed = pd.merge(
-        df_processed, 
-        df_basis_map, 
-        on='Item Name', 
-        how='left'
-    )
- 
-    
-
-    df_processed['Category Name (New)'].fillna('UNCATEGORIZED', inplace=True) 
-    
-   
-    df_processed['Rate (Base Price)'] = df_processed['Rate (Original)'] / 1.12
-    
-   
-    df_processed['Rate (Base Price)'] = df_processed['Rate (Base Price)'].round(2)
-    
-    df_processed.sort_values(by='Product Id', inplace=True, na_position='last')
-    
-    df_processed['Featured Product'] = 'N'
-    df_processed['Pos Point Short Name'] = 'RMS'
-    df_processed['Unit Short Name'] = 'Unit'
-    df_processed['Status'] = 'A'
-
-    
-    remaining_placeholder_cols = [
-        'Description', 'Taxes Short Name', 'Pos Attributes', 
-        'NC value(%)', 'Kitchen Code'
-    ]
-    for col in remaining_placeholder_cols:
-        df_processed[col] = ''
-    
-  
-    df_final = df_processed[[
-        'Featured Product',
-        'Pos Point Short Name',
-        'Item Name',              
-        'Product Id', 
-        'Description',
-        'Category Name (New)',    
-        'Taxes Short Name',
-        'Pos Attributes',
-        'Rate (Base Price)',      
-        'NC value(%)',
-        'Unit Short Name',
-        'Kitchen Code',
-        'Status'
-    ]].copy()
-
-    df_final.rename(columns={
-        'Item Name': 'Pos Product Name',        
-        'Category Name (New)': 'Pos Categories', 
-        'Rate (Base Price)': 'Price'             
-    }, inplace=True)
-
-    return df_final
+from cache import result_cache
+from brands import catalog_registry
+from export import (OUTPUT_FORMATS, accepted_encoding, attachment_response, available_formats, download_response,
+                    encode_frame, iter_bytes, iter_csv, iter_encoded)
+from ingest import INPUT_EXTENSIONS, read_workbook
+from metrics import PROMETHEUS_CONTENT_TYPE, metrics, traced_stream
+import pages
+from processing import process_data, split_review, unmatched_count
+from uploads import SLOT_TIMEOUT, UploadsBusy, upload_spool
+
+app = Flask(__name__, template_folder='web')
+pages.init_app(app)
+# Uploads past a small threshold are spooled to disk; RMS_MAX_UPLOAD_MB sets the cap (see uploads.py)
+app.config['MAX_CONTENT_LENGTH'] = upload_spool.max_upload_bytes
+app.request_class = upload_spool.request_class(app.request_class)
+
+# Number of items matched by a normalized or fuzzy name, which need checking before the HLX import
+REVIEW_HEADER = 'X-Needs-Review'
+
 
 @app.route('/', methods=['GET', 'POST'])
 def index():
@@ -103,145 +33,121 @@ def index():
         if file.filename == '':
             return "Error: No selected file", 400
         
-        if file and file.filename.endswith(('.xlsx', '.xls')):
+        if file and file.filename.lower().endswith(INPUT_EXTENSIONS):
+            trace = metrics.trace(route='index', file=file.filename, bytes=request.content_length or 0)
             try:
-                df_imported = pd.read_excel(file)
-
-                basis_file_name = 'basis_data.csv' 
-                if not os.path.exists(basis_file_name):
-                    return f"Error: Basis file '{basis_file_name}' not found. Please save 'PosProductDetails-RMS (1).csv' as 'basis_data.csv' in the same folder as 'app.py'.", 500
-                
-                df_basis = pd.read_csv(basis_file_name)
-                
-                df_exported = process_data(df_imported, df_basis)
-                
-                output = io.StringIO()
-                df_exported.to_csv(output, index=False)
-                output.seek(0)
-                output_bytes = io.BytesIO(output.getvalue().encode('utf-8'))
+                brand = request.values.get('brand') or catalog_registry.default_brand
+                if brand not in catalog_registry.brands():
+                    trace.finish('error', error='unknown brand')
+                    return "Error: Unknown brand", 400
+                # format=parquet or format=arrow returns a columnar file instead of the CSV
+                output_format = request.values.get('format') or 'csv'
+                if output_format not in available_formats():
+                    trace.finish('error', error='unsupported output format')
+                    return "Error: Unsupported output format", 400
+                download_name = 'monggoloid' + OUTPUT_FORMATS[output_format][0]
+                catalog, options = catalog_registry.get(brand)
+                if not catalog.exists():
+                    trace.finish('error', error='basis file missing')
+                    return f"Error: Basis file '{catalog.path}' not found. Please save 'PosProductDetails-RMS (1).csv' as 'basis_data.csv' in the same folder as 'app.py'.", 500
+
+                # Re-uploads of the same workbook against the same basis file skip straight to the CSV
+                upload = upload_spool.open(file)
+                digest = upload.digest()
+                version = catalog.version()
+                if options['rules'] is not None:
+                    version = f"{version}:{options['rules'].version}"
+                if output_format != 'csv':
+                    digest = f'{digest}:{output_format}'
+                cached = None if request.values.get('refresh') == '1' else result_cache.get(digest, version, brand)
+                if cached is not None:
+                    # Cached CSVs keep their compression, so hits go out gzip- or deflate-encoded
+                    compression = cached.get('compression')
+                    body = cached['data'] if compression is None else compression['body']
+                    chunks = traced_stream(trace, 'export', iter_bytes(body), cache='hit',
+                                           rows=cached['rows'], unmatched=cached['unmatched'])
+                    response = download_response(chunks, download_name, len(body), compression)
+                    response.headers[REVIEW_HEADER] = str(cached['needs_review'])
+                    return response
+
+                # Large uploads are parsed from their spooled file, a few at a time
+                with upload_spool.slot(SLOT_TIMEOUT):
+                    with trace.stage('read'):
+                        df_imported = read_workbook(upload.source())
+
+                    with trace.stage('catalog'):
+                        catalog_index = catalog.get_index()
+                        matcher = catalog.get_matcher()
+
+                    df_exported, has_uncategorized = process_data(df_imported, catalog_index, matcher,
+                                                                  stage=trace.stage, lean=True, match_details=True,
+                                                                  **options)
+                df_exported, df_review = split_review(df_exported)
                 
-                response = send_file(
-                    output_bytes, 
-                    mimetype='text/csv',
-                    as_attachment=True,
-                    download_name='monggoloid.csv' 
-                )
+                # Stream encoded CSV chunks straight from the processed frame, keeping a copy for the cache.
+                # CSVs are gzip- or deflate-compressed as they stream, and the cache keeps that compression.
+                counts = {'rows': len(df_imported),
+                          'unmatched': unmatched_count(df_exported, options['rules'])}
+                # The review list is cached too, so test.py hits on the same upload can offer it
+                info = {'uncategorized': bool(has_uncategorized), 'needs_review': len(df_review),
+                        'review': b''.join(iter_csv(df_review)) if len(df_review) else None, **counts}
+                encoding = None
+                if output_format == 'csv':
+                    encoding = accepted_encoding()
+
+                    def cache_result(data, compression):
+                        result_cache.put(digest, version, data, brand, compression=compression, **info)
+
+                    chunks = iter_encoded(iter_csv(df_exported), encoding,
+                                          cache_result if result_cache.enabled else None)
+                else:
+                    chunks = result_cache.tee(digest, version, iter_bytes(encode_frame(df_exported, output_format)),
+                                              brand, **info)
+                chunks = traced_stream(trace, 'export', chunks, cache='miss', **counts)
+                response = attachment_response(chunks, download_name)
+                response.headers[REVIEW_HEADER] = str(len(df_review))
+                if output_format == 'csv':
+                    response.content_encoding = encoding
+                    response.vary.add('Accept-Encoding')
                 
                 return response
                 
+            except UploadsBusy as e:
+                trace.finish('error', error=e)
+                return f"Error: {e}. Please try again in a minute.", 503
             except Exception as e:
+                trace.finish('error', error=e)
                 return f"An error occurred during file processing: {e}", 500
 
     success_message = request.args.get('success')
-    
-    html_template = f"""
-    <!doctype html>
-    <title> Branch POS template </title>
-    <style>
-        body {{ font-family: Arial, sans-serif; margin: 50px; background-color: #f4f4f9; color: #333; }}
-        .container {{ background: white; padding: 30px; border-radius: 8px; box-shadow: 0 4px 8px rgba(0,0,0,0.1); max-width: 600px; margin: auto; }}
-        
-        h1 {{ 
-            color: #007bff; 
-            border-bottom: 2px solid #eee; 
-            padding-bottom: 10px; 
-            text-align: center; 
-        }}
-        
-        form {{ display: flex; flex-direction: column; }} 
-        
-        input[type="file"] {{ 
-            border: 1px solid #ccc; 
-            padding: 10px; 
-            border-radius: 4px; 
-            margin-bottom: 20px; 
-        }}
-        
-        button {{ 
-            background-color: #28a745; 
-            color: white; 
-            padding: 12px 20px; 
-            border: none; 
-            border-radius: 4px; 
-            cursor: pointer; 
-            font-size: 16px; 
-            transition: background-color 0.3s; 
-        }}
-        
-        .success-prompt {{
-            background-color: #d4edda;
-            color: #155724;
-            padding: 15px;
-            margin-bottom: 20px;
-            border: 1px solid #c3e6cb;
-            border-radius: 5px;
-            text-align: center;
-            font-weight: bold;
-        }}
-        
-        #success-view {{
-            display: flex;
-            flex-direction: column;
-            align-items: center; 
-        }}
-        .reset-button {{
-            background-color: #007bff; 
-            width: auto; 
-            margin-top: 10px; 
-        }}
-        .reset-button:hover {{
-            background-color: #0056b3; 
-        }}
-        
-        button:hover {{ background-color: #218838; }}
-        .note {{ background-color: #fff3cd; color: #856404; padding: 10px; border: 1px solid #ffeeba; border-radius: 4px; margin-top: 15px; }}
-        
-    </style>
-    <div class="container">
-        <h1>POS Template Generator</h1>
-        
-        <div id="success-view" style="display: {'block' if success_message == 'true' else 'none'};">
-            <div class="success-prompt">
-                ✅ File successfully generated!
-            </div>
-            <button class="reset-button" onclick="window.location.href = window.location.pathname;">
-                Generate New Template
-            </button>
-        </div>
-
-        <form id="upload-form" method="POST" enctype="multipart/form-data" action="/" style="display: {'none' if success_message == 'true' else 'flex'};">
-            <input type="file" name="file" required>
-            
-            <button type="submit">Proceed and Generate New CSV File</button>
-        </form>
-        
-        <div class="note">
-            <strong>Generated template note:</strong> The generated CSV file automatically put values on those required columns for importing POS products in HLX. Please double check generated file and modify columns if needed.
-        </div>
-    </div>
-    <script>
-        const isSuccess = '{{ success_message }}' === 'true';
-
-        document.querySelector('#upload-form').onsubmit = function() {{
-            const fileInput = document.querySelector('input[type="file"]');
-            if (fileInput.files.length > 0) {{
-                document.querySelector('#upload-form button[type="submit"]').disabled = true;
-                
-                setTimeout(() => {{
-                    window.location.href = window.location.pathname + '?success=true';
-                }}, 2000); 
-            }}
-            return true;
-        }};
-
-        if (isSuccess) {{
-            window.scrollTo(0, 0);
-        }}
-    </script>
-    """
-    return render_template_string(html_template)
+    # The template is compiled once (web/app.html); only the success state changes per request
+    return render_template('app.html', success=success_message == 'true')
+
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    """Prometheus scrape endpoint."""
+    return Response(metrics.render(), mimetype=PROMETHEUS_CONTENT_TYPE)
+
+
+@app.route('/healthz', methods=['GET'])
+def healthz():
+    """Liveness probe: the process is up and answering requests."""
+    return jsonify({'status': 'ok', 'pid': os.getpid()})
+
+
+@app.route('/readyz', methods=['GET'])
+def readyz():
+    """Readiness probe: 503 until every brand's basis catalog is in place."""
+    ready, brands = catalog_registry.readiness()
+    return jsonify({'ready': ready, 'brands': brands}), 200 if ready else 503
+
+
+metrics.add_collector(result_cache.gauges)
+metrics.add_collector(catalog_registry.gauges)
+metrics.add_collector(upload_spool.gauges)
 
 # --- Main Execution (Unchanged) ---
 if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
     print("Running Flask app. Open your browser to http://127.0.0.1:5000/")
     app.run(debug=True)
\ No newline at end of file
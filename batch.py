@@ -0,0 +1,268 @@
+import io
+import os
+import tempfile
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+from werkzeug.utils import secure_filename
+
+from delta import process_delta, read_template
+from chunked import process_workbook_chunked
+from export import convert_csv_file, encode_frame, iter_csv, output_filename
+from ingest import INPUT_EXTENSIONS, read_workbook
+from processing import process_data, split_review, unmatched_count
+
+# needs_review counts items matched by a normalized or fuzzy name, listed in <output>_review.csv
+SUMMARY_COLUMNS = ['file', 'output', 'status', 'input_rows', 'rows', 'unmatched', 'needs_review', 'uncategorized',
+                   'error']
+# Limits on what ZIP uploads may unpack to, all archives of one batch together
+MAX_ARCHIVE_MEMBERS = 500
+MAX_ARCHIVE_BYTES = 256 * 1024 * 1024
+ARCHIVE_BLOCK_SIZE = 1024 * 1024
+
+# Catalog index, matcher and process_data options (brand constants, rules)
+# handed to each pool worker once, instead of once per file
+_worker_catalog_index = None
+_worker_matcher = None
+_worker_options = {}
+
+
+def _init_worker(catalog_index, matcher=None, options=None):
+    global _worker_catalog_index, _worker_matcher, _worker_options
+    _worker_catalog_index = catalog_index
+    _worker_matcher = matcher
+    _worker_options = options or {}
+
+
+def generated_filename(filename):
+    """Names the output the same way the upload page does: secure base name + '.csv'."""
+    base_name = os.path.splitext(secure_filename(os.path.basename(filename)))[0]
+    return (base_name or 'template') + '.csv'
+
+
+class ArchiveTooLarge(ValueError):
+    """A ZIP upload unpacks to more files or bytes than collect_workbooks allows."""
+
+
+def review_filename(filename):
+    """Name of the review list that goes with a generated template, e.g. Branch_A_review.csv."""
+    return os.path.splitext(filename)[0] + '_review.csv'
+
+
+def collect_workbooks(uploads, max_members=MAX_ARCHIVE_MEMBERS, max_bytes=MAX_ARCHIVE_BYTES, spool=None):
+    """Expands (filename, source) uploads into workbooks (or CSV/Parquet files), unpacking any ZIP archives.
+
+    A source is bytes, a path or a binary file object, and so is each
+    workbook's. ZIP members are read into memory, or written to spool (an
+    uploads.UploadSpool) when one is given and passed on as paths. The
+    archives may hold at most max_members workbooks and max_bytes once
+    unpacked, all of them together. Sizes are counted as members are read, not
+    taken from the ZIP headers, and ArchiveTooLarge is raised as soon as either
+    limit is passed, so a small ZIP cannot unpack to gigabytes.
+    """
+    workbooks = []
+    unpacked = {'members': 0, 'bytes': 0}
+    for filename, data in uploads:
+        if filename.lower().endswith('.zip'):
+            with zipfile.ZipFile(_source(data)) as archive:
+                for member in archive.infolist():
+                    member_name = os.path.basename(member.filename)
+                    if member.is_dir() or member.filename.startswith('__MACOSX/'):
+                        continue
+                    if member_name.lower().endswith(INPUT_EXTENSIONS):
+                        unpacked['members'] += 1
+                        if unpacked['members'] > max_members:
+                            raise ArchiveTooLarge(f'ZIP archives may hold at most {max_members} workbooks')
+                        blocks = _member_blocks(archive, member, unpacked, max_bytes)
+                        if spool is None:
+                            workbooks.append((member_name, b''.join(blocks)))
+                        else:
+                            workbooks.append((member_name, spool.store(member_name, blocks).path))
+        elif filename.lower().endswith(INPUT_EXTENSIONS):
+            workbooks.append((filename, data))
+    return workbooks
+
+
+def _source(data):
+    """What zipfile and read_workbook take for a source: bytes get wrapped in a buffer."""
+    return io.BytesIO(data) if isinstance(data, bytes) else data
+
+
+def _member_blocks(archive, member, unpacked, max_bytes):
+    """Yields a ZIP member's bytes block by block, adding them to unpacked['bytes'] against max_bytes."""
+    too_large = ArchiveTooLarge(f'ZIP archives may unpack to at most {max_bytes / (1024 * 1024):g} MB')
+    # The declared size turns most oversized archives away before anything is inflated
+    if unpacked['bytes'] + member.file_size > max_bytes:
+        raise too_large
+    with archive.open(member) as stream:
+        for block in iter(lambda: stream.read(ARCHIVE_BLOCK_SIZE), b''):
+            unpacked['bytes'] += len(block)
+            if unpacked['bytes'] > max_bytes:
+                raise too_large
+            yield block
+
+
+def _new_status(filename):
+    return {'file': filename, 'output': generated_filename(filename), 'status': 'ok',
+            'input_rows': 0, 'rows': 0, 'unmatched': 0, 'needs_review': 0, 'uncategorized': False, 'error': ''}
+
+
+def _process(df_imported, status):
+    # Returns (template, review) frames; see processing.split_review
+    df_exported, has_uncategorized = process_data(df_imported, _worker_catalog_index, _worker_matcher, lean=True,
+                                                  match_details=True, branch=_branch(status['file']),
+                                                  **_worker_options)
+    df_exported, df_review = split_review(df_exported)
+    status['input_rows'] = len(df_imported)
+    status['rows'] = len(df_exported)
+    status['unmatched'] = unmatched_count(df_exported, _worker_options.get('rules'))
+    status['needs_review'] = len(df_review)
+    status['uncategorized'] = bool(has_uncategorized)
+    return df_exported, df_review
+
+
+def _branch(filename):
+    # Branch name that rule conditions match, e.g. 'Branch_A' for 'Branch A.xlsx'
+    return os.path.splitext(generated_filename(filename))[0]
+
+
+def _fail(status, error):
+    status['status'] = 'error'
+    status['output'] = ''
+    status['error'] = str(error)
+
+
+def process_workbook(filename, data):
+    """Runs process_data on a single workbook (bytes, a path or a file object).
+
+    Returns (status, csv bytes, review csv bytes); the review is None when
+    every item matched exactly or not at all.
+    """
+    status = _new_status(filename)
+    try:
+        df_exported, df_review = _process(read_workbook(_source(data)), status)
+        review_data = b''.join(iter_csv(df_review)) if len(df_review) else None
+        return status, b''.join(iter_csv(df_exported)), review_data
+    except Exception as e:
+        _fail(status, e)
+        return status, None, None
+
+
+def process_workbook_file(path, output_path, previous_path=None, extra_formats=(), memory_budget=None):
+    """Runs process_data on a workbook on disk and streams its CSV to output_path.
+
+    With previous_path (an earlier template for the same branch) only the
+    added, re-priced and removed items are written; see delta.process_delta.
+    Each of extra_formats ('parquet', 'arrow') is written next to the CSV.
+    With a memory_budget (bytes) full templates go through chunked.py instead
+    and never hold the whole workbook in memory. Items matched by a normalized
+    or fuzzy name are listed in review_filename(output_path).
+    """
+    status = _new_status(os.path.basename(path))
+    status['output'] = os.path.basename(output_path)
+    if memory_budget is not None and previous_path is None:
+        return _process_file_chunked(path, output_path, extra_formats, memory_budget, status)
+    try:
+        with open(path, 'rb') as file:
+            df_imported = read_workbook(file)
+        if previous_path is None:
+            df_exported, df_review = _process(df_imported, status)
+        else:
+            df_exported, has_uncategorized = process_delta(df_imported, read_template(previous_path),
+                                                           _worker_catalog_index, _worker_matcher,
+                                                           branch=_branch(status['file']), match_details=True,
+                                                           **_worker_options)
+            df_exported, df_review = split_review(df_exported)
+            added = df_exported[df_exported['Change'] == 'added']
+            status['input_rows'] = len(df_imported)
+            status['rows'] = len(df_exported)
+            status['unmatched'] = unmatched_count(added, _worker_options.get('rules'))
+            status['needs_review'] = len(df_review)
+            status['uncategorized'] = has_uncategorized
+        with open(output_path, 'wb') as output:
+            for chunk in iter_csv(df_exported):
+                output.write(chunk)
+        if len(df_review):
+            with open(review_filename(output_path), 'wb') as output:
+                for chunk in iter_csv(df_review):
+                    output.write(chunk)
+        for output_format in extra_formats:
+            with open(output_filename(output_path, output_format), 'wb') as output:
+                output.write(encode_frame(df_exported, output_format))
+    except Exception as e:
+        _fail(status, e)
+    return status
+
+
+def _process_file_chunked(path, output_path, extra_formats, memory_budget, status):
+    review_path = review_filename(output_path)
+    try:
+        with open(path, 'rb') as file, open(output_path, 'wb') as output, open(review_path, 'wb') as review:
+            stats = process_workbook_chunked(file, output, _worker_catalog_index, _worker_matcher, memory_budget,
+                                             review=review, branch=_branch(status['file']), **_worker_options)
+        if not stats['needs_review']:
+            os.remove(review_path)
+        for key in ('input_rows', 'rows', 'unmatched', 'needs_review', 'uncategorized'):
+            status[key] = stats[key]
+        for output_format in extra_formats:
+            convert_csv_file(output_path, output_filename(output_path, output_format), output_format)
+    except Exception as e:
+        _fail(status, e)
+    return status
+
+
+def unique_output_names(names):
+    """Suffixes repeated output names (_2, _3, ...) so two branches never overwrite each other."""
+    used_names = set()
+    unique_names = []
+    for name in names:
+        unique_name, suffix = name, 2
+        while unique_name in used_names:
+            unique_name = f"{os.path.splitext(name)[0]}_{suffix}.csv"
+            suffix += 1
+        used_names.add(unique_name)
+        unique_names.append(unique_name)
+    return unique_names
+
+
+def run_pool(task, task_args, catalog_index, matcher=None, max_workers=None, options=None):
+    """Runs task(*args) for every args tuple on a process pool spread across all cores.
+
+    The catalog index and matcher are loaded into each worker once by the pool
+    initializer, not shipped with every task.
+    """
+    if not task_args:
+        return []
+    max_workers = min(len(task_args), max_workers or os.cpu_count() or 1)
+    with ProcessPoolExecutor(max_workers=max_workers, initializer=_init_worker,
+                             initargs=(catalog_index, matcher, options)) as pool:
+        futures = [pool.submit(task, *args) for args in task_args]
+        return [future.result() for future in futures]
+
+
+def run_batch(workbooks, catalog_index, matcher=None, max_workers=None, options=None):
+    """Processes every (filename, source) workbook from collect_workbooks.
+
+    Returns [(status, csv bytes, review csv bytes)], as process_workbook does.
+    """
+    return run_pool(process_workbook, workbooks, catalog_index, matcher, max_workers, options)
+
+
+def write_batch_zip(results):
+    """Packs every generated CSV, its review list if any, and a summary.csv into a spooled ZIP file."""
+    output = tempfile.SpooledTemporaryFile(max_size=8 * 1024 * 1024)
+    succeeded = [result for result in results if result[1] is not None]
+    # Two branches can share a base name; keep both instead of overwriting
+    names = unique_output_names([status['output'] for status, _, _ in succeeded])
+    with zipfile.ZipFile(output, 'w', compression=zipfile.ZIP_DEFLATED) as archive:
+        for name, (status, csv_data, review_data) in zip(names, succeeded):
+            status['output'] = name
+            archive.writestr(name, csv_data)
+            if review_data is not None:
+                archive.writestr(review_filename(name), review_data)
+
+        summary = pd.DataFrame([status for status, _, _ in results], columns=SUMMARY_COLUMNS)
+        archive.writestr('summary.csv', summary.to_csv(index=False))
+    output.seek(0)
+    return output
@@ -0,0 +1,308 @@
+"""Benchmarks for process_data and the upload route.
+
+Generates synthetic basis catalogs and branch workbooks, times every pipeline
+stage with its peak traced memory, runs the upload -> /download flow through
+Flask's test client, and compares the results with a saved baseline:
+
+    python bench.py --sizes 1000 10000 --output bench_results.json
+    python bench.py --sizes 1000 10000 --baseline bench_results.json
+
+With --rules, the pipeline runs with that rule file and each size also times
+RuleSet.evaluate against the plain tax divide it replaces:
+
+    python bench.py --sizes 1000000 --rules rules.example.json --no-e2e
+"""
+import argparse
+import io
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+import numpy as np
+import pandas as pd
+
+from catalog import BasisCatalog, build_index
+from export import iter_csv
+from ingest import read_workbook
+from matching import MatchIndex
+from processing import process_data, unmatched_count
+from rules import load_rules
+
+CATEGORIES = ['Ala Carte', 'Beverages', 'Savers Meal', 'Breakfast', 'Desserts', 'Add Ons']
+WORDS = [
+    'Crispy', 'Grilled', 'Fried', 'Spicy', 'Garlic', 'Pork', 'Chicken', 'Beef', 'Bangus',
+    'Sisig', 'Adobo', 'Lechon', 'Kawali', 'Liempo', 'Tocino', 'Rice', 'Noodle', 'Soup',
+    'Iced Tea', 'Mango', 'Cheese', 'Burger', 'Spaghetti', 'Family', 'Solo', 'Combo',
+]
+# Ratio above which a stage counts as a regression against the baseline
+REGRESSION_THRESHOLD = 1.25
+# Stages that got slower by less than this many seconds are treated as noise
+NOISE_FLOOR_SECONDS = 0.01
+
+
+# --- Synthetic Data ---
+
+def generate_catalog(rows, seed=0):
+    """Returns a basis catalog in the basis_data.csv layout."""
+    rng = np.random.default_rng(seed)
+    words = rng.choice(WORDS, size=(rows, 3))
+    names = [f'{a} {b} {c} {i}' for i, (a, b, c) in enumerate(words)]
+    return pd.DataFrame({
+        'Product Id': [f'SOGO{i:07d}' for i in range(1, rows + 1)],
+        'Pos Product Name': names,
+        'Pos Categories': rng.choice(CATEGORIES, size=rows),
+        'Price': rng.integers(20, 900, size=rows),
+    })
+
+
+def generate_branch(rows, df_catalog, duplicate_rate=0.05, unmatched_rate=0.1,
+                    extra_columns=10, seed=0):
+    """Returns a branch export with tunable duplicate and unmatched-item rates."""
+    rng = np.random.default_rng(seed + 1)
+    unique_rows = max(1, int(rows * (1 - duplicate_rate)))
+    names = rng.choice(df_catalog['Pos Product Name'].to_numpy(), size=unique_rows)
+    unmatched = rng.random(unique_rows) < unmatched_rate
+    names = np.where(unmatched, [f'Unlisted Item {i}' for i in range(unique_rows)], names)
+    # Pad up to `rows` by repeating earlier items, the way POS exports repeat menu lines
+    names = np.concatenate([names, rng.choice(names, size=rows - unique_rows)])
+    df = pd.DataFrame({
+        'Item Name': names,
+        'Category Name': rng.choice(CATEGORIES, size=rows),
+        'Rate': rng.integers(20, 900, size=rows),
+    })
+    for i in range(extra_columns):
+        df[f'Extra Column {i}'] = rng.integers(0, 1000, size=rows)
+    return df
+
+
+def prepare_inputs(rows, catalog_rows, args):
+    """Writes (or reuses) the generated catalog CSV and branch workbook for one size."""
+    os.makedirs(args.workdir, exist_ok=True)
+    tag = f'{rows}_{catalog_rows}_{args.duplicate_rate}_{args.unmatched_rate}_{args.seed}'
+    catalog_path = os.path.join(args.workdir, f'catalog_{catalog_rows}_{args.seed}.csv')
+    workbook_path = os.path.join(args.workdir, f'branch_{tag}.xlsx')
+
+    if not os.path.exists(catalog_path):
+        generate_catalog(catalog_rows, args.seed).to_csv(catalog_path, index=False)
+    if not os.path.exists(workbook_path):
+        df_catalog = pd.read_csv(catalog_path)
+        df_branch = generate_branch(rows, df_catalog, args.duplicate_rate, args.unmatched_rate,
+                                    seed=args.seed)
+        df_branch.to_excel(workbook_path, index=False)
+    return catalog_path, workbook_path
+
+
+# --- Measurement ---
+
+class StageRecorder:
+    """Records wall time, or peak traced memory, for each named stage.
+
+    tracemalloc slows pure-Python code (openpyxl especially) several times over,
+    so timings and memory peaks are taken on separate passes.
+    """
+
+    def __init__(self, trace_memory=False):
+        self.trace_memory = trace_memory
+        self.stages = {}
+
+    @contextmanager
+    def __call__(self, name):
+        if self.trace_memory:
+            tracemalloc.reset_peak()
+            baseline, _ = tracemalloc.get_traced_memory()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            if self.trace_memory:
+                _, peak = tracemalloc.get_traced_memory()
+                self.stages[name] = round(max(peak - baseline, 0) / 2 ** 20, 3)
+            else:
+                self.stages[name] = round(elapsed, 6)
+
+
+def run_pipeline(catalog_path, workbook_path, fuzzy, lean, recorder, rules=None, branch=None):
+    with recorder('catalog'):
+        catalog_index = build_index(pd.read_csv(catalog_path))
+        matcher = MatchIndex(catalog_index) if fuzzy else None
+    with open(workbook_path, 'rb') as file, recorder('read'):
+        df_imported = read_workbook(file)
+    df_exported, _ = process_data(df_imported, catalog_index, matcher, stage=recorder, lean=lean,
+                                  rules=rules, branch=branch)
+    with recorder('export'):
+        csv_bytes = sum(len(chunk) for chunk in iter_csv(df_exported))
+    unmatched = unmatched_count(df_exported, rules)
+    return {'output_rows': len(df_exported), 'unmatched': unmatched, 'csv_bytes': csv_bytes}
+
+
+def bench_pipeline(catalog_path, workbook_path, fuzzy, lean, repeat, rules=None, branch=None):
+    """Returns per-stage {'seconds' (best of `repeat`), 'peak_mb'} plus output counts."""
+    timings = []
+    for _ in range(repeat):
+        recorder = StageRecorder()
+        counts = run_pipeline(catalog_path, workbook_path, fuzzy, lean, recorder, rules, branch)
+        timings.append(recorder.stages)
+
+    memory = StageRecorder(trace_memory=True)
+    tracemalloc.start()
+    try:
+        run_pipeline(catalog_path, workbook_path, fuzzy, lean, memory, rules, branch)
+    finally:
+        tracemalloc.stop()
+
+    stages = {
+        name: {'seconds': min(run[name] for run in timings), 'peak_mb': memory.stages[name]}
+        for name in timings[0]
+    }
+    return stages, counts
+
+
+def bench_rules(rows, rules, branch, repeat, seed=0):
+    """Times RuleSet.evaluate against the fixed divide-and-round it replaces, on `rows` rows."""
+    rng = np.random.default_rng(seed)
+    gross = pd.Series(rng.integers(20, 900, size=rows).astype('float64'))
+    categories = pd.Series(rng.choice(CATEGORIES + ['UNCATEGORIZED'], size=rows), dtype=object)
+
+    def best(func):
+        seconds = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            func()
+            seconds.append(time.perf_counter() - start)
+        return round(min(seconds), 6)
+
+    # The catalog join hands rules coded categories; object input pays for the coding itself
+    coded = categories.astype('category')
+
+    divide = best(lambda: (gross / 1.12).round(2))
+    evaluate = best(lambda: rules.evaluate(gross, coded, branch))
+    evaluate_object = best(lambda: rules.evaluate(gross, categories, branch))
+    return {
+        'divide': {'seconds': divide},
+        'rules': {'seconds': evaluate},
+        'rules_object_categories': {'seconds': evaluate_object},
+        'ratio': round(evaluate / divide, 2) if divide else None,
+    }
+
+
+def bench_end_to_end(catalog_path, workbook_path):
+    """Runs upload -> redirect -> /download through the Flask test client."""
+    import test as web
+
+    # A catalog of its own, so it looks for catalog_path's snapshot rather than basis_data's
+    web.catalog_registry.add(web.catalog_registry.default_brand, BasisCatalog(catalog_path))
+    with open(workbook_path, 'rb') as file:
+        data = file.read()
+
+    client = web.app.test_client()
+    start = time.perf_counter()
+    response = client.post('/', data={'file': (io.BytesIO(data), 'branch.xlsx')},
+                           content_type='multipart/form-data')
+    upload_seconds = time.perf_counter() - start
+    if response.status_code != 302:
+        raise RuntimeError(f'Upload failed ({response.status_code}): {response.get_data(as_text=True)}')
+    download = client.get('/download')
+    total_seconds = time.perf_counter() - start
+    return {
+        'upload': {'seconds': round(upload_seconds, 6)},
+        'upload_and_download': {'seconds': round(total_seconds, 6)},
+        'download_bytes': len(download.data),
+    }
+
+
+# --- Baseline Comparison ---
+
+def compare(results, baseline, threshold=REGRESSION_THRESHOLD, noise_floor=NOISE_FLOOR_SECONDS):
+    """Returns (size, stage, baseline seconds, current seconds, ratio) for every regression."""
+    regressions = []
+    baseline_runs = {run['rows']: run for run in baseline['runs']}
+    for run in results['runs']:
+        previous = baseline_runs.get(run['rows'])
+        if previous is None:
+            continue
+        for section in ('stages', 'end_to_end', 'rules'):
+            for name, current in run.get(section, {}).items():
+                before = previous.get(section, {}).get(name)
+                if not isinstance(current, dict) or not isinstance(before, dict):
+                    continue
+                if before['seconds'] > 0:
+                    ratio = current['seconds'] / before['seconds']
+                    print(f"  {run['rows']:>9} {name:<20} {before['seconds']:>9.4f}s -> "
+                          f"{current['seconds']:>9.4f}s  x{ratio:.2f}")
+                    if ratio > threshold and current['seconds'] - before['seconds'] > noise_floor:
+                        regressions.append((run['rows'], name, before['seconds'], current['seconds'], ratio))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000],
+                        help='branch workbook row counts (1k to 1M)')
+    parser.add_argument('--catalog-rows', type=int, default=None,
+                        help='basis catalog rows (default: same as each size)')
+    parser.add_argument('--duplicate-rate', type=float, default=0.05)
+    parser.add_argument('--unmatched-rate', type=float, default=0.1)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--repeat', type=int, default=3, help='timing passes per size (best is kept)')
+    parser.add_argument('--exact-only', action='store_true', help='skip the fuzzy matcher')
+    parser.add_argument('--lean', action='store_true', help='use the low-copy process_data pipeline')
+    parser.add_argument('--no-e2e', action='store_true', help='skip the Flask end-to-end run')
+    parser.add_argument('--rules', help='rule file to run the pipeline with and benchmark')
+    parser.add_argument('--branch', default='Branch_A', help='branch name the rules are evaluated for')
+    parser.add_argument('--workdir', default='bench_data', help='where generated inputs are cached')
+    parser.add_argument('--output', default='bench_results.json')
+    parser.add_argument('--baseline', help='results JSON to compare against')
+    parser.add_argument('--threshold', type=float, default=REGRESSION_THRESHOLD)
+    args = parser.parse_args(argv)
+
+    results = {
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': sys.version.split()[0],
+        'pandas': pd.__version__,
+        'machine': platform.machine(),
+        'cpus': os.cpu_count(),
+        'settings': {key: value for key, value in vars(args).items() if key not in ('output', 'baseline')},
+        'runs': [],
+    }
+    rules = load_rules(args.rules) if args.rules else None
+    for rows in args.sizes:
+        catalog_rows = args.catalog_rows or rows
+        catalog_path, workbook_path = prepare_inputs(rows, catalog_rows, args)
+        stages, counts = bench_pipeline(catalog_path, workbook_path, not args.exact_only, args.lean,
+                                        args.repeat, rules, args.branch)
+        run = {'rows': rows, 'catalog_rows': catalog_rows, 'stages': stages, **counts}
+        if rules is not None:
+            run['rules'] = bench_rules(rows, rules, args.branch, args.repeat, args.seed)
+        if not args.no_e2e:
+            run['end_to_end'] = bench_end_to_end(catalog_path, workbook_path)
+        results['runs'].append(run)
+
+        summary = ', '.join(f"{name} {stage['seconds']:.3f}s/{stage['peak_mb']:.1f}MB"
+                            for name, stage in stages.items())
+        print(f'{rows:>9} rows: {summary}')
+        if rules is not None:
+            print(f"{'':>9}       rules {run['rules']['rules']['seconds']:.4f}s vs divide "
+                  f"{run['rules']['divide']['seconds']:.4f}s (x{run['rules']['ratio']})")
+
+    with open(args.output, 'w') as file:
+        json.dump(results, file, indent=2)
+    print(f'Results written to {args.output}')
+
+    if args.baseline:
+        with open(args.baseline) as file:
+            baseline = json.load(file)
+        print(f'Comparison against {args.baseline}:')
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print(f'{len(regressions)} stage(s) slower than x{args.threshold:.2f} of the baseline')
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
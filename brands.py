@@ -0,0 +1,188 @@
+"""Basis catalogs per brand, selected per upload.
+
+Without RMS_BRANDS the registry holds one brand, 'rms', backed by
+basis_data.csv (or RMS_CATALOG_DB). RMS_BRANDS names a JSON file such as
+
+    {
+        "rms": {"basis": "basis_data.csv", "pos_point": "RMS"},
+        "sogo": {"basis": "catalogs/sogo.db", "pos_point": "SOGO", "rules": "sogo_rules.json"}
+    }
+
+where the first brand is the default, pos_point fills the template's
+'Pos Point Short Name' and rules names a pricing rule file (see rules.py),
+recompiled whenever the file changes.
+A pos_point wins over the rule file's "columns"; without one, the rule file
+or the 'RMS' default applies.
+RMS_RULES sets the rule file of the single default brand.
+"""
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from catalog import basis_catalog, open_catalog
+from rules import RuleFile
+
+DEFAULT_BRAND = 'rms'
+
+logger = logging.getLogger('rms.catalog')
+
+
+class CatalogRegistry:
+    """Lazily loaded catalogs per brand, kept in memory within a byte budget.
+
+    A brand's index and matcher are built on its first upload. Whenever a
+    catalog finishes loading, the least recently used other catalogs are
+    unloaded until the loaded total fits memory_budget again; they reload on
+    their next upload.
+    """
+
+    def __init__(self, memory_budget=512 * 1024 * 1024):
+        self.memory_budget = memory_budget
+        self.default_brand = None
+        self._brands = OrderedDict()
+        self._lock = threading.Lock()
+        self.evictions = 0
+        # brand -> seconds the last warm() took to make its catalog ready
+        self.warm_seconds = {}
+
+    def add(self, brand, catalog, pos_point=None, rules=None):
+        """Registers a brand; rules is a rules.RuleFile or None."""
+        catalog.on_load = self._loaded
+        # Without a pos_point the rule file's columns, then CONSTANT_COLUMNS ('RMS'), decide
+        constants = {'Pos Point Short Name': pos_point} if pos_point is not None else {}
+        with self._lock:
+            self._brands[brand] = {'catalog': catalog, 'constants': constants, 'rules': rules}
+            if self.default_brand is None:
+                self.default_brand = brand
+
+    def brands(self):
+        with self._lock:
+            return sorted(self._brands)
+
+    def get(self, brand=None):
+        """Returns (catalog, process_data keyword options) for a brand; raises KeyError for unknown ones.
+
+        options['rules'] is the brand's RuleSet as its file is now, or None.
+        """
+        brand = brand or self.default_brand
+        with self._lock:
+            entry = self._brands[brand]
+            self._brands.move_to_end(brand)
+        rules = entry['rules'].get() if entry['rules'] is not None else None
+        return entry['catalog'], {'constants': entry['constants'], 'rules': rules}
+
+    def files(self, brand):
+        """The brand's catalog and, if it has one, its RuleFile: what serve.py pins and watches."""
+        with self._lock:
+            entry = self._brands[brand]
+        return [entry['catalog']] + ([entry['rules']] if entry['rules'] is not None else [])
+
+    def warm(self):
+        """Loads every brand's index and matcher now, so no upload waits for them.
+
+        One match also builds the hash tables pandas creates lazily, and rule files
+        are compiled. Brands whose catalog file is missing are skipped. Returns
+        the total seconds.
+        """
+        total = 0.0
+        for brand in self.brands():
+            catalog, _ = self.get(brand)
+            if not catalog.exists():
+                logger.warning('Basis catalog of brand %s not found at %s', brand, catalog.path)
+                continue
+            start = time.perf_counter()
+            catalog.get_matcher().match(['warm-up'])
+            seconds = time.perf_counter() - start
+            self.warm_seconds[brand] = seconds
+            total += seconds
+            logger.info('Catalog of brand %s ready in %.2fs (from %s, version %s)', brand, seconds,
+                        catalog.stats()['source'], catalog.version())
+        return total
+
+    def _loaded(self, catalog):
+        with self._lock:
+            loaded = [entry['catalog'] for entry in self._brands.values()]
+        total = sum(other.memory_bytes() for other in loaded)
+        # Oldest first; the catalog that just loaded is never the one evicted
+        for other in loaded:
+            if total <= self.memory_budget:
+                break
+            size = other.memory_bytes()
+            if other is catalog or size == 0:
+                continue
+            other.unload()
+            total -= size
+            with self._lock:
+                self.evictions += 1
+
+    def stats(self):
+        with self._lock:
+            entries = list(self._brands.items())
+        return {brand: entry['catalog'].stats() for brand, entry in entries}
+
+    def readiness(self):
+        """(ready, details per brand) for readiness probes: ready once every brand's catalog file exists."""
+        with self._lock:
+            entries = list(self._brands.items())
+        details = {}
+        for brand, entry in entries:
+            catalog = entry['catalog']
+            exists = catalog.exists()
+            stats = catalog.stats()
+            details[brand] = {
+                'exists': exists,
+                'loaded': stats['loaded'],
+                'source': stats['source'],
+                'version': catalog.version() if exists else None,
+            }
+        return all(brand['exists'] for brand in details.values()), details
+
+    def gauges(self):
+        """metrics collector with per-brand load time and memory."""
+        gauges = {'rms_catalog_evictions': ('Catalogs unloaded to stay within the memory budget.', self.evictions)}
+        for brand, stats in self.stats().items():
+            label = f'{{brand="{brand}"}}'
+            gauges[f'rms_catalog_loaded{label}'] = ('1 if the brand catalog is in memory.', int(stats['loaded']))
+            gauges[f'rms_catalog_memory_bytes{label}'] = ('Approximate bytes held per brand catalog.',
+                                                          stats['memory_bytes'])
+            gauges[f'rms_catalog_load_seconds{label}'] = ('Duration of the last catalog index load.',
+                                                          round(stats['load_seconds'], 6))
+            gauges[f'rms_catalog_matcher_seconds{label}'] = ('Duration of the last matcher build.',
+                                                             round(stats['matcher_seconds'], 6))
+            gauges[f'rms_catalog_loads{label}'] = ('Times the catalog index was (re)loaded.', stats['loads'])
+            gauges[f'rms_catalog_from_snapshot{label}'] = ('1 if the loaded catalog came from its compiled snapshot.',
+                                                           int(stats['source'] == 'snapshot'))
+            if brand in self.warm_seconds:
+                gauges[f'rms_catalog_warm_seconds{label}'] = ('Time the startup warm-up took to make the catalog ready.',
+                                                              round(self.warm_seconds[brand], 6))
+        return gauges
+
+
+def _rule_file(path):
+    rule_file = RuleFile(path)
+    # Compiled now, so a broken rule file still stops the app from starting
+    rule_file.get()
+    return rule_file
+
+
+def load_registry(config_path=None, memory_budget=512 * 1024 * 1024, rules_path=None):
+    """Builds the registry from a brands JSON file, or the single default brand."""
+    registry = CatalogRegistry(memory_budget)
+    if not config_path:
+        registry.add(DEFAULT_BRAND, basis_catalog, rules=_rule_file(rules_path) if rules_path else None)
+        return registry
+    with open(config_path) as file:
+        brands = json.load(file)
+    for brand, settings in brands.items():
+        rules = _rule_file(settings['rules']) if settings.get('rules') else None
+        registry.add(brand, open_catalog(settings['basis']), settings.get('pos_point'), rules)
+    return registry
+
+
+# Shared instance used by the web apps; RMS_CATALOG_BUDGET_MB bounds loaded catalogs
+catalog_registry = load_registry(os.environ.get('RMS_BRANDS'),
+                                 int(os.environ.get('RMS_CATALOG_BUDGET_MB', '512')) * 1024 * 1024,
+                                 os.environ.get('RMS_RULES'))
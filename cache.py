@@ -0,0 +1,135 @@
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+
+
+class ResultCache:
+    """Generated CSVs keyed by a hash of the uploaded bytes and the basis catalog version.
+
+    Re-uploading the same workbook returns the stored CSV without parsing or
+    matching again. Entries are evicted LRU-first once max_bytes is exceeded.
+    Each scope (one per brand catalog) tracks its own version, and a scope's
+    entries are dropped as soon as a lookup sees a new version of its catalog.
+    With enabled=False every lookup misses and nothing is stored. An entry's
+    'compression' (export.compress of its data) is kept and counted with it.
+    """
+
+    def __init__(self, max_bytes=128 * 1024 * 1024, enabled=True):
+        self.max_bytes = max_bytes
+        self.enabled = enabled
+        self._entries = OrderedDict()
+        self._bytes_used = 0
+        self._versions = {}
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    @staticmethod
+    def digest(data):
+        return hashlib.blake2b(data, digest_size=20).hexdigest()
+
+    def get(self, digest, version, scope=None):
+        """Returns {'data', 'rows', 'unmatched', 'uncategorized'} (plus any other info put) or None."""
+        if not self.enabled:
+            return None
+        key = (scope, digest, version)
+        with self._lock:
+            self._check_version_locked(scope, version)
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self, digest, version, data, scope=None, **info):
+        if not self.enabled or len(data) > self.max_bytes:
+            return
+        key = (scope, digest, version)
+        with self._lock:
+            self._check_version_locked(scope, version)
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._bytes_used -= _entry_bytes(previous)
+            entry = {'data': data, **info}
+            self._entries[key] = entry
+            self._bytes_used += _entry_bytes(entry)
+            while self._bytes_used > self.max_bytes:
+                _, entry = self._entries.popitem(last=False)
+                self._bytes_used -= _entry_bytes(entry)
+                self.evictions += 1
+
+    def tee(self, digest, version, chunks, scope=None, **info):
+        """Passes streamed chunks through and caches the whole body once it has been sent."""
+        if not self.enabled:
+            yield from chunks
+            return
+        parts = []
+        for chunk in chunks:
+            parts.append(chunk)
+            yield chunk
+        self.put(digest, version, b''.join(parts), scope, **info)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes_used = 0
+            self._versions.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'bytes': self._bytes_used,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': self.hits / lookups if lookups else 0.0,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations,
+            }
+
+    def gauges(self):
+        """metrics collector for the cache counters."""
+        stats = self.stats()
+        return {
+            'rms_result_cache_entries': ('Generated CSVs held by the result cache.', stats['entries']),
+            'rms_result_cache_bytes': ('Bytes held by the result cache.', stats['bytes']),
+            'rms_result_cache_hits': ('Uploads answered from the result cache.', stats['hits']),
+            'rms_result_cache_misses': ('Uploads that had to be processed.', stats['misses']),
+            'rms_result_cache_hit_ratio': ('Hits over lookups since start.', round(stats['hit_ratio'], 4)),
+            'rms_result_cache_evictions': ('Entries dropped to stay under the size limit.', stats['evictions']),
+            'rms_result_cache_invalidations': ('Times the cache was dropped for a new basis catalog.',
+                                               stats['invalidations']),
+        }
+
+    def _check_version_locked(self, scope, version):
+        # Results made against an older basis catalog are never served again
+        if self._versions.get(scope, version) == version:
+            self._versions[scope] = version
+            return
+        self._versions[scope] = version
+        stale = [key for key in self._entries if key[0] == scope]
+        if stale:
+            self.invalidations += 1
+        for key in stale:
+            self._bytes_used -= _entry_bytes(self._entries.pop(key))
+
+
+def _entry_bytes(entry):
+    compression = entry.get('compression')
+    return (len(entry['data']) + (len(compression['body']) if compression else 0)
+            + len(entry.get('review') or b''))
+
+
+# Shared instance used by the web apps. RMS_RESULT_CACHE=0 bypasses it;
+# RMS_RESULT_CACHE_MB sets the size limit.
+result_cache = ResultCache(
+    max_bytes=int(os.environ.get('RMS_RESULT_CACHE_MB', '128')) * 1024 * 1024,
+    enabled=os.environ.get('RMS_RESULT_CACHE', '1') != '0',
+)
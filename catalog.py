@@ -0,0 +1,180 @@
+import logging
+import os
+import threading
+import time
+
+import pandas as pd
+
+from catalog_db import SQLiteCatalog
+from catalog_snapshot import open_snapshot, snapshot_path_for
+from matching import MatchIndex
+
+BASIS_FILE_NAME = 'basis_data.csv'
+
+logger = logging.getLogger('rms.catalog')
+
+
+def build_index(df_basis):
+    """Builds the deduplicated name -> (Product Id, Pos Categories) lookup index."""
+    df_index = df_basis[['Pos Product Name', 'Product Id', 'Pos Categories']]
+    df_index = df_index.dropna(subset=['Pos Product Name'])
+    df_index = df_index.drop_duplicates(subset=['Pos Product Name'], keep='first')
+    return df_index.set_index('Pos Product Name')
+
+
+class BasisCatalog:
+    """Keeps the basis catalog in memory and reloads it only when the file changes.
+
+    The index and matcher come from the compiled snapshot next to the CSV (see
+    catalog_snapshot.py) while it is current, and from the CSV otherwise.
+    """
+
+    def __init__(self, path=BASIS_FILE_NAME, on_load=None, snapshot_path=None):
+        self.path = path
+        self.snapshot_path = snapshot_path or snapshot_path_for(path)
+        # Called with this catalog after the index or matcher is (re)built
+        self.on_load = on_load
+        # A pinned catalog keeps serving what it loaded, even after the file
+        # changes; serve.py pins catalogs in its workers and replaces them instead
+        self.pinned = False
+        self._lock = threading.Lock()
+        # (file signature, lookup index) is swapped as one tuple so readers
+        # never see an index from one file version with the signature of another.
+        self._state = (None, None)
+        self._matcher_state = (None, None)
+        # (index, snapshot) while the matcher tables of a snapshot-loaded index are still to be used
+        self._snapshot_state = (None, None)
+        # 'snapshot' or 'csv': where the loaded index came from
+        self.source = None
+        self.loads = 0
+        self.load_seconds = 0.0
+        self.matcher_seconds = 0.0
+        self._index_bytes = 0
+        self._matcher_bytes = 0
+
+    def _file_signature(self):
+        stat = os.stat(self.path)
+        try:
+            snapshot_mtime_ns = os.stat(self.snapshot_path).st_mtime_ns
+        except FileNotFoundError:
+            snapshot_mtime_ns = None
+        # A recompiled snapshot triggers a reload too, but version() covers the CSV alone
+        return (stat.st_mtime_ns, stat.st_size, snapshot_mtime_ns)
+
+    def exists(self):
+        return os.path.exists(self.path)
+
+    def _load(self):
+        # Returns (file signature, lookup index), reloading if the file changed
+        state = self._state
+        if self.pinned and state[1] is not None:
+            return state
+        signature = self._file_signature()
+        if signature == state[0]:
+            return state
+
+        with self._lock:
+            state = self._state
+            loaded = signature != state[0]
+            if loaded:
+                start = time.perf_counter()
+                state = (signature, self._read_index())
+                self._state = state
+                self.loads += 1
+                self.load_seconds = time.perf_counter() - start
+                index = state[1]
+                self._index_bytes = int(index.memory_usage(deep=True).sum() + index.index.memory_usage(deep=True))
+        if loaded and self.on_load is not None:
+            self.on_load(self)
+        return state
+
+    def _read_index(self):
+        snapshot, reason = open_snapshot(self.snapshot_path, self.path)
+        if snapshot is None:
+            log = logger.info if not os.path.exists(self.snapshot_path) else logger.warning
+            log('Reading %s instead of its snapshot: %s (compile one with python catalog_snapshot.py %s)',
+                self.path, reason, self.path)
+            self.source = 'csv'
+            self._snapshot_state = (None, None)
+            return build_index(pd.read_csv(self.path))
+        index = snapshot.to_index()
+        self.source = 'snapshot'
+        self._snapshot_state = (index, snapshot)
+        return index
+
+    def get_index(self):
+        return self._load()[1]
+
+    def version(self):
+        """Identifies the current basis file version, without loading it."""
+        signature = self._state[0]
+        if not self.pinned or signature is None:
+            signature = self._file_signature()
+        mtime_ns, size, _ = signature
+        return f'{mtime_ns}-{size}'
+
+    def stale(self):
+        """True when the file changed since the index in memory was loaded."""
+        signature = self._state[0]
+        try:
+            return signature is not None and self._file_signature() != signature
+        except FileNotFoundError:
+            # Keep serving the loaded catalog until a new file is in place
+            return False
+
+    def get_matcher(self):
+        """Returns a MatchIndex over the current index, rebuilt only when the index changes."""
+        index = self.get_index()
+        matched_index, matcher = self._matcher_state
+        if matched_index is not index:
+            with self._lock:
+                matched_index, matcher = self._matcher_state
+                loaded = matched_index is not index
+                if loaded:
+                    start = time.perf_counter()
+                    snapshot_index, snapshot = self._snapshot_state
+                    tables = snapshot.match_tables() if snapshot_index is index else None
+                    matcher = MatchIndex(index) if tables is None else MatchIndex.from_tables(index, tables)
+                    self._snapshot_state = (None, None)
+                    self._matcher_state = (index, matcher)
+                    self.matcher_seconds = time.perf_counter() - start
+                    self._matcher_bytes = matcher.memory_bytes()
+            if loaded and self.on_load is not None:
+                self.on_load(self)
+        return matcher
+
+    def unload(self):
+        """Drops the in-memory index and matcher; the next lookup reloads them."""
+        with self._lock:
+            self._state = (None, None)
+            self._matcher_state = (None, None)
+            self._snapshot_state = (None, None)
+            self._index_bytes = 0
+            self._matcher_bytes = 0
+
+    def memory_bytes(self):
+        """Approximate bytes held by the loaded index and matcher, measured when they were built."""
+        matched_index, _ = self._matcher_state
+        matcher_bytes = self._matcher_bytes if matched_index is self._state[1] else 0
+        return self._index_bytes + matcher_bytes
+
+    def stats(self):
+        return {
+            'loaded': self._state[1] is not None,
+            'source': self.source,
+            'loads': self.loads,
+            'load_seconds': self.load_seconds,
+            'matcher_seconds': self.matcher_seconds,
+            'memory_bytes': self.memory_bytes(),
+        }
+
+
+def open_catalog(path):
+    """BasisCatalog for a CSV, SQLiteCatalog for a .db/.sqlite database."""
+    if path.endswith(('.db', '.sqlite', '.sqlite3')):
+        return SQLiteCatalog(path)
+    return BasisCatalog(path)
+
+
+# Shared instance used by the web apps; RMS_CATALOG_DB points them at a SQLite catalog
+basis_catalog = open_catalog(os.environ.get('RMS_CATALOG_DB') or BASIS_FILE_NAME)
@@ -0,0 +1,216 @@
+"""Basis catalog stored in an embedded SQLite database.
+
+Import the current CSV once, then point the apps at the database:
+
+    python catalog_db.py basis_data.csv catalog.db
+    RMS_CATALOG_DB=catalog.db python test.py
+"""
+import os
+import sqlite3
+import sys
+import threading
+from contextlib import contextmanager
+
+import numpy as np
+import pandas as pd
+
+from matching import normalize_names
+
+# CSV rows inserted per executemany while importing
+IMPORT_CHUNK_ROWS = 50000
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS products (
+    position INTEGER PRIMARY KEY,
+    name TEXT NOT NULL UNIQUE,
+    product_id TEXT,
+    category TEXT,
+    price REAL,
+    key TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS products_product_id ON products (product_id);
+CREATE INDEX IF NOT EXISTS products_key ON products (key, position);
+"""
+
+
+class SQLiteCatalog:
+    """Basis catalog with indexed name, normalized-name and Product Id lookups.
+
+    Stands in for both the catalog index and the matcher in process_data:
+    lookup() resolves exact names and match() adds the normalized tier, each as
+    one join against a temp table of the requested names, so only the rows
+    asked for are ever loaded. There is no fuzzy tier; that needs the whole
+    catalog in memory (build a matching.MatchIndex over to_index() instead).
+
+    Edits go through edit(), which runs in one transaction and bumps the
+    version that result caches key on.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+
+    def __getstate__(self):
+        # Connections stay in their own process; workers open their own
+        return {'path': self.path}
+
+    def __setstate__(self, state):
+        self.__init__(state['path'])
+
+    def _connection(self):
+        # One connection per thread, and never one inherited through fork
+        pid, connection = getattr(self._local, 'connection', (None, None))
+        if pid != os.getpid():
+            connection = sqlite3.connect(self.path)
+            connection.executescript(SCHEMA)
+            connection.execute('CREATE TEMP TABLE IF NOT EXISTS lookup_names '
+                               '(position INTEGER PRIMARY KEY, name TEXT, key TEXT)')
+            self._local.connection = (os.getpid(), connection)
+        return connection
+
+    # --- Same interface as catalog.BasisCatalog ---
+
+    def exists(self):
+        return os.path.exists(self.path)
+
+    def get_index(self):
+        return self
+
+    def get_matcher(self):
+        return self
+
+    def version(self):
+        return str(self._connection().execute('PRAGMA user_version').fetchone()[0])
+
+    def unload(self):
+        # Nothing is cached in memory; SQLite pages come and go with its own cache
+        pass
+
+    def stale(self):
+        # Every query sees the latest committed version
+        return False
+
+    def memory_bytes(self):
+        return 0
+
+    def stats(self):
+        return {'loaded': self.exists(), 'source': 'sqlite', 'loads': 0, 'load_seconds': 0.0,
+                'matcher_seconds': 0.0, 'memory_bytes': 0}
+
+    # --- Bulk Lookups ---
+
+    def _load_names(self, connection, names, keys=None):
+        connection.execute('DELETE FROM lookup_names')
+        names = _nullable(names)
+        if keys is None:
+            rows = zip(range(len(names)), names)
+            connection.executemany('INSERT INTO lookup_names (position, name) VALUES (?, ?)', rows)
+        else:
+            rows = zip(range(len(names)), names, keys)
+            connection.executemany('INSERT INTO lookup_names (position, name, key) VALUES (?, ?, ?)', rows)
+
+    def _aligned(self, rows, length, columns):
+        result = pd.DataFrame(rows, columns=['position'] + columns)
+        aligned = pd.DataFrame(index=pd.RangeIndex(length))
+        positions = result['position'].to_numpy(dtype=np.int64)
+        for column in columns:
+            values = np.full(length, np.nan, dtype=object)
+            values[positions] = result[column].to_numpy(dtype=object)
+            aligned[column] = values
+        return aligned
+
+    def lookup(self, names):
+        """Returns Product Id, Pos Categories and Matched Name per exact name, positionally aligned."""
+        connection = self._connection()
+        with connection:
+            self._load_names(connection, names)
+            rows = connection.execute(
+                'SELECT l.position, p.product_id, p.category, p.name '
+                'FROM lookup_names l JOIN products p ON p.name = l.name').fetchall()
+        return self._aligned(rows, len(names), ['Product Id', 'Pos Categories', 'Matched Name'])
+
+    def match(self, names):
+        """Exact then normalized-name matching, in the matching.MatchIndex.match layout."""
+        names = pd.Series(names).reset_index(drop=True)
+        keys = normalize_names(names).to_numpy()
+        connection = self._connection()
+        with connection:
+            self._load_names(connection, names, keys)
+            rows = connection.execute(
+                "SELECT l.position, p.product_id, p.category, p.name, 'exact', 1.0 "
+                "FROM lookup_names l JOIN products p ON p.name = l.name").fetchall()
+            rows += connection.execute(
+                "SELECT l.position, p.product_id, p.category, p.name, 'normalized', 1.0 "
+                "FROM lookup_names l JOIN products p ON p.position = "
+                "(SELECT MIN(position) FROM products WHERE key = l.key) "
+                "WHERE l.key != '' AND NOT EXISTS (SELECT 1 FROM products e WHERE e.name = l.name)").fetchall()
+        result = self._aligned(rows, len(names), ['Product Id', 'Pos Categories', 'Matched Name', 'Match Type',
+                                                  'Match Score'])
+        result['Match Score'] = result['Match Score'].astype('float64')
+        return result
+
+    def to_index(self):
+        """Materializes the catalog in the catalog.build_index layout."""
+        return pd.read_sql_query(
+            'SELECT name AS "Pos Product Name", product_id AS "Product Id", category AS "Pos Categories" '
+            'FROM products ORDER BY position', self._connection()).set_index('Pos Product Name')
+
+    # --- Transactional Edits ---
+
+    @contextmanager
+    def edit(self):
+        """Yields the connection inside one transaction; commits (and bumps the version) or rolls back."""
+        connection = self._connection()
+        with connection:
+            yield connection
+            version = connection.execute('PRAGMA user_version').fetchone()[0]
+            connection.execute(f'PRAGMA user_version = {int(version) + 1}')
+
+    def upsert(self, df_basis):
+        """Adds or updates products from a frame in the basis_data.csv layout."""
+        with self.edit() as connection:
+            connection.executemany(
+                'INSERT INTO products (name, product_id, category, price, key) VALUES (?, ?, ?, ?, ?) '
+                'ON CONFLICT (name) DO UPDATE SET product_id = excluded.product_id, '
+                'category = excluded.category, price = excluded.price', _product_rows(df_basis))
+
+    def delete(self, names):
+        with self.edit() as connection:
+            connection.executemany('DELETE FROM products WHERE name = ?', ((name,) for name in names))
+
+    def import_csv(self, csv_path, chunk_rows=IMPORT_CHUNK_ROWS):
+        """Replaces the catalog with a basis_data.csv file in one transaction.
+
+        Read in chunks, so memory does not grow with the file. Repeated names
+        keep their first row, like catalog.build_index.
+        """
+        with self.edit() as connection:
+            connection.execute('DELETE FROM products')
+            for df_chunk in pd.read_csv(csv_path, chunksize=chunk_rows, dtype={'Product Id': object}):
+                connection.executemany(
+                    'INSERT OR IGNORE INTO products (name, product_id, category, price, key) '
+                    'VALUES (?, ?, ?, ?, ?)', _product_rows(df_chunk))
+
+
+def _nullable(values):
+    values = pd.Series(values).astype(object)
+    return values.where(values.notna(), None)
+
+
+def _product_rows(df_basis):
+    """(name, product_id, category, price, key) tuples for the rows of a basis frame."""
+    df_basis = df_basis.dropna(subset=['Pos Product Name'])
+    names = df_basis['Pos Product Name'].astype(str)
+    prices = pd.to_numeric(df_basis['Price'], errors='coerce') if 'Price' in df_basis else np.nan
+    prices = pd.Series(prices, index=df_basis.index, dtype='float64')
+    return zip(names, _nullable(df_basis['Product Id']), _nullable(df_basis['Pos Categories']),
+               _nullable(prices), normalize_names(names).to_numpy())
+
+
+if __name__ == '__main__':
+    if len(sys.argv) != 3:
+        sys.exit('usage: python catalog_db.py basis_data.csv catalog.db')
+    catalog = SQLiteCatalog(sys.argv[2])
+    catalog.import_csv(sys.argv[1])
+    count = catalog._connection().execute('SELECT COUNT(*) FROM products').fetchone()[0]
+    print(f'Imported {count} products into {sys.argv[2]} (version {catalog.version()})')
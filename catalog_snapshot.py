@@ -0,0 +1,220 @@
+"""Compiled basis catalogs: the lookup index and matcher tables in one memory-mapped file.
+
+    python catalog_snapshot.py basis_data.csv                 # writes basis_data.snapshot
+    python catalog_snapshot.py basis_data.csv other.snapshot
+
+Loading the CSV means read_csv, a dedupe and, for the matcher, normalizing and
+splitting every name into trigrams: seconds for a large catalog. A snapshot
+stores the result as flat arrays: the deduplicated names sorted (fixed-width
+UTF-8) with their catalog positions, Product Ids, integer-coded categories and
+the matcher's tables. Opening one maps the file and reads a small JSON header;
+nothing is parsed.
+
+The header records the format version, the matcher settings and the size,
+mtime and BLAKE2 digest of the CSV it was compiled from. catalog.BasisCatalog
+uses a snapshot only while it matches its CSV, and otherwise logs why and
+reads the CSV.
+"""
+import hashlib
+import json
+import mmap
+import os
+import struct
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+from matching import MAX_BLOCK_SIZE, MIN_SIMILARITY, MatchIndex
+
+MAGIC = b'RMSSNAP\n'
+FORMAT_VERSION = 1
+SNAPSHOT_SUFFIX = '.snapshot'
+# Arrays start on this boundary so every view is aligned
+ALIGNMENT = 64
+
+
+def snapshot_path_for(csv_path):
+    """Default snapshot location of a basis CSV: same name, .snapshot extension."""
+    return os.path.splitext(csv_path)[0] + SNAPSHOT_SUFFIX
+
+
+def file_digest(path):
+    digest = hashlib.blake2b(digest_size=20)
+    with open(path, 'rb') as file:
+        for block in iter(lambda: file.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _encode(values):
+    """(fixed-width UTF-8 array, missing mask) of an object array of strings and NaN."""
+    missing = pd.isna(values)
+    encoded = [b'' if skip else str(value).encode('utf-8') for value, skip in zip(values, missing)]
+    width = max((len(value) for value in encoded), default=0)
+    return np.array(encoded, dtype=f'S{max(width, 1)}'), missing
+
+
+def _decode(array, missing=None):
+    """Object array of str (NaN where missing) back from _encode."""
+    values = np.empty(len(array), dtype=object)
+    # tolist() yields bytes with the padding stripped; faster than np.char.decode
+    values[:] = [value.decode('utf-8') for value in array.tolist()]
+    if missing is not None and missing.any():
+        values[missing] = np.nan
+    return values
+
+
+# --- Writing ---
+
+def write_snapshot(path, index, source_path, matcher=None):
+    """Writes the catalog.build_index frame `index` of source_path (and matcher's tables) to path."""
+    names, _ = _encode(index.index.to_numpy(dtype=object))
+    # Stored sorted next to their catalog positions, which index() restores; a stable sort keeps
+    # the catalog order of equal byte strings
+    order = np.argsort(names, kind='stable')
+    product_ids, product_id_missing = _encode(index['Product Id'].to_numpy(dtype=object))
+    category_codes, categories = pd.factorize(index['Pos Categories'])
+    arrays = {
+        'names': names[order],
+        'name_positions': order.astype(np.int32),
+        'product_ids': product_ids,
+        'product_id_missing': product_id_missing,
+        'category_codes': category_codes.astype(np.int32),
+    }
+    if matcher is not None:
+        for name, table in matcher.tables().items():
+            if table.dtype == object:
+                table, _ = _encode(table)
+            elif table.dtype.kind == 'i':
+                table = table.astype(np.int32)
+            arrays[f'match_{name}'] = table
+
+    stat = os.stat(source_path)
+    header = {
+        'format': FORMAT_VERSION,
+        'created': time.time(),
+        'source': {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'digest': file_digest(source_path)},
+        'rows': len(index),
+        'dtypes': {'name': str(index.index.dtype), 'product_id': str(index['Product Id'].dtype),
+                   'category': str(index['Pos Categories'].dtype)},
+        'categories': list(categories),
+        'match': None if matcher is None else {'min_similarity': matcher.min_similarity,
+                                               'max_block_size': matcher.max_block_size},
+        'arrays': {},
+    }
+    relative, offset = {}, 0
+    for name, array in arrays.items():
+        relative[name] = offset
+        offset += -(-array.nbytes // ALIGNMENT) * ALIGNMENT
+    # The arrays follow the header, whose length depends on their offsets: grow until it fits
+    base = 0
+    while True:
+        header['arrays'] = {name: {'dtype': array.dtype.str, 'length': len(array), 'offset': base + relative[name]}
+                            for name, array in arrays.items()}
+        header_bytes = json.dumps(header).encode('utf-8')
+        end = -(-(len(MAGIC) + 8 + len(header_bytes)) // ALIGNMENT) * ALIGNMENT
+        if end <= base:
+            break
+        base = end
+
+    # Written to a temp name and renamed so readers never map a half-written file
+    temp_path = path + '.tmp'
+    with open(temp_path, 'wb') as file:
+        file.write(MAGIC + struct.pack('<Q', len(header_bytes)) + header_bytes)
+        for name, array in arrays.items():
+            file.seek(header['arrays'][name]['offset'])
+            file.write(np.ascontiguousarray(array).tobytes())
+    os.replace(temp_path, path)
+    return header
+
+
+# --- Reading ---
+
+class SnapshotError(Exception):
+    pass
+
+
+class CatalogSnapshot:
+    """A snapshot file mapped read-only; every array is a view into the mapping."""
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as file:
+            self._map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._map[:len(MAGIC)] != MAGIC:
+            raise SnapshotError('not a catalog snapshot')
+        (length,) = struct.unpack_from('<Q', self._map, len(MAGIC))
+        start = len(MAGIC) + 8
+        self.header = json.loads(self._map[start:start + length])
+        if self.header['format'] != FORMAT_VERSION:
+            raise SnapshotError(f"format version {self.header['format']}, expected {FORMAT_VERSION}")
+        self.arrays = {
+            name: np.frombuffer(self._map, dtype=np.dtype(entry['dtype']), count=entry['length'],
+                                offset=entry['offset'])
+            for name, entry in self.header['arrays'].items()
+        }
+
+    def check_source(self, csv_path):
+        """None if the snapshot was compiled from csv_path as it is now, else the reason it is stale."""
+        source = self.header['source']
+        stat = os.stat(csv_path)
+        if stat.st_size != source['size']:
+            return 'the basis file changed size since it was compiled'
+        # Copies and checkouts touch the mtime; only a content change makes it stale
+        if stat.st_mtime_ns != source['mtime_ns'] and file_digest(csv_path) != source['digest']:
+            return 'the basis file changed since it was compiled'
+        return None
+
+    def to_index(self):
+        """The catalog.build_index frame, in catalog order."""
+        arrays, dtypes = self.arrays, self.header['dtypes']
+        names = np.empty(self.header['rows'], dtype=object)
+        names[arrays['name_positions']] = _decode(arrays['names'])
+        categories = np.array(self.header['categories'] + [np.nan], dtype=object)[arrays['category_codes']]
+        index = pd.DataFrame({
+            'Product Id': pd.Series(_decode(arrays['product_ids'], arrays['product_id_missing']),
+                                    dtype=object).astype(dtypes['product_id']),
+            'Pos Categories': pd.Series(categories, dtype=object).astype(dtypes['category']),
+        })
+        index.index = pd.Index(names, dtype=object, name='Pos Product Name').astype(dtypes['name'])
+        return index
+
+    def match_tables(self, min_similarity=MIN_SIMILARITY, max_block_size=MAX_BLOCK_SIZE):
+        """The stored matcher tables (see MatchIndex.from_tables), or None if absent or built with other settings."""
+        if self.header['match'] != {'min_similarity': min_similarity, 'max_block_size': max_block_size}:
+            return None
+        tables = {}
+        for name, array in self.arrays.items():
+            if name.startswith('match_'):
+                tables[name[len('match_'):]] = _decode(array) if array.dtype.kind == 'S' else array
+        return tables
+
+
+def open_snapshot(path, csv_path):
+    """(CatalogSnapshot, None) if path holds a current snapshot of csv_path, else (None, reason)."""
+    try:
+        snapshot = CatalogSnapshot(path)
+    except FileNotFoundError:
+        return None, f'no snapshot at {path}'
+    except (OSError, ValueError, KeyError, SnapshotError) as e:
+        return None, f'unreadable snapshot {path} ({e})'
+    reason = snapshot.check_source(csv_path)
+    if reason is not None:
+        return None, f'snapshot {path} is stale: {reason}'
+    return snapshot, None
+
+
+if __name__ == '__main__':
+    from catalog import build_index
+
+    if len(sys.argv) not in (2, 3):
+        sys.exit('usage: python catalog_snapshot.py basis_data.csv [basis_data.snapshot]')
+    csv_path = sys.argv[1]
+    path = sys.argv[2] if len(sys.argv) == 3 else snapshot_path_for(csv_path)
+    start = time.perf_counter()
+    index = build_index(pd.read_csv(csv_path))
+    header = write_snapshot(path, index, csv_path, MatchIndex(index))
+    print(f"Compiled {header['rows']} products into {path} ({os.path.getsize(path) / 1e6:.1f} MB) "
+          f"in {time.perf_counter() - start:.2f}s")
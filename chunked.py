@@ -0,0 +1,261 @@
+"""Out-of-core mode: convert workbooks of any size within a fixed memory budget.
+
+The input is read in row chunks. Item names already seen in earlier chunks are
+dropped through a sorted array of 64-bit name hashes (8 bytes per distinct
+name). Each chunk goes through process_data (lean), which leaves it sorted by
+Product Id, and is spilled to disk as a sorted run. The runs are then k-way
+merged, block by block, into the output CSV. The sort is stable, so the result
+is byte-identical to process_data on the whole workbook.
+
+    python chunked.py all_branches.csv templates/all_branches.csv --memory-budget-mb 256
+"""
+import argparse
+import contextlib
+import os
+import pickle
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+from ingest import iter_workbook_chunks
+from processing import REVIEW_COLUMNS, process_data, split_review, unmatched_count
+
+DEFAULT_MEMORY_BUDGET = 256 * 1024 * 1024
+# Peak bytes per input row while a chunk goes through process_data (about 1.1KB
+# with fuzzy matching and all-distinct names), and per template row held in a
+# merge buffer, counting the sort and CSV copies (measured with tracemalloc)
+CHUNK_ROW_BYTES = 1536
+MERGE_ROW_BYTES = 512
+# Runs merged at once; more runs are merged in several passes
+MAX_FAN_IN = 64
+
+
+class _NameFilter:
+    """Remembers which item names have been seen, as a sorted array of 64-bit hashes.
+
+    A hash collision (about 1 in 10^7 for ten million distinct names) would
+    drop the later name as a duplicate.
+    """
+
+    def __init__(self):
+        self._seen = np.empty(0, dtype=np.uint64)
+
+    def first_seen(self, names):
+        """Mask of the rows holding the first occurrence of a name across every call so far."""
+        hashes = pd.util.hash_array(np.asarray(names, dtype=object))
+        mask = ~pd.Series(hashes).duplicated(keep='first').to_numpy()
+        positions = np.searchsorted(self._seen, hashes)
+        found = positions < len(self._seen)
+        found[found] = self._seen[positions[found]] == hashes[found]
+        mask &= ~found
+        new = np.sort(hashes[mask])
+        self._seen = np.insert(self._seen, np.searchsorted(self._seen, new), new)
+        return mask
+
+    def memory_bytes(self):
+        return self._seen.nbytes
+
+
+def _sort_keys(df):
+    # (missing, key) orders rows like sort_values(by='Product Id', na_position='last')
+    product_ids = df['Product Id'].to_numpy(dtype=object)
+    missing = pd.isna(product_ids)
+    keys = np.where(missing, '', product_ids).astype(str)
+    return missing, keys
+
+
+def _score_keys(df):
+    # (missing, key) orders review rows like split_review's sort_values(by='Match Score')
+    scores = df['Match Score'].to_numpy(dtype='float64')
+    missing = np.isnan(scores)
+    return missing, np.where(missing, 0.0, scores)
+
+
+def _write_run(path, frames, block_rows):
+    """Writes frames to a run file as pickled blocks of at most block_rows rows."""
+    with open(path, 'wb') as file:
+        for df in frames:
+            for start in range(0, len(df), block_rows):
+                pickle.dump(df.iloc[start:start + block_rows], file, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+def _read_run(path):
+    with open(path, 'rb') as file:
+        while True:
+            try:
+                yield pickle.load(file)
+            except EOFError:
+                return
+
+
+class _RunCursor:
+    """The buffered block of one run during a merge."""
+
+    def __init__(self, number, path, sort_keys=_sort_keys):
+        self.number = number
+        self.sort_keys = sort_keys
+        self._blocks = _read_run(path)
+        self.exhausted = False
+        self._next_block()
+
+    def _next_block(self):
+        self.block = next(self._blocks, None)
+        if self.block is None:
+            self.exhausted = True
+            self.block = pd.DataFrame()
+            self.missing, self.keys = np.empty(0, dtype=bool), np.empty(0, dtype=str)
+        else:
+            self.missing, self.keys = self.sort_keys(self.block)
+
+    def take(self, count):
+        taken = (self.block.iloc[:count], self.missing[:count], self.keys[:count])
+        self.block, self.missing, self.keys = self.block.iloc[count:], self.missing[count:], self.keys[count:]
+        if not len(self.block) and not self.exhausted:
+            self._next_block()
+        return taken
+
+
+def merge_runs(paths, sort_keys=_sort_keys):
+    """Yields the rows of sorted runs as sorted frames, ties in run order.
+
+    Each step emits every buffered row up to the smallest (last key, run)
+    among runs with blocks still on disk, so no later block can sort before
+    what has been emitted. Runs are sorted by Product Id unless sort_keys
+    says otherwise.
+    """
+    cursors = [_RunCursor(number, path, sort_keys) for number, path in enumerate(paths)]
+    while True:
+        active = [cursor for cursor in cursors if len(cursor.block)]
+        if not active:
+            return
+        pending = [(cursor.missing[-1], cursor.keys[-1], cursor.number) for cursor in active if not cursor.exhausted]
+        bound = min(pending) if pending else None
+        frames, missing, keys, numbers = [], [], [], []
+        for cursor in active:
+            if bound is None:
+                count = len(cursor.block)
+            else:
+                bound_missing, bound_key, bound_number = bound
+                same_key = (cursor.missing == bound_missing) & (cursor.keys == bound_key)
+                below = (cursor.missing < bound_missing) | (
+                    (cursor.missing == bound_missing) & (cursor.keys < bound_key))
+                count = int((below | (same_key & (cursor.number <= bound_number))).sum())
+            if count:
+                block, block_missing, block_keys = cursor.take(count)
+                frames.append(block)
+                missing.append(block_missing)
+                keys.append(block_keys)
+                numbers.append(np.full(count, cursor.number))
+        df = pd.concat(frames)
+        # lexsort is stable and sorts by its last key first
+        yield df.iloc[np.lexsort((np.concatenate(numbers), np.concatenate(keys), np.concatenate(missing)))]
+
+
+def _merge_to_fan_in(paths, directory, block_rows, sort_keys=_sort_keys, prefix='merge'):
+    """Merges runs in groups of MAX_FAN_IN until one final merge can take them all.
+
+    Returns (run paths, intermediate passes).
+    """
+    generation = 0
+    while len(paths) > MAX_FAN_IN:
+        merged = []
+        for start in range(0, len(paths), MAX_FAN_IN):
+            group = paths[start:start + MAX_FAN_IN]
+            path = os.path.join(directory, f'{prefix}-{generation}-{start}.pkl')
+            _write_run(path, merge_runs(group, sort_keys), block_rows)
+            for old_path in group:
+                os.remove(old_path)
+            merged.append(path)
+        paths, generation = merged, generation + 1
+    return paths, generation
+
+
+def process_workbook_chunked(file, output, catalog_index, matcher=None, memory_budget=DEFAULT_MEMORY_BUDGET,
+                             spill_dir=None, review=None, **options):
+    """Converts one workbook (a file object) into a template CSV written to `output`.
+
+    Half the budget bounds each input chunk, the other half the merge buffers.
+    The catalog, the name filter and the fuzzy matcher's fixed working set
+    (FUZZY_BATCH_SIZE queries at a time) come on top. options are passed to process_data (constants, rules, branch).
+    With a `review` file object, the rows matched by a normalized or fuzzy name
+    are written to it as CSV (see processing.split_review), lowest score first:
+    they are spilled as runs of their own and merged on Match Score after the
+    template, ties in workbook order.
+    Returns {'input_rows', 'rows', 'unmatched', 'needs_review', 'uncategorized',
+    'chunks', 'chunk_rows', 'merge_passes'}.
+    """
+    chunk_rows = max(1000, memory_budget // 2 // CHUNK_ROW_BYTES)
+    block_rows = max(100, memory_budget // 2 // MAX_FAN_IN // MERGE_ROW_BYTES)
+    names = _NameFilter()
+    stats = {'input_rows': 0, 'rows': 0, 'unmatched': 0, 'needs_review': 0, 'uncategorized': False, 'chunks': 0,
+             'chunk_rows': chunk_rows, 'merge_passes': 0}
+    with tempfile.TemporaryDirectory(prefix='rms-runs-', dir=spill_dir) as directory:
+        # --- Sorted Runs ---
+        paths, review_paths, header = [], [], None
+        for df_chunk in iter_workbook_chunks(file, chunk_rows):
+            stats['input_rows'] += len(df_chunk)
+            df_chunk = df_chunk[names.first_seen(df_chunk['Item Name'])]
+            df_run, has_uncategorized = process_data(df_chunk, catalog_index, matcher, lean=True,
+                                                     match_details=review is not None, **options)
+            if review is not None:
+                df_run, df_review = split_review(df_run)
+                stats['needs_review'] += len(df_review)
+                if len(df_review):
+                    path = os.path.join(directory, f'review-{len(review_paths)}.pkl')
+                    _write_run(path, [df_review], block_rows)
+                    review_paths.append(path)
+            if header is None:
+                header = df_run.iloc[:0]
+            stats['chunks'] += 1
+            stats['rows'] += len(df_run)
+            stats['unmatched'] += unmatched_count(df_run, options.get('rules'))
+            stats['uncategorized'] |= bool(has_uncategorized)
+            if len(df_run):
+                path = os.path.join(directory, f'run-{len(paths)}.pkl')
+                _write_run(path, [df_run], block_rows)
+                paths.append(path)
+            del df_chunk, df_run
+
+        # --- External Merge on Product Id ---
+        paths, passes = _merge_to_fan_in(paths, directory, block_rows)
+        stats['merge_passes'] = passes + 1
+        output.write(header.to_csv(index=False).encode('utf-8'))
+        for df in merge_runs(paths):
+            output.write(df.to_csv(index=False, header=False).encode('utf-8'))
+
+        # --- Review List, Merged on Match Score ---
+        if review is not None:
+            review_paths, _ = _merge_to_fan_in(review_paths, directory, block_rows, _score_keys, 'review-merge')
+            review.write(pd.DataFrame(columns=REVIEW_COLUMNS).to_csv(index=False).encode('utf-8'))
+            for df in merge_runs(review_paths, _score_keys):
+                review.write(df.to_csv(index=False, header=False).encode('utf-8'))
+    return stats
+
+
+if __name__ == '__main__':
+    from catalog import BASIS_FILE_NAME, open_catalog
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('input', help='workbook, CSV or Parquet file')
+    parser.add_argument('output', help='template CSV to write')
+    parser.add_argument('--basis', default=BASIS_FILE_NAME, help='basis catalog CSV or SQLite catalog (.db)')
+    parser.add_argument('--memory-budget-mb', type=int, default=DEFAULT_MEMORY_BUDGET // (1024 * 1024))
+    parser.add_argument('--spill-dir', help='where sorted runs are written (default: system temp dir)')
+    parser.add_argument('--exact-only', action='store_true', help='skip normalized/fuzzy name matching')
+    parser.add_argument('--review', help='CSV to write the items matched by a normalized or fuzzy name to')
+    args = parser.parse_args()
+
+    catalog = open_catalog(args.basis)
+    start = time.perf_counter()
+    with contextlib.ExitStack() as stack:
+        file = stack.enter_context(open(args.input, 'rb'))
+        output = stack.enter_context(open(args.output, 'wb'))
+        review = stack.enter_context(open(args.review, 'wb')) if args.review else None
+        stats = process_workbook_chunked(file, output, catalog.get_index(),
+                                         None if args.exact_only else catalog.get_matcher(),
+                                         args.memory_budget_mb * 1024 * 1024, args.spill_dir, review)
+    print(f"{stats['input_rows']:,} rows -> {stats['rows']:,} items in {time.perf_counter() - start:.2f}s "
+          f"({stats['chunks']} chunks of {stats['chunk_rows']:,} rows, {stats['merge_passes']} merge passes, "
+          f"{stats['unmatched']} unmatched, {stats['needs_review']} to review)")
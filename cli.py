@@ -0,0 +1,109 @@
+"""Headless batch mode: turn a directory (or glob) of branch workbooks into HLX CSVs.
+
+Inputs may be .xlsx/.xls workbooks or CSV/Parquet exports with the same columns.
+
+    python cli.py branches/ --output-dir templates/
+    python cli.py "exports/*.xlsx" --output-dir templates/ --workers 8 --summary summary.csv
+    python cli.py branches/ --output-dir changes/ --previous-dir templates/
+    python cli.py exports/ --output-dir templates/ --extra-formats parquet
+    python cli.py all_history.csv --output-dir templates/ --memory-budget-mb 512 --workers 2
+"""
+import argparse
+import glob
+import os
+import sys
+import time
+
+import pandas as pd
+
+from batch import SUMMARY_COLUMNS, generated_filename, process_workbook_file, run_pool, unique_output_names
+from catalog import BASIS_FILE_NAME, open_catalog
+from export import available_formats
+from ingest import INPUT_EXTENSIONS
+from rules import load_rules
+
+
+def find_workbooks(inputs):
+    """Expands directories and glob patterns into a sorted list of workbook paths."""
+    paths = []
+    for pattern in inputs:
+        if os.path.isdir(pattern):
+            candidates = [os.path.join(pattern, name) for name in os.listdir(pattern)]
+        else:
+            candidates = glob.glob(pattern)
+        paths.extend(path for path in candidates
+                     if os.path.isfile(path) and path.lower().endswith(INPUT_EXTENSIONS)
+                     and not os.path.basename(path).startswith('~$'))
+    return sorted(set(paths))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('inputs', nargs='+', help='workbook directories or glob patterns')
+    parser.add_argument('--output-dir', required=True, help='where the generated CSVs are written')
+    parser.add_argument('--basis', default=BASIS_FILE_NAME, help='basis catalog CSV, or a SQLite catalog (.db) from catalog_db.py')
+    parser.add_argument('--workers', type=int, default=None, help='worker processes (default: all cores)')
+    parser.add_argument('--exact-only', action='store_true', help='skip normalized/fuzzy name matching')
+    parser.add_argument('--previous-dir',
+                        help='earlier templates; branches found here get only a <name>_changes.csv')
+    parser.add_argument('--rules', help='pricing and category rule file (see rules.py)')
+    parser.add_argument('--extra-formats', nargs='+', default=[], choices=[f for f in available_formats() if f != 'csv'],
+                        help='also write each template in these formats (needs pyarrow)')
+    parser.add_argument('--memory-budget-mb', type=int,
+                        help='out-of-core mode: cap each worker at about this much memory, whatever the '
+                             'workbook size (full templates only; delta exports stay in memory)')
+    parser.add_argument('--summary', help='also write the per-file status table to this CSV')
+    args = parser.parse_args(argv)
+
+    paths = find_workbooks(args.inputs)
+    if not paths:
+        print(f'No {", ".join(INPUT_EXTENSIONS)} files found.', file=sys.stderr)
+        return 1
+
+    catalog = open_catalog(args.basis)
+    if not catalog.exists():
+        print(f"Error: Basis file '{args.basis}' not found.", file=sys.stderr)
+        return 1
+
+    start = time.perf_counter()
+    catalog_index = catalog.get_index()
+    matcher = None if args.exact_only else catalog.get_matcher()
+    load_seconds = time.perf_counter() - start
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    output_names = unique_output_names([generated_filename(path) for path in paths])
+    memory_budget = args.memory_budget_mb * 1024 * 1024 if args.memory_budget_mb else None
+    task_args = []
+    for path, name in zip(paths, output_names):
+        previous_path = os.path.join(args.previous_dir, name) if args.previous_dir else None
+        if previous_path and os.path.exists(previous_path):
+            task_args.append((path, os.path.join(args.output_dir, os.path.splitext(name)[0] + '_changes.csv'),
+                              previous_path, args.extra_formats, memory_budget))
+        else:
+            task_args.append((path, os.path.join(args.output_dir, name), None, args.extra_formats, memory_budget))
+    options = {'rules': load_rules(args.rules)} if args.rules else None
+    results = run_pool(process_workbook_file, task_args, catalog_index, matcher, args.workers, options)
+    elapsed = time.perf_counter() - start
+
+    summary = pd.DataFrame(results, columns=SUMMARY_COLUMNS)
+    if args.summary:
+        summary.to_csv(args.summary, index=False)
+
+    failed = summary[summary['status'] != 'ok']
+    for _, row in failed.iterrows():
+        print(f"FAILED {row['file']}: {row['error']}", file=sys.stderr)
+
+    input_rows = int(summary['input_rows'].sum())
+    print(f"{len(summary) - len(failed)}/{len(summary)} workbooks converted in {elapsed:.2f}s "
+          f"(catalog load {load_seconds:.2f}s)")
+    print(f"  {len(summary) / elapsed:.1f} files/s, {input_rows / elapsed:,.0f} rows/s")
+    print(f"  {int(summary['unmatched'].sum())} unmatched items across "
+          f"{int((summary['unmatched'] > 0).sum())} workbooks")
+    if summary['needs_review'].sum():
+        print(f"  {int(summary['needs_review'].sum())} items matched by a normalized or fuzzy name need review "
+              f"(see the *_review.csv files)")
+    return 1 if len(failed) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
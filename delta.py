@@ -0,0 +1,133 @@
+import os
+import tempfile
+
+import numpy as np
+import pandas as pd
+from werkzeug.utils import secure_filename
+
+from processing import MATCH_DETAIL_COLUMNS, TEMPLATE_COLUMNS, process_data
+
+CHANGE_COLUMN = 'Change'
+
+
+def read_template(file):
+    """Reads a generated template CSV back with the dtypes process_data produces."""
+    return pd.read_csv(file, dtype={'Product Id': object, 'Pos Product Name': object})
+
+
+def process_delta(df_imported, df_previous, catalog_index, matcher=None, stage=None, constants=None,
+                  rules=None, branch=None, match_details=False):
+    """Exports only what changed between a branch's previous template and a new workbook.
+
+    New and previous items are hash-joined on 'Pos Product Name'. Only items that
+    are new to the menu go through process_data (and so through matching);
+    re-priced items keep the Product Id and category of the previous template.
+    With rules, their new price is evaluated against the catalog category the
+    rules started from, not the rewritten one in the previous template.
+    Returns (df_changes, has_uncategorized_items), where df_changes has the
+    template columns plus 'Change' ('added', 'repriced' or 'removed').
+    match_details=True adds the match columns of process_data, set on added
+    items only (see processing.split_review).
+    """
+    missing = [col for col in ('Item Name', 'Category Name', 'Rate') if col not in df_imported.columns]
+    if missing:
+        raise KeyError(f"{missing} not in index")
+
+    # --- Hash Join: first occurrence of each new item against the previous template ---
+    keep = ~df_imported['Item Name'].duplicated(keep='first').to_numpy()
+    current = pd.DataFrame({
+        'Pos Product Name': df_imported['Item Name'][keep].to_numpy(),
+        'Rate': df_imported['Rate'][keep].to_numpy(),
+        'position': np.flatnonzero(keep),
+    })
+    previous = df_previous[TEMPLATE_COLUMNS]
+    joined = current.merge(previous, on='Pos Product Name', how='outer', indicator=True, sort=False)
+
+    added = joined[joined['_merge'] == 'left_only']
+    removed = joined[joined['_merge'] == 'right_only']
+    kept = joined[joined['_merge'] == 'both']
+    if rules is None:
+        new_prices = (kept['Rate'] / 1.12).round(2).to_numpy()
+    else:
+        categories = _catalog_categories(kept['Pos Product Name'], kept['Product Id'], catalog_index, matcher,
+                                         rules.fallback_category)
+        new_prices, _, _ = rules.evaluate(kept['Rate'], categories, branch)
+    kept = kept.assign(**{'New Price': new_prices})
+    repriced = kept[~np.isclose(kept['New Price'].to_numpy(dtype=float),
+                                kept['Price'].to_numpy(dtype=float), rtol=0, atol=0.005, equal_nan=True)]
+
+    # --- Only new items are matched against the catalog ---
+    df_added, has_uncategorized_items = process_data(
+        df_imported.iloc[added['position'].to_numpy(dtype=np.int64)], catalog_index, matcher,
+        stage=stage, lean=True, constants=constants, rules=rules, branch=branch, match_details=match_details)
+    df_added = df_added.assign(**{CHANGE_COLUMN: 'added'})
+
+    df_repriced = repriced[TEMPLATE_COLUMNS].assign(Price=repriced['New Price'], **{CHANGE_COLUMN: 'repriced'})
+    df_removed = removed[TEMPLATE_COLUMNS].assign(**{CHANGE_COLUMN: 'removed'})
+
+    df_changes = pd.concat([df_added, df_repriced, df_removed], ignore_index=True)
+    columns = TEMPLATE_COLUMNS + [CHANGE_COLUMN] + (MATCH_DETAIL_COLUMNS if match_details else [])
+    return df_changes[columns], bool(has_uncategorized_items)
+
+
+def _catalog_categories(names, product_ids, catalog_index, matcher, fallback_category):
+    """The category process_data hands the rules for each kept item, before any rule renames it.
+
+    Names are looked up exactly; only items the previous template has a Product
+    Id for but the catalog has no exact name for (normalized or fuzzy matches)
+    go through the matcher. Unmatched items get fallback_category.
+    """
+    names = names.reset_index(drop=True)
+    if isinstance(catalog_index, pd.DataFrame):
+        positions = catalog_index.index.get_indexer(names)
+        found = positions >= 0
+        categories = catalog_index['Pos Categories'].to_numpy(dtype=object)[np.where(found, positions, 0)]
+    else:
+        matches = catalog_index.lookup(names)
+        found = matches['Matched Name'].notna().to_numpy()
+        categories = matches['Pos Categories'].to_numpy(dtype=object)
+    categories = np.where(found, categories, None)
+    unresolved = ~found & product_ids.notna().to_numpy()
+    if matcher is not None and unresolved.any():
+        categories[unresolved] = matcher.match(names[unresolved].reset_index(drop=True))['Pos Categories'].to_numpy()
+    return pd.Series(categories, dtype=object).fillna(fallback_category).to_numpy(dtype=object)
+
+
+def apply_delta(df_previous, df_changes):
+    """Returns the full template after applying a change set to the previous one."""
+    changed = df_changes.set_index('Pos Product Name')[CHANGE_COLUMN]
+    change = df_previous['Pos Product Name'].map(changed)
+    df_current = df_previous[change.isna() | (change == 'repriced')].copy()
+
+    repriced = df_changes[df_changes[CHANGE_COLUMN] == 'repriced'].set_index('Pos Product Name')['Price']
+    new_prices = df_current['Pos Product Name'].map(repriced)
+    df_current['Price'] = new_prices.fillna(df_current['Price'])
+
+    df_added = df_changes[df_changes[CHANGE_COLUMN] == 'added'][TEMPLATE_COLUMNS]
+    df_current = pd.concat([df_current[TEMPLATE_COLUMNS], df_added], ignore_index=True)
+    return df_current.sort_values(by='Product Id', na_position='last', kind='stable')
+
+
+class SnapshotStore:
+    """Keeps the last full template generated for each branch, keyed by its output filename."""
+
+    def __init__(self, directory=None):
+        self.directory = directory or os.path.join(tempfile.gettempdir(), 'rms-snapshots')
+        os.makedirs(self.directory, exist_ok=True)
+
+    def _path(self, name):
+        return os.path.join(self.directory, secure_filename(name) or 'template.csv')
+
+    def load(self, name):
+        """Returns the stored template as a DataFrame, or None if there is none."""
+        try:
+            return read_template(self._path(name))
+        except FileNotFoundError:
+            return None
+
+    def save(self, name, csv_data):
+        path = self._path(name)
+        temp_path = path + '.tmp'
+        with open(temp_path, 'wb') as file:
+            file.write(csv_data)
+        os.replace(temp_path, path)
@@ -0,0 +1,255 @@
+import io
+import itertools
+import os
+import struct
+import zlib
+
+import pandas as pd
+from flask import Response, request
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # Parquet and Arrow output need pyarrow; CSV never does
+    pa = None
+
+# Rows encoded per chunk; bounds the export buffer regardless of output size
+CSV_CHUNK_ROWS = 5000
+# Bytes per chunk when streaming an already encoded payload
+BYTES_CHUNK_SIZE = 64 * 1024
+# Output format -> (file extension, mimetype)
+OUTPUT_FORMATS = {
+    'csv': ('.csv', 'text/csv'),
+    'parquet': ('.parquet', 'application/vnd.apache.parquet'),
+    'arrow': ('.arrow', 'application/vnd.apache.arrow.file'),
+}
+# Columns typed as float64 in columnar outputs; every other column is text
+NUMERIC_COLUMNS = ('Price', 'Match Score')
+# Content-codings offered for CSV downloads, in order of preference
+CONTENT_ENCODINGS = ('gzip', 'deflate')
+# Compression runs on the request path: level 1 is about 4x faster than gzip's
+# default (6) on template CSVs, for output about 30% larger (still ~3.5x smaller than the CSV)
+COMPRESS_LEVEL = 1
+# Fixed gzip header (no name, no mtime) and zlib header framing a raw DEFLATE body
+GZIP_HEADER = b'\x1f\x8b\x08\x00\x00\x00\x00\x00\x00\xff'
+ZLIB_HEADER = b'\x78\x9c'
+
+
+def iter_csv(df, chunk_rows=CSV_CHUNK_ROWS):
+    """Yields the frame as UTF-8 encoded CSV, header first, chunk_rows rows at a time."""
+    yield df.iloc[:0].to_csv(index=False).encode('utf-8')
+    for start in range(0, len(df), chunk_rows):
+        yield df.iloc[start:start + chunk_rows].to_csv(index=False, header=False).encode('utf-8')
+
+
+def iter_bytes(data, chunk_size=BYTES_CHUNK_SIZE):
+    """Yields an encoded payload in fixed-size slices, copying one slice at a time.
+
+    The slices are bytes, not memoryviews: WSGI servers (werkzeug's included)
+    only accept bytes from the response iterable.
+    """
+    view = memoryview(data)
+    for start in range(0, len(view), chunk_size):
+        yield view[start:start + chunk_size].tobytes()
+
+
+def available_formats():
+    """Output formats this install can write: always CSV, Parquet and Arrow IPC when pyarrow is present."""
+    return [name for name in OUTPUT_FORMATS if name == 'csv' or pa is not None]
+
+
+def output_filename(filename, output_format):
+    """Swaps a generated .csv name for the extension of output_format."""
+    return os.path.splitext(filename)[0] + OUTPUT_FORMATS[output_format][0]
+
+
+def _arrow_table(df):
+    # Same types whether the frame comes from process_data or from a CSV read
+    # back as text: numeric columns as float64, the rest as strings with
+    # empty values as nulls
+    arrays = {}
+    for column in df.columns:
+        if column in NUMERIC_COLUMNS:
+            arrays[column] = pa.array(pd.to_numeric(df[column]).to_numpy(dtype='float64'), from_pandas=True)
+        else:
+            values = df[column].astype(object)
+            values = values.where(values.notna() & (values != ''), None)
+            arrays[column] = pa.array(values.to_numpy(), type=pa.string())
+    return pa.table(arrays)
+
+
+def encode_frame(df, output_format='csv'):
+    """Returns the frame encoded as CSV, Parquet or an Arrow IPC file."""
+    if output_format == 'csv':
+        return b''.join(iter_csv(df))
+    if output_format not in OUTPUT_FORMATS:
+        raise ValueError(f'Unknown output format {output_format!r}')
+    if pa is None:
+        raise ImportError(f'{output_format} output needs pyarrow (pip install pyarrow)')
+    table = _arrow_table(df)
+    sink = pa.BufferOutputStream()
+    if output_format == 'parquet':
+        pq.write_table(table, sink)
+    else:
+        with pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+    return sink.getvalue().to_pybytes()
+
+
+def convert_csv(csv_data, output_format):
+    """Re-encodes an already generated CSV (for example a cached one) in another format."""
+    if output_format == 'csv':
+        return csv_data
+    df = pd.read_csv(io.BytesIO(csv_data), dtype=object, keep_default_na=False)
+    return encode_frame(df, output_format)
+
+
+def convert_csv_file(csv_path, output_path, output_format, chunk_rows=100000):
+    """Re-encodes a template CSV on disk as Parquet or Arrow IPC, chunk_rows rows at a time."""
+    if pa is None:
+        raise ImportError(f'{output_format} output needs pyarrow (pip install pyarrow)')
+    writer = None
+    try:
+        for df in pd.read_csv(csv_path, dtype=object, keep_default_na=False, chunksize=chunk_rows):
+            table = _arrow_table(df)
+            if writer is None:
+                if output_format == 'parquet':
+                    writer = pq.ParquetWriter(output_path, table.schema)
+                else:
+                    writer = pa.ipc.new_file(output_path, table.schema)
+            writer.write_table(table)
+    finally:
+        if writer is not None:
+            writer.close()
+
+
+def attachment_response(chunks, filename, mimetype=None, content_length=None):
+    """Wraps a chunk generator in a streamed download response.
+
+    The mimetype defaults to the one matching the filename's output format.
+    """
+    if mimetype is None:
+        extension = os.path.splitext(filename)[1].lower()
+        mimetype = next((mime for ext, mime in OUTPUT_FORMATS.values() if ext == extension), 'text/csv')
+    response = Response(chunks, mimetype=mimetype)
+    response.headers.set('Content-Disposition', 'attachment', filename=filename)
+    if content_length is not None:
+        response.content_length = content_length
+    return response
+
+
+# --- Compressed Downloads ---
+
+def compress(data, level=COMPRESS_LEVEL):
+    """Compresses a payload once for every content-coding in CONTENT_ENCODINGS.
+
+    Returns {'body', 'size', 'crc32', 'adler32'}. body is a raw DEFLATE stream;
+    gzip and deflate responses carry the same body between a few header and
+    trailer bytes (see encoding_frame), so one compression serves both.
+    """
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS)
+    return {
+        'body': compressor.compress(data) + compressor.flush(),
+        'size': len(data),
+        'crc32': zlib.crc32(data),
+        'adler32': zlib.adler32(data),
+    }
+
+
+def encoding_frame(encoding, compression):
+    """(header, trailer) that make a compress() body valid `encoding` content."""
+    if encoding == 'gzip':
+        return GZIP_HEADER, struct.pack('<II', compression['crc32'], compression['size'] & 0xffffffff)
+    if encoding == 'deflate':
+        return ZLIB_HEADER, struct.pack('>I', compression['adler32'])
+    raise ValueError(f'Unknown content-coding {encoding!r}')
+
+
+def iter_inflate(chunks):
+    """Yields the payload of a compress() body streamed as chunks."""
+    decompressor = zlib.decompressobj(-zlib.MAX_WBITS)
+    for chunk in chunks:
+        data = decompressor.decompress(chunk)
+        if data:
+            yield data
+    data = decompressor.flush()
+    if data:
+        yield data
+
+
+def accepted_encoding():
+    """The content-coding in CONTENT_ENCODINGS that Accept-Encoding prefers, or None."""
+    return request.accept_encodings.best_match(CONTENT_ENCODINGS)
+
+
+def iter_encoded(chunks, encoding=None, on_complete=None, level=COMPRESS_LEVEL):
+    """Streams chunks as `encoding` content ('gzip', 'deflate' or None for as-is), compressing as they pass.
+
+    on_complete(data, compression), if given, is called once the chunks run
+    out with the whole payload and its compress() dict, so the result cache
+    can keep both without compressing the payload a second time.
+    """
+    if encoding is None:
+        parts = []
+        for chunk in chunks:
+            if on_complete is not None:
+                parts.append(chunk)
+            yield chunk
+        if on_complete is not None:
+            data = b''.join(parts)
+            on_complete(data, compress(data, level))
+        return
+    if encoding not in CONTENT_ENCODINGS:
+        raise ValueError(f'Unknown content-coding {encoding!r}')
+
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS)
+    parts, blocks = [], []
+    size, crc32, adler32 = 0, 0, 1
+    yield GZIP_HEADER if encoding == 'gzip' else ZLIB_HEADER
+    for chunk in chunks:
+        size += len(chunk)
+        crc32 = zlib.crc32(chunk, crc32)
+        adler32 = zlib.adler32(chunk, adler32)
+        block = compressor.compress(chunk)
+        if on_complete is not None:
+            parts.append(chunk)
+            blocks.append(block)
+        if block:
+            yield block
+    block = compressor.flush()
+    blocks.append(block)
+    yield block
+    compression = {'body': b''.join(blocks), 'size': size, 'crc32': crc32, 'adler32': adler32}
+    yield encoding_frame(encoding, compression)[1]
+    if on_complete is not None:
+        on_complete(b''.join(parts), compression)
+
+
+def _closing(response, chunks):
+    # The header/trailer and inflate wrappers hide the chunks' close(), which a
+    # stored download needs even when the body is never sent (HEAD, early disconnect)
+    close = getattr(chunks, 'close', None)
+    if close is not None:
+        response.call_on_close(close)
+    return response
+
+
+def download_response(chunks, filename, size, compression=None):
+    """attachment_response for a stored download of `size` bytes.
+
+    When the chunks are a compress() body (compression holds its checksums),
+    the response is gzip- or deflate-encoded, whichever Accept-Encoding prefers;
+    clients that accept neither get it decompressed on the fly.
+    """
+    if compression is None:
+        return _closing(attachment_response(chunks, filename, content_length=size), chunks)
+    encoding = accepted_encoding()
+    if encoding is None:
+        response = attachment_response(iter_inflate(chunks), filename, content_length=compression['size'])
+    else:
+        header, trailer = encoding_frame(encoding, compression)
+        response = attachment_response(itertools.chain([header], chunks, [trailer]), filename,
+                                       content_length=len(header) + size + len(trailer))
+        response.content_encoding = encoding
+    response.vary.add('Accept-Encoding')
+    return _closing(response, chunks)
@@ -0,0 +1,201 @@
+import os
+import sys
+import time
+import zipfile
+
+import pandas as pd
+from openpyxl import load_workbook
+
+try:
+    import pyarrow.parquet as pq
+except ImportError:  # Parquet uploads and the multithreaded CSV parser need pyarrow
+    pq = None
+
+# The only workbook columns process_data needs
+REQUIRED_COLUMNS = ['Item Name', 'Category Name', 'Rate']
+# How far down the sheet to look for the header row
+HEADER_SCAN_ROWS = 20
+# Upload types read_workbook accepts
+INPUT_EXTENSIONS = ('.xlsx', '.xls', '.csv', '.parquet')
+# Leading bytes of a Parquet file and of a legacy (OLE) .xls workbook
+PARQUET_MAGIC = b'PAR1'
+XLS_MAGIC = b'\xd0\xcf\x11\xe0'
+# Parse hints for the projected columns, so nothing is inferred
+COLUMN_DTYPES = {'Item Name': 'str', 'Category Name': 'str', 'Rate': 'float64'}
+
+
+def _find_header(rows):
+    """Returns (row number, {column name: position}) for the first row holding every required column."""
+    for row_number, row in enumerate(rows, start=1):
+        positions = {}
+        for position, cell in enumerate(row):
+            name = str(cell).strip() if cell is not None else ''
+            if name in REQUIRED_COLUMNS and name not in positions:
+                positions[name] = position
+        if len(positions) == len(REQUIRED_COLUMNS):
+            return row_number, positions
+    raise KeyError(f"Workbook is missing one of the required columns {REQUIRED_COLUMNS}")
+
+
+def _iter_xlsx(file, chunk_rows=None):
+    if _is_path(file):
+        # openpyxl judges a path by its extension, which spooled uploads lack; the zip is read from disk either way
+        with open(file, 'rb') as opened:
+            yield from _iter_xlsx(opened, chunk_rows)
+        return
+    workbook = load_workbook(file, read_only=True, data_only=True)
+    try:
+        worksheet = workbook.worksheets[0]
+        header_row, positions = _find_header(
+            worksheet.iter_rows(max_row=HEADER_SCAN_ROWS, values_only=True))
+        # Stop each row at the last column we need instead of materializing every cell
+        rows = worksheet.iter_rows(min_row=header_row + 1, max_col=max(positions.values()) + 1,
+                                   values_only=True)
+        columns = {name: [] for name in REQUIRED_COLUMNS}
+        count, yielded = 0, False
+        for row in rows:
+            values = [row[positions[name]] if positions[name] < len(row) else None
+                      for name in REQUIRED_COLUMNS]
+            if all(value is None for value in values):
+                continue
+            for name, value in zip(REQUIRED_COLUMNS, values):
+                columns[name].append(value)
+            count += 1
+            if count == chunk_rows:
+                yield _xlsx_frame(columns)
+                columns = {name: [] for name in REQUIRED_COLUMNS}
+                count, yielded = 0, True
+        if count or not yielded:
+            yield _xlsx_frame(columns)
+    finally:
+        workbook.close()
+
+
+def _xlsx_frame(columns):
+    df = pd.DataFrame(columns)
+    df['Rate'] = pd.to_numeric(df['Rate'])
+    return df
+
+
+def _iter_xls(file, chunk_rows=None):
+    # Legacy .xls has no streaming reader; still skip every column we don't use
+    df = pd.read_excel(file, usecols=lambda column: str(column).strip() in REQUIRED_COLUMNS)
+    if chunk_rows is None:
+        yield df
+        return
+    for start in range(0, max(len(df), 1), chunk_rows):
+        yield df.iloc[start:start + chunk_rows]
+
+
+def _projected_names(header):
+    """Maps each required column to its name in `header`, which may carry stray whitespace."""
+    _, positions = _find_header([header])
+    return {name: header[positions[name]] for name in REQUIRED_COLUMNS}
+
+
+def _iter_csv(file, chunk_rows=None):
+    # Read the header alone, then parse only the three columns with fixed dtypes
+    names = _projected_names(list(pd.read_csv(file, nrows=0, encoding='utf-8-sig').columns))
+    if not _is_path(file):
+        file.seek(0)
+    options = {'usecols': list(names.values()), 'encoding': 'utf-8-sig',
+               'dtype': {names[name]: dtype for name, dtype in COLUMN_DTYPES.items()}}
+    if chunk_rows is None:
+        frames = [pd.read_csv(file, engine='c' if pq is None else 'pyarrow', **options)]
+    else:
+        # The pyarrow engine cannot read in chunks
+        frames = pd.read_csv(file, chunksize=chunk_rows, **options)
+    for df in frames:
+        df = df.rename(columns={column: name for name, column in names.items()})[REQUIRED_COLUMNS]
+        yield df.dropna(how='all').reset_index(drop=True)
+
+
+def _iter_parquet(file, chunk_rows=None):
+    if pq is None:
+        raise ImportError('Parquet uploads need pyarrow (pip install pyarrow)')
+    # A file on disk is memory-mapped instead of read through Python
+    parquet_file = pq.ParquetFile(file, memory_map=_is_path(file))
+    names = _projected_names(parquet_file.schema_arrow.names)
+    # Only the three column chunks are read and decoded
+    columns = list(names.values())
+    if chunk_rows is None:
+        tables = [parquet_file.read(columns=columns)]
+    else:
+        tables = parquet_file.iter_batches(batch_size=chunk_rows, columns=columns)
+    for table in tables:
+        df = table.to_pandas()
+        df = df.rename(columns={column: name for name, column in names.items()})[REQUIRED_COLUMNS]
+        df['Rate'] = pd.to_numeric(df['Rate'])
+        yield df
+
+
+def _is_path(source):
+    return isinstance(source, (str, os.PathLike))
+
+
+def _reader(file):
+    """Picks the frame iterator for an upload (a file object or path) from its leading bytes."""
+    if _is_path(file):
+        with open(file, 'rb') as opened:
+            return _reader(opened)
+    if zipfile.is_zipfile(file):
+        file.seek(0)
+        return _iter_xlsx
+    file.seek(0)
+    head = file.read(len(PARQUET_MAGIC))
+    file.seek(0)
+    if head == PARQUET_MAGIC:
+        return _iter_parquet
+    if head == XLS_MAGIC:
+        return _iter_xls
+    return _iter_csv
+
+
+def read_workbook(file):
+    """Reads only Item Name / Category Name / Rate from an uploaded workbook, CSV or Parquet file.
+
+    file is a binary file object or a path; a path lets every reader work on
+    the file on disk. The format is taken from the content, not the filename. .xlsx files (ZIP
+    containers) are streamed row by row through openpyxl's read-only mode,
+    Parquet reads just the three column chunks, CSV is parsed with column
+    projection and dtype hints, and legacy .xls goes through pandas.
+    """
+    [df] = _reader(file)(file)
+    return df
+
+
+def iter_workbook_chunks(file, chunk_rows):
+    """Yields the same columns as read_workbook in frames of at most chunk_rows rows.
+
+    xlsx, CSV and Parquet are read incrementally; legacy .xls is read whole
+    and then sliced.
+    """
+    return _reader(file)(file, chunk_rows)
+
+
+# Unprojected pandas reader per upload type, for compare_read_times
+FULL_READERS = {'.csv': pd.read_csv, '.parquet': pd.read_parquet}
+
+
+def compare_read_times(path, repeat=3):
+    """Times the projected reader against a full pandas read (read_excel, read_csv or read_parquet) of the same file."""
+    timings = {}
+    full_reader = FULL_READERS.get(os.path.splitext(path)[1].lower(), pd.read_excel)
+    for label, reader in (('full read', full_reader), ('projected', read_workbook)):
+        best = None
+        for _ in range(repeat):
+            with open(path, 'rb') as file:
+                start = time.perf_counter()
+                reader(file)
+                elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        timings[label] = best
+    return timings
+
+
+if __name__ == '__main__':
+    for workbook_path in sys.argv[1:]:
+        timings = compare_read_times(workbook_path)
+        full, projected = timings['full read'], timings['projected']
+        print(f"{workbook_path}: full read {full:.3f}s, projected read {projected:.3f}s "
+              f"({full / projected:.1f}x faster)")
@@ -0,0 +1,145 @@
+import json
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# Stages reported by upload jobs, in order
+STAGES = ['queued', 'parsing', 'matching', 'exporting', 'done']
+# Finished jobs are forgotten after this many seconds
+JOB_TTL = 15 * 60
+# How often (seconds) the shared state directory is swept for expired jobs
+STATE_SWEEP_INTERVAL = 60
+
+
+class JobQueue:
+    """Runs pipeline jobs on a local worker pool and tracks their stage-level progress.
+
+    A job function is called as func(report, *args); it calls report(stage) as it
+    moves through STAGES and returns a dict that is merged into the job record.
+    With shared=True every record change is also written to state_dir, so a
+    worker process that did not run the job can still report its status.
+    """
+
+    def __init__(self, max_workers=None, ttl=JOB_TTL, shared=False, state_dir=None):
+        self.ttl = ttl
+        self.shared = shared
+        self.state_dir = state_dir or os.path.join(tempfile.gettempdir(), 'rms-jobs')
+        if shared:
+            os.makedirs(self.state_dir, exist_ok=True)
+        self._pool = ThreadPoolExecutor(max_workers=max_workers or os.cpu_count() or 1,
+                                        thread_name_prefix='rms-job')
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self._last_state_sweep = 0.0
+
+    def submit(self, func, *args):
+        """Queues func and returns the new job id immediately."""
+        job_id = os.urandom(16).hex()
+        with self._lock:
+            self._prune_locked()
+            self._jobs[job_id] = {
+                'job_id': job_id,
+                'status': 'queued',
+                'stage': 'queued',
+                'progress': 0.0,
+                'error': None,
+                'finished_at': None,
+            }
+            self._write_state_locked(job_id)
+        self._sweep_state()
+        self._pool.submit(self._run, job_id, func, args)
+        return job_id
+
+    def get(self, job_id):
+        """Returns a snapshot of the job record, or None for unknown/expired jobs."""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is not None:
+                return dict(job)
+        return self._read_state(job_id) if self.shared else None
+
+    def shutdown(self, wait=True):
+        """Stops taking jobs; with wait=True, returns once queued and running jobs have finished."""
+        self._pool.shutdown(wait=wait)
+
+    def stats(self):
+        with self._lock:
+            counts = {}
+            for job in self._jobs.values():
+                counts[job['status']] = counts.get(job['status'], 0) + 1
+            return counts
+
+    def _report(self, job_id, stage):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is not None:
+                job['status'] = 'running'
+                job['stage'] = stage
+                job['progress'] = STAGES.index(stage) / (len(STAGES) - 1)
+                self._write_state_locked(job_id)
+
+    def _run(self, job_id, func, args):
+        try:
+            result = func(lambda stage: self._report(job_id, stage), *args)
+        except Exception as e:
+            update = {'status': 'error', 'error': str(e)}
+        else:
+            update = dict(result or {}, status='done', stage='done', progress=1.0)
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is not None:
+                job.update(update, finished_at=time.monotonic())
+                self._write_state_locked(job_id)
+
+    def _prune_locked(self):
+        cutoff = time.monotonic() - self.ttl
+        expired = [job_id for job_id, job in self._jobs.items()
+                   if job['finished_at'] is not None and job['finished_at'] < cutoff]
+        for job_id in expired:
+            del self._jobs[job_id]
+
+    # --- Shared State ---
+
+    def _state_path(self, job_id, suffix='.json'):
+        # Ids come from the URL, so never let them name arbitrary paths
+        if not job_id.isalnum():
+            job_id = 'invalid'
+        return os.path.join(self.state_dir, job_id + suffix)
+
+    def _write_state_locked(self, job_id):
+        if not self.shared:
+            return
+        # Written to a temp name and renamed so readers only see complete records
+        temp_path = self._state_path(job_id, '.tmp')
+        with open(temp_path, 'w') as file:
+            json.dump({key: value for key, value in self._jobs[job_id].items() if key != 'finished_at'}, file)
+        os.replace(temp_path, self._state_path(job_id))
+
+    def _read_state(self, job_id):
+        path = self._state_path(job_id)
+        try:
+            if os.path.getmtime(path) + self.ttl <= time.time():
+                return None
+            with open(path) as file:
+                return json.load(file)
+        except (OSError, ValueError):
+            return None
+
+    def _sweep_state(self):
+        now = time.time()
+        if not self.shared or now - self._last_state_sweep < STATE_SWEEP_INTERVAL:
+            return
+        self._last_state_sweep = now
+        try:
+            names = os.listdir(self.state_dir)
+        except OSError:
+            return
+        for name in names:
+            path = os.path.join(self.state_dir, name)
+            try:
+                if os.path.getmtime(path) + self.ttl <= now:
+                    os.remove(path)
+            except OSError:
+                continue
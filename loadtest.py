@@ -0,0 +1,509 @@
+"""Load test for the upload -> redirect -> /download flow of a running server.
+
+    python loadtest.py --start --workers 2 --concurrency 1 4 16 --duration 30
+    python loadtest.py --url http://127.0.0.1:8000 --server-pid 4242 --concurrency 8 --requests 200
+    python loadtest.py --start --concurrency 1 4 16 --baseline loadtest_results.json
+
+Each virtual user keeps its own connection and session cookie and repeats what
+a browser does: POST a generated branch workbook to /, follow the redirect to
+the success page, then GET /download with gzip accepted. --flow jobs submits
+to /jobs and polls the job instead, like the upload page's script. Uploads
+send refresh=1, so every cycle is processed in full; --cache lets the result
+cache answer repeats.
+
+Concurrency levels run one after another, for --duration seconds or
+--requests cycles each, and report throughput, p50/p95/p99 cycle latency and
+the error rate. The server's RSS and PSS (which counts pages shared by
+preforked workers once) are sampled from /proc over the whole run, for the
+server process and all its children.
+
+Nothing leaves the machine: workbooks are generated from a synthetic catalog
+(bench.generate_catalog), which --start serves through serve.py on a free
+local port. Against --url, they are generated from --catalog instead.
+"""
+import argparse
+import http.client
+import io
+import json
+import os
+import platform
+import signal
+import socket
+import subprocess
+import sys
+import threading
+import time
+import uuid
+from http.cookies import SimpleCookie
+from urllib.parse import urlsplit
+
+import numpy as np
+import pandas as pd
+
+from bench import generate_branch, generate_catalog
+
+# Level-over-baseline ratios that count as a regression: p95 latency up, throughput down
+REGRESSION_THRESHOLD = 1.25
+# Seconds a started server gets to report ready on /readyz
+STARTUP_TIMEOUT = 300
+# Timeline rows printed per run; the JSON output keeps every sample
+TIMELINE_ROWS = 20
+
+
+# --- Workbooks ---
+
+def generate_workbooks(df_catalog, count, rows, workbook_format='xlsx', seed=0):
+    """Returns `count` distinct (filename, bytes) branch uploads drawn from df_catalog."""
+    workbooks = []
+    for number in range(count):
+        df = generate_branch(rows, df_catalog, seed=seed + number)
+        buffer = io.BytesIO()
+        if workbook_format == 'xlsx':
+            df.to_excel(buffer, index=False)
+        else:
+            df.to_csv(buffer, index=False)
+        workbooks.append((f'Branch_{number}.{workbook_format}', buffer.getvalue()))
+    return workbooks
+
+
+def _multipart(fields, file_field, filename, data):
+    boundary = uuid.uuid4().hex
+    parts = [f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode()
+             for name, value in fields.items()]
+    parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="{file_field}"; filename="{filename}"\r\n'
+                 f'Content-Type: application/octet-stream\r\n\r\n'.encode() + data + b'\r\n')
+    parts.append(f'--{boundary}--\r\n'.encode())
+    return b''.join(parts), f'multipart/form-data; boundary={boundary}'
+
+
+# --- Virtual Users ---
+
+class CycleError(Exception):
+    """A cycle step got an unexpected answer; str() is the step and what came back."""
+
+
+class VirtualUser:
+    """One browser: a keep-alive connection, a session cookie and the upload cycle."""
+
+    def __init__(self, host, port, flow='form', cache=False, poll_interval=0.5, timeout=300):
+        self.host = host
+        self.port = port
+        self.flow = flow
+        self.fields = {} if cache else {'refresh': '1'}
+        self.poll_interval = poll_interval
+        self.timeout = timeout
+        self.cookies = {}
+        self._connection = None
+
+    def request(self, method, path, body=None, headers=None):
+        """(status, headers, body) of one request; reconnects once if the kept-alive connection dropped."""
+        headers = dict(headers or {})
+        if self.cookies:
+            headers['Cookie'] = '; '.join(f'{name}={value}' for name, value in self.cookies.items())
+        for attempt in (0, 1):
+            if self._connection is None:
+                self._connection = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+            try:
+                self._connection.request(method, path, body, headers)
+                response = self._connection.getresponse()
+                data = response.read()
+                break
+            except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+                self.close()
+                if attempt:
+                    raise
+        for header in response.headers.get_all('Set-Cookie') or []:
+            for name, morsel in SimpleCookie(header).items():
+                self.cookies[name] = morsel.value
+        if response.getheader('Connection', '').lower() == 'close':
+            self.close()
+        return response.status, response.headers, data
+
+    def close(self):
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+
+    def cycle(self, filename, data):
+        """Runs one full upload cycle; returns {step: seconds} plus 'download_bytes'."""
+        timings = {}
+        start = time.perf_counter()
+        if self.flow == 'jobs':
+            redirect = self._submit_job(filename, data, timings)
+        else:
+            body, content_type = _multipart(self.fields, 'file', filename, data)
+            status, headers, _ = self.request('POST', '/', body, {'Content-Type': content_type})
+            if status != 302:
+                raise CycleError(f'upload {status}')
+            redirect = urlsplit(headers['Location'])
+            redirect = redirect.path + (f'?{redirect.query}' if redirect.query else '')
+            timings['upload'] = time.perf_counter() - start
+
+        step = time.perf_counter()
+        status, _, _ = self.request('GET', redirect)
+        if status != 200:
+            raise CycleError(f'page {status}')
+        timings['page'] = time.perf_counter() - step
+
+        step = time.perf_counter()
+        status, headers, body = self.request('GET', '/download', headers={'Accept-Encoding': 'gzip'})
+        # A redirect instead of the file means this worker could not find the stored result
+        if status != 200 or 'attachment' not in headers.get('Content-Disposition', ''):
+            raise CycleError(f'download {status}')
+        timings['download'] = time.perf_counter() - step
+        timings['cycle'] = time.perf_counter() - start
+        timings['download_bytes'] = len(body)
+        return timings
+
+    def _submit_job(self, filename, data, timings):
+        start = time.perf_counter()
+        body, content_type = _multipart(self.fields, 'file', filename, data)
+        status, _, text = self.request('POST', '/jobs', body, {'Content-Type': content_type})
+        if status != 202:
+            raise CycleError(f'submit {status}')
+        status_url = json.loads(text)['status_url']
+        timings['upload'] = time.perf_counter() - start
+        while True:
+            time.sleep(self.poll_interval)
+            status, _, text = self.request('GET', status_url)
+            if status != 200:
+                raise CycleError(f'job status {status}')
+            job = json.loads(text)
+            if job['status'] == 'done':
+                timings['job'] = time.perf_counter() - start
+                return job['redirect']
+            if job['status'] == 'error':
+                raise CycleError('job error')
+
+
+# --- Server ---
+
+def start_server(catalog_path, workers, workdir, port=None):
+    """Starts serve.py on catalog_path; returns (process, port) once /readyz answers 200."""
+    if port is None:
+        with socket.socket() as probe:
+            probe.bind(('127.0.0.1', 0))
+            port = probe.getsockname()[1]
+    brands_path = os.path.join(workdir, 'loadtest_brands.json')
+    with open(brands_path, 'w') as file:
+        json.dump({'rms': {'basis': os.path.abspath(catalog_path)}}, file)
+    env = dict(os.environ, RMS_BRANDS=brands_path)
+    log = open(os.path.join(workdir, 'loadtest_server.log'), 'wb')
+    process = subprocess.Popen(
+        [sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'serve.py'),
+         '--bind', f'127.0.0.1:{port}', '--workers', str(workers)],
+        env=env, stdout=log, stderr=subprocess.STDOUT)
+    deadline = time.monotonic() + STARTUP_TIMEOUT
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f'serve.py exited with {process.returncode}; see {log.name}')
+        try:
+            connection = http.client.HTTPConnection('127.0.0.1', port, timeout=5)
+            connection.request('GET', '/readyz')
+            if connection.getresponse().status == 200:
+                return process, port
+        except OSError:
+            pass
+        time.sleep(0.2)
+    stop_server(process)
+    raise RuntimeError(f'serve.py was not ready within {STARTUP_TIMEOUT}s; see {log.name}')
+
+
+def stop_server(process, timeout=60):
+    process.send_signal(signal.SIGTERM)
+    try:
+        process.wait(timeout)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.wait()
+
+
+def _process_tree(pid):
+    """pid and all its descendants, from /proc."""
+    parents = {}
+    for name in os.listdir('/proc'):
+        if not name.isdigit():
+            continue
+        try:
+            with open(f'/proc/{name}/stat') as file:
+                # The command name may hold spaces; fields after it are fixed
+                parents[int(name)] = int(file.read().rsplit(')', 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+    tree, pending = [], [pid]
+    while pending:
+        current = pending.pop()
+        tree.append(current)
+        pending.extend(child for child, parent in parents.items() if parent == current)
+    return tree
+
+
+def _memory_kb(pid, path, field):
+    try:
+        with open(f'/proc/{pid}/{path}') as file:
+            for line in file:
+                if line.startswith(field):
+                    return int(line.split()[1])
+    except (OSError, ValueError):
+        pass
+    return 0
+
+
+class MemorySampler:
+    """Samples the RSS and PSS of a server's process tree on a background thread."""
+
+    def __init__(self, pid, interval=1.0):
+        self.pid = pid
+        self.interval = interval
+        self.samples = []
+        # Concurrency level running now, recorded with each sample
+        self.level = None
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._start = time.monotonic()
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def sample(self, label=None):
+        pids = _process_tree(self.pid)
+        self.samples.append({
+            'seconds': round(time.monotonic() - self._start, 3),
+            'level': label,
+            'processes': len(pids),
+            'rss_mb': round(sum(_memory_kb(pid, 'status', 'VmRSS:') for pid in pids) / 1024, 1),
+            'pss_mb': round(sum(_memory_kb(pid, 'smaps_rollup', 'Pss:') for pid in pids) / 1024, 1),
+        })
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.sample(self.level)
+
+
+# --- Running Levels ---
+
+def run_level(host, port, workbooks, concurrency, args, sampler=None):
+    """Runs `concurrency` virtual users for args.duration seconds or args.requests cycles."""
+    if sampler is not None:
+        sampler.level = concurrency
+    users = [VirtualUser(host, port, args.flow, args.cache, args.poll_interval, args.timeout)
+             for _ in range(concurrency)]
+    results, lock = [], threading.Lock()
+    counter = iter(range(sys.maxsize))
+    deadline = time.monotonic() + args.duration if args.duration else None
+
+    def work(user):
+        while True:
+            with lock:
+                number = next(counter)
+            if args.requests and number >= args.requests:
+                break
+            if deadline is not None and time.monotonic() >= deadline:
+                break
+            filename, data = workbooks[number % len(workbooks)]
+            start = time.perf_counter()
+            try:
+                outcome = user.cycle(filename, data)
+            except CycleError as e:
+                outcome = {'error': str(e)}
+            except (OSError, http.client.HTTPException) as e:
+                user.close()
+                outcome = {'error': type(e).__name__}
+            outcome.setdefault('cycle', time.perf_counter() - start)
+            with lock:
+                results.append(outcome)
+        user.close()
+
+    start = time.perf_counter()
+    threads = [threading.Thread(target=work, args=(user,)) for user in users]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return summarize(concurrency, results, time.perf_counter() - start)
+
+
+def summarize(concurrency, results, elapsed):
+    ok = [result for result in results if 'error' not in result]
+    errors = {}
+    for result in results:
+        if 'error' in result:
+            errors[result['error']] = errors.get(result['error'], 0) + 1
+    summary = {
+        'concurrency': concurrency,
+        'cycles': len(results),
+        'errors': errors,
+        'error_rate': round(sum(errors.values()) / len(results), 4) if results else 0.0,
+        'seconds': round(elapsed, 3),
+        'throughput': round(len(ok) / elapsed, 3) if elapsed else 0.0,
+        'latency': {},
+    }
+    if ok:
+        for step in sorted({step for result in ok for step in result if step != 'download_bytes'}):
+            seconds = np.array([result[step] for result in ok if step in result])
+            p50, p95, p99 = np.percentile(seconds, [50, 95, 99])
+            summary['latency'][step] = {'p50': round(p50, 4), 'p95': round(p95, 4), 'p99': round(p99, 4),
+                                        'max': round(seconds.max(), 4)}
+        summary['download_bytes'] = int(np.mean([result['download_bytes'] for result in ok]))
+    return summary
+
+
+# --- Baseline Comparison ---
+
+def compare(results, baseline, threshold=REGRESSION_THRESHOLD):
+    """Returns (concurrency, metric, baseline, current, ratio) for every level that got worse.
+
+    p95 cycle latency and throughput regress beyond threshold; any rise in the
+    error rate is a regression (its ratio is None).
+    """
+    regressions = []
+    previous_levels = {level['concurrency']: level for level in baseline['levels']}
+    for level in results['levels']:
+        previous = previous_levels.get(level['concurrency'])
+        if previous is None or 'cycle' not in level['latency'] or 'cycle' not in previous['latency']:
+            continue
+        before, after = previous['latency']['cycle']['p95'], level['latency']['cycle']['p95']
+        ratio = after / before if before else 1.0
+        print(f"  c={level['concurrency']:<4} p95 {before:.3f}s -> {after:.3f}s x{ratio:.2f}, "
+              f"throughput {previous['throughput']:.2f}/s -> {level['throughput']:.2f}/s")
+        if ratio > threshold:
+            regressions.append((level['concurrency'], 'p95', before, after, ratio))
+        if level['throughput'] and previous['throughput'] / level['throughput'] > threshold:
+            regressions.append((level['concurrency'], 'throughput', previous['throughput'], level['throughput'],
+                                level['throughput'] / previous['throughput']))
+        if level['error_rate'] > previous['error_rate']:
+            regressions.append((level['concurrency'], 'error_rate', previous['error_rate'], level['error_rate'],
+                                None))
+    return regressions
+
+
+def print_level(level):
+    cycle = level['latency'].get('cycle', {})
+    print(f"c={level['concurrency']:<4} {level['cycles']:>6} cycles in {level['seconds']:>7.1f}s  "
+          f"{level['throughput']:>7.2f}/s  p50 {cycle.get('p50', 0):.3f}s  p95 {cycle.get('p95', 0):.3f}s  "
+          f"p99 {cycle.get('p99', 0):.3f}s  errors {level['error_rate']:.1%}"
+          + (f"  {level['errors']}" if level['errors'] else ''))
+
+
+def print_timeline(samples, rows=TIMELINE_ROWS):
+    if not samples:
+        return
+    print('Server memory:')
+    step = max(1, len(samples) // rows)
+    for sample in samples[::step]:
+        print(f"  {sample['seconds']:>8.1f}s  c={sample['level'] or '-':<4} rss {sample['rss_mb']:>8.1f} MB  "
+              f"pss {sample['pss_mb']:>8.1f} MB  ({sample['processes']} processes)")
+    peak = max(samples, key=lambda sample: sample['rss_mb'])
+    print(f"  peak rss {peak['rss_mb']:.1f} MB at c={peak['level']}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    target = parser.add_mutually_exclusive_group()
+    target.add_argument('--start', action='store_true', help='start serve.py on a generated catalog')
+    target.add_argument('--url', default='http://127.0.0.1:8000', help='server to test (default: %(default)s)')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='serve.py workers with --start')
+    parser.add_argument('--server-pid', type=int, help='pid whose process tree is sampled (with --url)')
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 4, 16],
+                        help='simultaneous users, one level after another')
+    parser.add_argument('--duration', type=float, default=30.0, help='seconds per level (0: use --requests)')
+    parser.add_argument('--requests', type=int, default=0, help='cycles per level (0: use --duration)')
+    parser.add_argument('--flow', choices=('form', 'jobs'), default='form',
+                        help='upload form post (default) or /jobs with polling')
+    parser.add_argument('--cache', action='store_true', help="let the result cache answer repeated workbooks")
+    parser.add_argument('--rows', type=int, default=2000, help='rows per generated workbook')
+    parser.add_argument('--workbooks', type=int, default=20, help='distinct workbooks uploaded in turn')
+    parser.add_argument('--workbook-format', choices=('xlsx', 'csv'), default='xlsx')
+    parser.add_argument('--catalog-rows', type=int, default=20000, help='generated catalog size with --start')
+    parser.add_argument('--catalog', default='basis_data.csv', help='catalog the workbooks draw names from (with --url)')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--poll-interval', type=float, default=0.5, help='seconds between /jobs polls')
+    parser.add_argument('--timeout', type=float, default=300.0, help='seconds before a request counts as failed')
+    parser.add_argument('--sample-interval', type=float, default=1.0, help='seconds between memory samples')
+    parser.add_argument('--workdir', default='bench_data', help='where generated inputs and the server log go')
+    parser.add_argument('--output', default='loadtest_results.json')
+    parser.add_argument('--baseline', help='results JSON to compare against')
+    parser.add_argument('--threshold', type=float, default=REGRESSION_THRESHOLD)
+    args = parser.parse_args(argv)
+    if not args.duration and not args.requests:
+        parser.error('one of --duration or --requests must be set')
+
+    os.makedirs(args.workdir, exist_ok=True)
+    if args.start:
+        catalog_path = os.path.join(args.workdir, f'catalog_{args.catalog_rows}_{args.seed}.csv')
+        if not os.path.exists(catalog_path):
+            generate_catalog(args.catalog_rows, args.seed).to_csv(catalog_path, index=False)
+    else:
+        catalog_path = args.catalog
+    workbooks = generate_workbooks(pd.read_csv(catalog_path), args.workbooks, args.rows, args.workbook_format,
+                                   args.seed)
+
+    server = None
+    if args.start:
+        print(f'Starting serve.py with {args.workers} workers on {catalog_path}...')
+        server, port = start_server(catalog_path, args.workers, args.workdir)
+        host, server_pid = '127.0.0.1', server.pid
+    else:
+        url = urlsplit(args.url)
+        host, port, server_pid = url.hostname, url.port or 80, args.server_pid
+
+    sampler = None
+    if server_pid and os.path.isdir('/proc'):
+        sampler = MemorySampler(server_pid, args.sample_interval).start()
+        sampler.sample()
+    results = {
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': sys.version.split()[0],
+        'machine': platform.machine(),
+        'cpus': os.cpu_count(),
+        'settings': {key: value for key, value in vars(args).items() if key not in ('output', 'baseline')},
+        'levels': [],
+    }
+    try:
+        # One untimed cycle loads whatever the server loads lazily
+        try:
+            VirtualUser(host, port, args.flow, args.cache, args.poll_interval, args.timeout).cycle(*workbooks[0])
+        except (CycleError, OSError, http.client.HTTPException) as e:
+            print(f'Warm-up cycle failed ({e or type(e).__name__}); measuring anyway')
+        for concurrency in args.concurrency:
+            level = run_level(host, port, workbooks, concurrency, args, sampler)
+            if sampler is not None:
+                level_samples = [sample for sample in sampler.samples if sample['level'] == concurrency]
+                if level_samples:
+                    level['peak_rss_mb'] = max(sample['rss_mb'] for sample in level_samples)
+                    level['peak_pss_mb'] = max(sample['pss_mb'] for sample in level_samples)
+            results['levels'].append(level)
+            print_level(level)
+    finally:
+        if sampler is not None:
+            sampler.stop()
+            results['memory'] = sampler.samples
+        if server is not None:
+            stop_server(server)
+
+    if sampler is not None:
+        print_timeline(sampler.samples)
+    with open(args.output, 'w') as file:
+        json.dump(results, file, indent=2)
+    print(f'Results written to {args.output}')
+
+    if args.baseline:
+        with open(args.baseline) as file:
+            baseline = json.load(file)
+        print(f'Comparison against {args.baseline}:')
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            for concurrency, metric, before, after, _ in regressions:
+                print(f'  regression at c={concurrency}: {metric} {before} -> {after}')
+            print(f'{len(regressions)} regression(s) against the baseline (threshold x{args.threshold:.2f})')
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,219 @@
+import numpy as np
+import pandas as pd
+
+# Word-level rewrites applied after lower-casing, so 'W/' and 'with' compare equal
+ABBREVIATIONS = {
+    r'\bw/\s*': 'with ',
+    r'&': ' and ',
+    r'\bpcs?\b': 'piece',
+    r'\bpieces\b': 'piece',
+    r'\bchkn\b': 'chicken',
+    r'\bbfast\b': 'breakfast',
+}
+# Fuzzy matches scoring below this trigram Jaccard similarity are left unmatched
+MIN_SIMILARITY = 0.6
+# Prefix trigrams shared by more catalog names than this are too common to block on
+MAX_BLOCK_SIZE = 200
+# Leftover names resolved per batch, bounding the candidate tables
+FUZZY_BATCH_SIZE = 2000
+
+
+def normalize_names(names):
+    """Lower-cases, expands abbreviations, strips punctuation and collapses whitespace."""
+    normalized = names.astype('string').str.lower()
+    for pattern, replacement in ABBREVIATIONS.items():
+        normalized = normalized.str.replace(pattern, replacement, regex=True)
+    normalized = normalized.str.replace(r'[^0-9a-z]+', ' ', regex=True).str.strip()
+    return normalized.fillna('')
+
+
+def _trigram_table(keys):
+    """Explodes normalized keys into a (position, gram) table of distinct padded trigrams."""
+    positions, grams = [], []
+    for position, key in enumerate(keys):
+        padded = f'  {key} '
+        for gram in {padded[i:i + 3] for i in range(len(padded) - 2)}:
+            positions.append(position)
+            grams.append(gram)
+    return pd.DataFrame({'position': np.array(positions, dtype=np.int64), 'gram': grams})
+
+
+class MatchIndex:
+    """Two-tier matcher over a catalog index (see catalog.build_index).
+
+    Tier 1 joins on the exact name and then on a normalized key. Tier 2 resolves
+    whatever is left in one batch through an inverted trigram index with prefix
+    filtering: under a global rarest-first trigram order, two names can only reach
+    min_similarity if their short prefixes share a trigram, so only the prefixes
+    are indexed and joined, and the work grows with the number of leftovers, not
+    leftovers x catalog size. Prefix trigrams shared by more than max_block_size
+    catalog names are skipped, which caps the candidates per name.
+    """
+
+    def __init__(self, catalog_index, min_similarity=MIN_SIMILARITY, max_block_size=MAX_BLOCK_SIZE):
+        self.catalog_index = catalog_index
+        self.min_similarity = min_similarity
+        self.max_block_size = max_block_size
+
+        catalog_names = catalog_index.index.to_series()
+        keys = normalize_names(catalog_names)
+        self._catalog_names = catalog_names.to_numpy()
+        # Normalized key -> catalog position; first catalog row wins like drop_duplicates
+        self._key_positions = pd.Series(np.arange(len(keys)), index=keys.to_numpy())
+        self._key_positions = self._key_positions[~self._key_positions.index.duplicated()]
+
+        # Trigrams are factorized once so every join below runs on integer codes
+        grams = _trigram_table(keys.to_numpy())
+        codes, vocabulary = pd.factorize(grams['gram'])
+        self._vocabulary = pd.Index(vocabulary)
+        self._grams = pd.DataFrame({'position': grams['position'].to_numpy(), 'gram': codes})
+        self._gram_counts = np.bincount(self._grams['position'].to_numpy(), minlength=len(keys))
+        self._gram_frequency = np.bincount(codes, minlength=len(vocabulary))
+        prefix_grams = self._prefix(self._grams, 'position')
+        self._prefix_grams = prefix_grams[prefix_grams['frequency'] <= max_block_size]
+
+    def tables(self):
+        """The tables derived from the catalog names, as flat arrays (see from_tables)."""
+        return {
+            'keys': self._key_positions.index.to_numpy(dtype=object),
+            'key_positions': self._key_positions.to_numpy(),
+            'vocabulary': self._vocabulary.to_numpy(dtype=object),
+            'gram_positions': self._grams['position'].to_numpy(),
+            'gram_codes': self._grams['gram'].to_numpy(),
+            'prefix_positions': self._prefix_grams['position'].to_numpy(),
+            'prefix_codes': self._prefix_grams['gram'].to_numpy(),
+            'prefix_frequencies': self._prefix_grams['frequency'].to_numpy(),
+        }
+
+    @classmethod
+    def from_tables(cls, catalog_index, tables, min_similarity=MIN_SIMILARITY, max_block_size=MAX_BLOCK_SIZE):
+        """Rebuilds a matcher from tables() of the same catalog without normalizing every name again.
+
+        The tables must have been built with the same min_similarity and max_block_size.
+        """
+        matcher = cls.__new__(cls)
+        matcher.catalog_index = catalog_index
+        matcher.min_similarity = min_similarity
+        matcher.max_block_size = max_block_size
+        matcher._catalog_names = catalog_index.index.to_series().to_numpy()
+        matcher._key_positions = pd.Series(tables['key_positions'].astype(np.int64), index=tables['keys'])
+        matcher._vocabulary = pd.Index(tables['vocabulary'])
+        positions = tables['gram_positions'].astype(np.int64)
+        codes = tables['gram_codes'].astype(np.intp)
+        matcher._grams = pd.DataFrame({'position': positions, 'gram': codes})
+        matcher._gram_counts = np.bincount(positions, minlength=len(catalog_index))
+        matcher._gram_frequency = np.bincount(codes, minlength=len(matcher._vocabulary))
+        matcher._prefix_grams = pd.DataFrame({
+            'position': tables['prefix_positions'].astype(np.int64),
+            'gram': tables['prefix_codes'].astype(np.intp),
+            'frequency': tables['prefix_frequencies'].astype(np.int64),
+        })
+        return matcher
+
+    def memory_bytes(self):
+        """Approximate bytes held by the lookup tables (the catalog index itself excluded)."""
+        frames = (self._grams, self._prefix_grams)
+        arrays = (self._gram_counts, self._gram_frequency)
+        return int(sum(frame.memory_usage(deep=True).sum() for frame in frames)
+                   + sum(array.nbytes for array in arrays)
+                   + self._vocabulary.memory_usage(deep=True)
+                   + self._key_positions.memory_usage(deep=True)
+                   + self._catalog_names.nbytes)
+
+    def match(self, names):
+        """Matches names against the catalog.
+
+        Returns a frame aligned to `names` with Product Id, Pos Categories,
+        Matched Name, Match Type ('exact', 'normalized', 'fuzzy' or missing)
+        and Match Score (1.0 for tier 1, trigram Jaccard for fuzzy matches).
+        """
+        names = pd.Series(names).reset_index(drop=True)
+        positions = pd.Series(
+            self.catalog_index.index.get_indexer(names), dtype='float64').where(lambda p: p >= 0)
+        match_type = pd.Series(np.where(positions.notna(), 'exact', None), dtype=object)
+        score = pd.Series(np.where(positions.notna(), 1.0, np.nan))
+
+        # --- Tier 1b: normalized key ---
+        pending = positions.isna()
+        if pending.any():
+            keys = normalize_names(names[pending])
+            normalized = keys.map(self._key_positions)
+            found = normalized.notna()
+            positions[found.index[found]] = normalized[found]
+            match_type[found.index[found]] = 'normalized'
+            score[found.index[found]] = 1.0
+
+            # --- Tier 2: blocked trigram similarity for the leftovers ---
+            leftovers = keys[~found]
+            leftovers = leftovers[leftovers != '']
+            for start in range(0, len(leftovers), FUZZY_BATCH_SIZE):
+                batch = leftovers.iloc[start:start + FUZZY_BATCH_SIZE]
+                best = self._fuzzy(batch.to_numpy())
+                rows = batch.index[best['query'].to_numpy().astype(np.int64)]
+                positions[rows] = best['position'].to_numpy()
+                match_type[rows] = 'fuzzy'
+                score[rows] = best['score'].round(4).to_numpy()
+
+        matched = positions.notna()
+        take = positions[matched].astype(np.int64).to_numpy()
+        result = pd.DataFrame(index=names.index)
+        for column in self.catalog_index.columns:
+            values = pd.Series(np.nan, index=names.index, dtype=object)
+            values[matched] = self.catalog_index[column].to_numpy()[take]
+            result[column] = values
+        matched_names = pd.Series(np.nan, index=names.index, dtype=object)
+        matched_names[matched] = self._catalog_names[take]
+        result['Matched Name'] = matched_names
+        result['Match Type'] = match_type
+        result['Match Score'] = score
+        return result
+
+    def _prefix(self, grams, key):
+        """Keeps the |x| - ceil(t * |x|) + 1 rarest trigrams of every name.
+
+        Jaccard >= t needs at least ceil(t * |x|) shared trigrams, so two names
+        that qualify always share a trigram within these prefixes.
+        """
+        codes = grams['gram'].to_numpy()
+        # Trigrams missing from the catalog (code -1) sort first; they never match anyway
+        frequency = np.where(codes >= 0, self._gram_frequency[np.maximum(codes, 0)], 0)
+        order = np.lexsort((codes, frequency, grams[key].to_numpy()))
+        grams = grams.iloc[order].assign(frequency=frequency[order])
+        sizes = grams.groupby(key)['gram'].transform('size').to_numpy()
+        prefix_sizes = sizes - np.ceil(self.min_similarity * sizes) + 1
+        return grams[grams.groupby(key).cumcount().to_numpy() < prefix_sizes]
+
+    def _fuzzy(self, keys):
+        """Returns the best catalog position and score per query key above min_similarity."""
+        empty = pd.DataFrame({'query': [], 'position': [], 'score': []})
+        query_grams = _trigram_table(keys).rename(columns={'position': 'query'})
+        query_grams['gram'] = self._vocabulary.get_indexer(query_grams['gram'])
+        query_counts = query_grams.groupby('query').size()
+
+        # --- Blocking: only pairs whose rarest-first prefixes overlap ---
+        prefix = self._prefix(query_grams, 'query')
+        candidates = prefix[['query', 'gram']].merge(self._prefix_grams[['position', 'gram']], on='gram')
+        candidates = candidates[['query', 'position']].drop_duplicates()
+        # Sizes alone rule out pairs that could never reach the threshold
+        query_sizes = query_counts.reindex(candidates['query']).to_numpy()
+        catalog_sizes = self._gram_counts[candidates['position'].to_numpy()]
+        candidates = candidates[(catalog_sizes >= self.min_similarity * query_sizes)
+                                & (catalog_sizes * self.min_similarity <= query_sizes)]
+        if candidates.empty:
+            return empty
+
+        # --- Verification: exact shared-trigram counts for candidate pairs only ---
+        known_grams = query_grams.loc[query_grams['gram'] >= 0, ['query', 'gram']]
+        shared = (candidates.merge(known_grams, on='query')
+                  .merge(self._grams, on=['position', 'gram'])
+                  .groupby(['query', 'position']).size().rename('shared').reset_index())
+
+        union = (query_counts.reindex(shared['query']).to_numpy()
+                 + self._gram_counts[shared['position'].to_numpy()]
+                 - shared['shared'].to_numpy())
+        shared['score'] = shared['shared'].to_numpy() / union
+
+        # Highest score per query; ties go to the earlier catalog row
+        shared = shared.sort_values(['query', 'score', 'position'], ascending=[True, False, True])
+        best = shared.drop_duplicates(subset=['query'], keep='first')
+        return best[best['score'] >= self.min_similarity]
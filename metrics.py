@@ -0,0 +1,244 @@
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+
+logger = logging.getLogger('rms.metrics')
+
+PROMETHEUS_CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+class UploadTrace:
+    """Collects stage timings and counts for one upload, then reports them once."""
+
+    def __init__(self, metrics, **fields):
+        self._metrics = metrics
+        self.fields = dict(fields)
+        self.stages = {}
+        self.failed_stage = None
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        except Exception:
+            self.failed_stage = self.failed_stage or name
+            raise
+        finally:
+            self.stages[name] = self.stages.get(name, 0.0) + time.perf_counter() - start
+
+    def finish(self, status, error=None, **fields):
+        self.fields.update(fields)
+        self._metrics.record_upload(self, status, error)
+
+
+class _DisabledTrace:
+    @property
+    def fields(self):
+        return {}
+
+    def stage(self, name):
+        return nullcontext()
+
+    def finish(self, status, error=None, **fields):
+        pass
+
+
+def traced_stream(trace, stage_name, chunks, **fields):
+    """Times a streamed response body as one stage and finishes the trace once it is sent.
+
+    A client that disconnects mid-body finishes it as 'aborted'.
+    """
+    # GeneratorExit (the server closing the body early) is no Exception, so it leaves 'aborted'
+    status, error = 'aborted', None
+    try:
+        with trace.stage(stage_name):
+            yield from chunks
+        status = 'ok'
+    except Exception as e:
+        status, error = 'error', e
+        raise
+    finally:
+        trace.finish(status, error, **(fields if error is None else {}))
+
+
+class Metrics:
+    """Stage timings, upload counters and gauges, exposed in Prometheus text format.
+
+    When disabled, trace() hands out a no-op tracer so instrumented code pays
+    only for a nullcontext per stage.
+
+    With shared=True each process also writes its counters to state_dir after
+    every upload, and render() adds up the counters of every process that
+    wrote there, so a scrape answered by any worker of serve.py sees the same
+    totals. Workers that stopped keep counting towards them. Gauges stay per
+    process.
+    """
+
+    def __init__(self, enabled=True, shared=False, state_dir=None):
+        self.enabled = enabled
+        self.shared = shared
+        self.state_dir = state_dir or os.path.join(tempfile.gettempdir(), 'rms-metrics')
+        if shared:
+            os.makedirs(self.state_dir, exist_ok=True)
+        self._lock = threading.Lock()
+        self._stage_seconds = {}
+        self._uploads = {}
+        self._errors = {}
+        self._gauges = {}
+        self._collectors = []
+        # (pid, state file) of this process; forked workers pick a file of their own
+        self._state_file = (None, None)
+
+    def trace(self, **fields):
+        if not self.enabled:
+            return _DisabledTrace()
+        return UploadTrace(self, **fields)
+
+    def add_collector(self, collector):
+        """Registers a callable returning {gauge name: (help, value)} at scrape time."""
+        self._collectors.append(collector)
+
+    def record_upload(self, trace, status, error=None):
+        with self._lock:
+            for name, seconds in trace.stages.items():
+                total = self._stage_seconds.setdefault(name, [0.0, 0])
+                total[0] += seconds
+                total[1] += 1
+            self._uploads[status] = self._uploads.get(status, 0) + 1
+            if trace.failed_stage:
+                self._errors[trace.failed_stage] = self._errors.get(trace.failed_stage, 0) + 1
+            for name in ('bytes', 'rows', 'unmatched'):
+                if name in trace.fields:
+                    self._gauges[f'rms_last_upload_{name}'] = trace.fields[name]
+            self._write_state_locked()
+
+        record = {
+            'event': 'upload',
+            'status': status,
+            **trace.fields,
+            'stages': {name: round(seconds, 6) for name, seconds in trace.stages.items()},
+        }
+        if error is not None:
+            record['error'] = str(error)
+            record['failed_stage'] = trace.failed_stage
+        logger.info(json.dumps(record, default=str))
+
+    def render(self):
+        """Returns every metric in Prometheus text exposition format."""
+        lines = []
+        with self._lock:
+            counters = self._counters_locked()
+            gauges = {name: ('Value from the most recent upload.', value)
+                      for name, value in self._gauges.items()}
+        if self.shared:
+            counters = self._shared_counters(counters)
+
+        lines.append('# HELP rms_stage_duration_seconds Time spent in each pipeline stage.')
+        lines.append('# TYPE rms_stage_duration_seconds summary')
+        for name, (total, count) in sorted(counters['stage_seconds'].items()):
+            lines.append(f'rms_stage_duration_seconds_sum{{stage="{name}"}} {total:.6f}')
+            lines.append(f'rms_stage_duration_seconds_count{{stage="{name}"}} {count}')
+
+        lines.append('# HELP rms_uploads_total Uploads processed, by outcome.')
+        lines.append('# TYPE rms_uploads_total counter')
+        for status, count in sorted(counters['uploads'].items()):
+            lines.append(f'rms_uploads_total{{status="{status}"}} {count}')
+
+        lines.append('# HELP rms_stage_errors_total Failed uploads, by the stage that failed.')
+        lines.append('# TYPE rms_stage_errors_total counter')
+        for name, count in sorted(counters['errors'].items()):
+            lines.append(f'rms_stage_errors_total{{stage="{name}"}} {count}')
+
+        for collector in self._collectors:
+            gauges.update(collector())
+        # Collectors may return labelled series ('name{brand="x"}'); describe each name once
+        described = set()
+        for name, (help_text, value) in sorted(gauges.items()):
+            base_name = name.split('{', 1)[0]
+            if base_name not in described:
+                described.add(base_name)
+                lines.append(f'# HELP {base_name} {help_text}')
+                lines.append(f'# TYPE {base_name} gauge')
+            lines.append(f'{name} {value}')
+        return '\n'.join(lines) + '\n'
+
+    # --- Shared Counters ---
+
+    def clear_shared_state(self):
+        """Forgets the counters of earlier processes; serve.py calls it before forking its workers."""
+        try:
+            names = os.listdir(self.state_dir)
+        except OSError:
+            return
+        for name in names:
+            try:
+                os.remove(os.path.join(self.state_dir, name))
+            except OSError:
+                continue
+
+    def _counters_locked(self):
+        return {
+            'stage_seconds': {name: list(total) for name, total in self._stage_seconds.items()},
+            'uploads': dict(self._uploads),
+            'errors': dict(self._errors),
+        }
+
+    def _state_path(self):
+        pid, path = self._state_file
+        if pid != os.getpid():
+            pid = os.getpid()
+            # The start time keeps a reused pid from overwriting a stopped worker's counters
+            path = os.path.join(self.state_dir, f'{pid}-{time.time_ns()}.json')
+            self._state_file = (pid, path)
+        return path
+
+    def _write_state_locked(self):
+        if not self.shared:
+            return
+        path = self._state_path()
+        # Written to a temp name and renamed so readers only see complete files
+        temp_path = path + '.tmp'
+        try:
+            with open(temp_path, 'w') as file:
+                json.dump(self._counters_locked(), file)
+            os.replace(temp_path, path)
+        except OSError:
+            logger.warning('Could not write shared metrics to %s', path, exc_info=True)
+
+    def _shared_counters(self, counters):
+        """counters (this process's) plus those every other process wrote to state_dir."""
+        with self._lock:
+            own_path = self._state_path()
+        try:
+            names = os.listdir(self.state_dir)
+        except OSError:
+            return counters
+        for file_name in names:
+            path = os.path.join(self.state_dir, file_name)
+            if not file_name.endswith('.json') or path == own_path:
+                continue
+            try:
+                with open(path) as file:
+                    other = json.load(file)
+            except (OSError, ValueError):
+                continue
+            for name, (total, count) in other['stage_seconds'].items():
+                stage = counters['stage_seconds'].setdefault(name, [0.0, 0])
+                stage[0] += total
+                stage[1] += count
+            for key in ('uploads', 'errors'):
+                for name, count in other[key].items():
+                    counters[key][name] = counters[key].get(name, 0) + count
+        return counters
+
+
+# Shared registry; set RMS_METRICS=0 to turn instrumentation off. With
+# RMS_SHARED_DOWNLOADS=1 (serve.py) counters are added up across worker processes.
+metrics = Metrics(enabled=os.environ.get('RMS_METRICS', '1') != '0',
+                  shared=os.environ.get('RMS_SHARED_DOWNLOADS') == '1',
+                  state_dir=os.environ.get('RMS_METRICS_DIR'))
@@ -0,0 +1,65 @@
+"""Page assets of the web apps.
+
+The pages are Jinja templates in web/ (the apps use it as their template
+folder). Flask compiles each once and keeps it, unless templates auto-reload
+in debug mode, so a request only renders the success state, warning and
+download link into it. Their CSS and JS are read into memory at import and
+linked as /assets/<name>?v=<hash>: browsers keep a versioned URL for a year,
+and any other request for an asset revalidates against its ETag.
+"""
+import hashlib
+import mimetypes
+import os
+
+from flask import Response, abort, request, url_for
+
+WEB_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'web')
+ASSET_EXTENSIONS = ('.css', '.js')
+# Seconds browsers may keep a versioned asset URL, whose content never changes
+ASSET_MAX_AGE = 365 * 24 * 60 * 60
+
+
+def load_assets(directory=WEB_DIR):
+    """name -> {'data', 'etag', 'mimetype'} of every stylesheet and script in directory."""
+    assets = {}
+    for name in sorted(os.listdir(directory)):
+        if not name.endswith(ASSET_EXTENSIONS):
+            continue
+        with open(os.path.join(directory, name), 'rb') as file:
+            data = file.read()
+        assets[name] = {
+            'data': data,
+            'etag': hashlib.blake2b(data, digest_size=8).hexdigest(),
+            'mimetype': mimetypes.guess_type(name)[0] or 'application/octet-stream',
+        }
+    return assets
+
+
+assets = load_assets()
+
+
+def asset_url(name):
+    """Versioned URL of an asset; templates call it as asset_url('index.css')."""
+    return url_for('asset', name=name, v=assets[name]['etag'])
+
+
+def asset_response(name):
+    asset = assets.get(name)
+    if asset is None:
+        abort(404)
+    response = Response(asset['data'], mimetype=asset['mimetype'])
+    response.set_etag(asset['etag'])
+    if request.args.get('v') == asset['etag']:
+        response.cache_control.public = True
+        response.cache_control.max_age = ASSET_MAX_AGE
+        response.cache_control.immutable = True
+    else:
+        response.cache_control.no_cache = True
+    # 304 Not Modified when If-None-Match carries the current ETag
+    return response.make_conditional(request)
+
+
+def init_app(app):
+    """Serves the assets under /assets/ and gives templates asset_url()."""
+    app.add_url_rule('/assets/<name>', 'asset', asset_response)
+    app.add_template_global(asset_url)
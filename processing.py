@@ -0,0 +1,266 @@
+from contextlib import nullcontext
+
+import numpy as np
+import pandas as pd
+
+# Template columns filled with the same value on every row
+CONSTANT_COLUMNS = {
+    'Featured Product': 'N',
+    'Pos Point Short Name': 'RMS',
+    'Unit Short Name': 'Unit',
+    'Status': 'A',
+    'Description': '',
+    'Taxes Short Name': '',
+    'Pos Attributes': '',
+    'NC value(%)': '',
+    'Kitchen Code': '',
+}
+TEMPLATE_COLUMNS = [
+    'Featured Product', 'Pos Point Short Name', 'Pos Product Name', 'Product Id',
+    'Description', 'Pos Categories', 'Taxes Short Name', 'Pos Attributes',
+    'Price', 'NC value(%)', 'Unit Short Name', 'Kitchen Code', 'Status'
+]
+MATCH_DETAIL_COLUMNS = ['Matched Name', 'Match Type', 'Match Score']
+# Category given to items no catalog entry matched, unless a rule file sets its own
+FALLBACK_CATEGORY = 'UNCATEGORIZED'
+# Matches on a normalized or similar name, which someone should check before the template is imported
+REVIEW_MATCH_TYPES = ('normalized', 'fuzzy')
+REVIEW_COLUMNS = ['Pos Product Name', 'Matched Name', 'Product Id', 'Pos Categories', 'Match Type', 'Match Score']
+
+
+def _no_stage(name):
+    return nullcontext()
+
+
+def process_data(df_imported, catalog_index, matcher=None, match_details=False, stage=None,
+                 lean=False, constants=None, rules=None, branch=None):
+    # catalog_index: catalog.build_index frame, or a catalog store with a bulk
+    # lookup(names) method (catalog_db.SQLiteCatalog).
+    # matcher: optional matching.MatchIndex over the same catalog. Without it only
+    # exact names match; with it, normalized and fuzzy matches are resolved too.
+    # match_details=True appends 'Matched Name', 'Match Type' and 'Match Score'
+    # after the template columns.
+    # stage: optional callable returning a context manager per step name
+    # ('dedupe', 'merge', 'price', 'sort', 'finalize'), used for timing hooks.
+    # lean=True runs the low-copy pipeline (see process_data_lean).
+    # constants: per-brand overrides of CONSTANT_COLUMNS, e.g. {'Pos Point Short Name': 'XYZ'}.
+    # rules: optional rules.RuleSet replacing the fixed tax divide, rounding and
+    # fallback category; branch is the name its branch conditions are checked against.
+    if lean:
+        return process_data_lean(df_imported, catalog_index, matcher, match_details, stage, constants,
+                                 rules, branch)
+
+    stage = stage or _no_stage
+    constants = _merged_constants(constants, rules)
+    fallback_category = FALLBACK_CATEGORY if rules is None else rules.fallback_category
+
+    df_imported.rename(columns={
+        'Category Name': 'Category Name (Old)',
+        'Rate': 'Rate (Original)'
+    }, inplace=True)
+
+
+    # --- Remove Duplicated Item Names ---
+    with stage('dedupe'):
+        df_processed = df_imported[['Item Name', 'Category Name (Old)', 'Rate (Original)']].copy()
+        df_processed.drop_duplicates(subset=['Item Name'], keep='first', inplace=True)
+
+    # --- Join Against the Prebuilt Basis Index ---
+    with stage('merge'):
+        if matcher is None and isinstance(catalog_index, pd.DataFrame):
+            df_processed = df_processed.join(catalog_index, on='Item Name', how='left')
+        else:
+            # Matchers and catalog stores return frames aligned by position
+            df_processed = df_processed.reset_index(drop=True)
+            if matcher is None:
+                matches = catalog_index.lookup(df_processed['Item Name'])[['Product Id', 'Pos Categories']]
+            else:
+                matches = matcher.match(df_processed['Item Name'])
+            df_processed = df_processed.join(matches)
+        df_processed.rename(columns={'Pos Categories': 'Category Name (New)'}, inplace=True)
+
+
+        # Check for items that will become 'UNCATEGORIZED' before filling NaNs.
+        has_uncategorized_items = df_processed['Category Name (New)'].isnull().any()
+
+        df_processed['Category Name (New)'] = df_processed['Category Name (New)'].fillna(fallback_category)
+
+
+    # --- Rate and Final Column Setup ---
+    row_columns = {}
+    with stage('price'):
+        if rules is None:
+            df_processed['Rate (Base Price)'] = (df_processed['Rate (Original)'] / 1.12).round(2)
+        else:
+            prices, categories, row_columns = rules.evaluate(
+                df_processed['Rate (Original)'], df_processed['Category Name (New)'], branch, constants)
+            df_processed['Rate (Base Price)'] = prices
+            df_processed['Category Name (New)'] = categories
+            for col, values in row_columns.items():
+                df_processed[col] = values
+
+    with stage('sort'):
+        # Stable, so items sharing a Product Id keep their workbook order (chunked.py relies on it)
+        df_processed.sort_values(by='Product Id', inplace=True, na_position='last', kind='stable')
+
+    with stage('finalize'):
+        for col, value in constants.items():
+            if col not in row_columns:
+                df_processed[col] = value
+
+
+        final_columns = [
+            'Featured Product', 'Pos Point Short Name', 'Item Name', 'Product Id',
+            'Description', 'Category Name (New)', 'Taxes Short Name', 'Pos Attributes',
+            'Rate (Base Price)', 'NC value(%)', 'Unit Short Name', 'Kitchen Code', 'Status'
+        ]
+        if match_details:
+            if matcher is None:
+                matched = df_processed['Product Id'].notna()
+                df_processed['Matched Name'] = df_processed['Item Name'].where(matched)
+                df_processed['Match Type'] = matched.map({True: 'exact', False: None})
+                df_processed['Match Score'] = matched.map({True: 1.0, False: None}).astype('float64')
+            final_columns += ['Matched Name', 'Match Type', 'Match Score']
+
+        df_final = df_processed[final_columns].copy()
+
+        df_final.rename(columns={
+            'Item Name': 'Pos Product Name',
+            'Category Name (New)': 'Pos Categories',
+            'Rate (Base Price)': 'Price'
+        }, inplace=True)
+
+    # Return the final DataFrame AND the status of UNCATEGORIZED items
+    return df_final, has_uncategorized_items
+
+
+def unmatched_count(df_exported, rules=None):
+    """Rows of a template (or delta) that got the fallback category in effect, i.e. matched nothing."""
+    fallback_category = FALLBACK_CATEGORY if rules is None else rules.fallback_category
+    return int((df_exported['Pos Categories'] == fallback_category).sum())
+
+
+def split_review(df_exported):
+    """(template, review) of a process_data(match_details=True) frame.
+
+    template is the frame without the match columns, as the HLX import needs
+    it. review has REVIEW_COLUMNS for every row matched by a normalized or
+    fuzzy name, lowest score first: their Product Id is a guess until checked.
+    """
+    needs_review = df_exported['Match Type'].isin(REVIEW_MATCH_TYPES).to_numpy()
+    review = df_exported.loc[needs_review, REVIEW_COLUMNS].sort_values('Match Score', kind='stable')
+    return df_exported.drop(columns=MATCH_DETAIL_COLUMNS), review
+
+
+def _merged_constants(constants, rules):
+    # Rule file columns override the defaults; explicit (per-brand) constants override both
+    return {**CONSTANT_COLUMNS, **(rules.columns if rules is not None else {}), **(constants or {})}
+
+
+def _constant_column(value, length):
+    # One byte per row instead of a full object array of repeated strings
+    return pd.Categorical.from_codes(np.zeros(length, dtype=np.int8), categories=[value])
+
+
+def process_data_lean(df_imported, catalog_index, matcher=None, match_details=False, stage=None,
+                      constants=None, rules=None, branch=None):
+    """Low-copy variant of process_data that produces the same template.
+
+    Works on the three input columns through a dedupe mask instead of copying
+    and renaming frames, leaves df_imported untouched, and keeps the constant
+    template columns as single-category categoricals until export.
+    """
+    stage = stage or _no_stage
+    constants = _merged_constants(constants, rules)
+    fallback_category = FALLBACK_CATEGORY if rules is None else rules.fallback_category
+
+    missing = [col for col in ('Item Name', 'Category Name', 'Rate') if col not in df_imported.columns]
+    if missing:
+        raise KeyError(f"{missing} not in index")
+
+    # --- Remove Duplicated Item Names ---
+    with stage('dedupe'):
+        keep = ~df_imported['Item Name'].duplicated(keep='first').to_numpy()
+        item_names = df_imported['Item Name'][keep]
+        rates = df_imported['Rate'][keep]
+
+    # --- Join Against the Prebuilt Basis Index ---
+    with stage('merge'):
+        if matcher is None:
+            if isinstance(catalog_index, pd.DataFrame):
+                positions = catalog_index.index.get_indexer(item_names)
+                found = positions >= 0
+                take = np.where(found, positions, 0)
+                product_ids = catalog_index['Product Id'].to_numpy(dtype=object)[take]
+                product_ids[~found] = np.nan
+                if rules is None:
+                    categories = catalog_index['Pos Categories'].to_numpy(dtype=object)[take]
+                    categories[~found] = np.nan
+                else:
+                    # Rules work on category codes; coding the catalog column costs catalog rows, not input rows
+                    catalog_codes, catalog_categories = pd.factorize(catalog_index['Pos Categories'])
+                    categories = pd.Categorical.from_codes(np.where(found, catalog_codes[take], -1),
+                                                           catalog_categories)
+            else:
+                # Catalog stores (catalog_db.SQLiteCatalog) resolve every name in one bulk lookup
+                matches = catalog_index.lookup(item_names)
+                found = matches['Matched Name'].notna().to_numpy()
+                product_ids = matches['Product Id'].to_numpy()
+                categories = matches['Pos Categories'].to_numpy()
+            details = None
+            if match_details:
+                details = {
+                    'Matched Name': item_names.where(found).to_numpy(),
+                    'Match Type': np.where(found, 'exact', None),
+                    'Match Score': np.where(found, 1.0, np.nan),
+                }
+        else:
+            matches = matcher.match(item_names)
+            product_ids = matches['Product Id'].to_numpy()
+            categories = matches['Pos Categories'].to_numpy()
+            details = ({col: matches[col].to_numpy() for col in MATCH_DETAIL_COLUMNS}
+                       if match_details else None)
+
+        product_ids = pd.Series(product_ids, index=item_names.index)
+        categories = pd.Series(categories, index=item_names.index)
+
+        # Check for items that will become 'UNCATEGORIZED' before filling NaNs.
+        has_uncategorized_items = categories.isnull().any()
+        if isinstance(categories.dtype, pd.CategoricalDtype) and fallback_category not in categories.cat.categories:
+            categories = categories.cat.add_categories([fallback_category])
+        categories = categories.fillna(fallback_category)
+
+    # --- Rate and Final Column Setup ---
+    row_columns = {}
+    with stage('price'):
+        if rules is None:
+            prices = (rates / 1.12).round(2)
+        else:
+            prices, categories, row_columns = rules.evaluate(rates, categories, branch, constants)
+            prices = pd.Series(prices, index=rates.index)
+            categories = pd.Series(categories, index=rates.index)
+
+    with stage('sort'):
+        # Same sort call as the copying path, so ties keep the same order; taken
+        # positionally so duplicate labels in the caller's index don't matter
+        order = product_ids.reset_index(drop=True).sort_values(na_position='last', kind='stable').index.to_numpy()
+
+    with stage('finalize'):
+        length = len(order)
+        columns = {col: _constant_column(value, length) for col, value in constants.items()}
+        for col, values in row_columns.items():
+            columns[col] = values[order]
+        columns['Pos Product Name'] = item_names.to_numpy()[order]
+        columns['Product Id'] = product_ids.to_numpy()[order]
+        columns['Pos Categories'] = categories.to_numpy()[order]
+        columns['Price'] = prices.to_numpy()[order]
+        final_columns = list(TEMPLATE_COLUMNS)
+        if details is not None:
+            for col, values in details.items():
+                columns[col] = values[order]
+            final_columns += MATCH_DETAIL_COLUMNS
+
+        df_final = pd.DataFrame({col: columns[col] for col in final_columns},
+                                index=item_names.index[order])
+
+    return df_final, has_uncategorized_items
@@ -0,0 +1,230 @@
+"""Declarative pricing and category rules, compiled into vectorized column operations.
+
+A rule file is JSON:
+
+    {
+        "tax_divisor": 1.12,
+        "price_decimals": 2,
+        "fallback_category": "UNCATEGORIZED",
+        "category_map": {"Ala Carte Promo": "Ala Carte"},
+        "columns": {"Taxes Short Name": "VAT"},
+        "rules": [
+            {"when": {"category": ["Beverages"]}, "multiply": 1.05},
+            {"when": {"branch": "Airport*"}, "add": 20, "set": {"Kitchen Code": "AIR"}},
+            {"when": {"branch": ["Branch_A"], "category": ["Add Ons"]}, "divisor": 1.0, "category": "Extras"}
+        ]
+    }
+
+The price is round(Rate / divisor * multiply + add, price_decimals). category_map
+renames catalog categories, and every rule condition sees the renamed ones.
+"columns" fixes template columns (those in processing.CONSTANT_COLUMNS) for every row. In "rules", each field
+(divisor, multiply, add, category, set columns) takes its value from the first
+matching rule that defines it. A rule matches when all of its "when" entries
+match: branch names are fnmatch patterns against the output name (for example
+Branch_A), and categories are exact.
+"""
+import fnmatch
+import json
+import os
+import threading
+
+import numpy as np
+import pandas as pd
+
+from processing import CONSTANT_COLUMNS, FALLBACK_CATEGORY
+
+CONDITION_KEYS = {'branch', 'category'}
+RULE_KEYS = {'when', 'divisor', 'multiply', 'add', 'category', 'set'}
+FILE_KEYS = {'tax_divisor', 'price_decimals', 'fallback_category', 'category_map', 'columns', 'rules'}
+
+
+def _as_list(value):
+    return [value] if isinstance(value, str) else list(value)
+
+
+class RuleSet:
+    """A compiled rule file; evaluate() runs every rule over a branch's rows in one pass."""
+
+    def __init__(self, config=None, version=''):
+        config = dict(config or {})
+        unknown = set(config) - FILE_KEYS
+        if unknown:
+            raise ValueError(f'Unknown rule file keys: {sorted(unknown)}')
+        self.version = version
+        self.tax_divisor = float(config.get('tax_divisor', 1.12))
+        self.price_decimals = int(config.get('price_decimals', 2))
+        self.fallback_category = config.get('fallback_category', FALLBACK_CATEGORY)
+        self.category_map = dict(config.get('category_map', {}))
+        self.columns = dict(config.get('columns', {}))
+        unknown = set(self.columns) - set(CONSTANT_COLUMNS)
+        if unknown:
+            raise ValueError(f'Only fixed template columns can be overridden, not {sorted(unknown)}')
+        self.rules = [self._compile_rule(rule, number) for number, rule in enumerate(config.get('rules', []), 1)]
+        self.branch_specific = any('branch' in rule['when'] for rule in self.rules)
+
+    @staticmethod
+    def _compile_rule(rule, number):
+        unknown = set(rule) - RULE_KEYS
+        if unknown:
+            raise ValueError(f'Rule {number}: unknown keys {sorted(unknown)}')
+        when = dict(rule.get('when', {}))
+        unknown = set(when) - CONDITION_KEYS
+        if unknown:
+            raise ValueError(f'Rule {number}: unknown conditions {sorted(unknown)}')
+        compiled = {'when': {}, 'set': dict(rule.get('set', {}))}
+        unknown = set(compiled['set']) - set(CONSTANT_COLUMNS)
+        if unknown:
+            raise ValueError(f'Rule {number}: only fixed template columns can be set, not {sorted(unknown)}')
+        if 'branch' in when:
+            compiled['when']['branch'] = _as_list(when['branch'])
+        if 'category' in when:
+            compiled['when']['category'] = _as_list(when['category'])
+        for field in ('divisor', 'multiply', 'add'):
+            if field in rule:
+                compiled[field] = float(rule[field])
+        if 'category' in rule:
+            compiled['category'] = rule['category']
+        return compiled
+
+    def _rules_for(self, branch):
+        # Branch conditions are one comparison per call, not per row
+        return [
+            rule for rule in self.rules
+            if 'branch' not in rule['when']
+            or (branch is not None and any(fnmatch.fnmatchcase(branch, pattern)
+                                           for pattern in rule['when']['branch']))
+        ]
+
+    def evaluate(self, gross, categories, branch=None, constants=None):
+        """Runs every rule over one branch's rows.
+
+        gross holds the workbook Rate and categories the matched (or fallback)
+        category of each row. Returns (prices, categories, columns): columns maps
+        each column set by a matching rule to its per-row values, defaulting to
+        `constants`. The file-level "columns" are left to the caller to merge.
+
+        Categories are integer-coded once (free for Categorical input), so the
+        category map and conditions run on the handful of distinct values and
+        reach the rows as integer takes; they come back as a pd.Categorical, or
+        untouched when no rule looks at them.
+        """
+        rules = self._rules_for(branch)
+        gross = np.asarray(gross, dtype='float64')
+        uses_categories = bool(self.category_map) or any(
+            'category' in rule or 'category' in rule['when'] for rule in rules)
+        if uses_categories:
+            if isinstance(getattr(categories, 'dtype', None), pd.CategoricalDtype):
+                categories = pd.Categorical(categories)
+                codes, uniques = categories.codes, list(categories.categories)
+            else:
+                codes, uniques = pd.factorize(np.asarray(categories, dtype=object))
+                uniques = list(uniques)
+            uniques = [self.category_map.get(value, value) for value in uniques]
+            # intp codes, since fancy indexing with narrower ones is about twice as slow
+            codes = codes.astype(np.intp)
+            if (codes < 0).any():
+                codes[codes < 0] = len(uniques)
+                uniques.append(np.nan)
+        else:
+            codes, uniques = None, [None]
+
+        # Branch conditions are settled by _rules_for, so what is left depends on the
+        # category alone: every field becomes a lookup table over the distinct categories
+        matches = [
+            np.isin(np.array(uniques, dtype=object), rule['when']['category'])
+            if 'category' in rule['when'] else np.ones(len(uniques), dtype=bool)
+            for rule in rules
+        ]
+
+        def per_row(values, default, dtype='float64'):
+            # First matching rule that defines a value wins; other rows keep `default`
+            if all(value is None for value in values):
+                return default
+            table = np.full(len(uniques), default, dtype=dtype)
+            for match, value in reversed(list(zip(matches, values))):
+                if value is not None:
+                    table[match] = value
+            return table[0] if codes is None else table[codes]
+
+        # --- Price ---
+        # Fields no rule defines stay scalars, so a rule file without rules is the plain divide
+        price = gross / per_row([rule.get('divisor') for rule in rules], self.tax_divisor)
+        if any('multiply' in rule for rule in rules):
+            price = price * per_row([rule.get('multiply') for rule in rules], 1.0)
+        if any('add' in rule for rule in rules):
+            price = price + per_row([rule.get('add') for rule in rules], 0.0)
+        prices = np.round(price, self.price_decimals)
+
+        # --- Categories: remapped and rule-assigned values are new codes ---
+        if uses_categories:
+            assigned = []
+            for rule in rules:
+                assigned.append(len(uniques) if 'category' in rule else None)
+                if 'category' in rule:
+                    uniques.append(rule['category'])
+            table = np.arange(len(uniques))
+            for match, code in reversed(list(zip(matches, assigned))):
+                if code is not None:
+                    table[:len(match)][match] = code
+            final_codes, final_uniques = pd.factorize(pd.Series(uniques, dtype=object))
+            categories = pd.Categorical.from_codes(final_codes[table][codes], final_uniques)
+
+        # --- Per-row columns ---
+        columns = {}
+        for column in sorted({column for rule in rules for column in rule['set']}):
+            values = per_row([rule['set'].get(column) for rule in rules],
+                             (constants or {}).get(column, ''), dtype=object)
+            columns[column] = values if codes is not None else np.full(len(gross), values, dtype=object)
+        return prices, categories, columns
+
+
+def load_rules(path):
+    """Reads and compiles a rule file."""
+    with open(path) as file:
+        config = json.load(file)
+    stat = os.stat(path)
+    return RuleSet(config, version=f'{stat.st_mtime_ns}-{stat.st_size}')
+
+
+class RuleFile:
+    """Keeps a compiled rule file and recompiles it only when the file changes.
+
+    Like catalog.BasisCatalog: the file's mtime and size are checked on every
+    get(), and a pinned RuleFile keeps the RuleSet it has (serve.py pins them
+    in its workers and rolls the workers over instead).
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.pinned = False
+        self._lock = threading.Lock()
+        # (file signature, RuleSet), swapped as one tuple
+        self._state = (None, None)
+
+    def _file_signature(self):
+        stat = os.stat(self.path)
+        return (stat.st_mtime_ns, stat.st_size)
+
+    def get(self):
+        """The RuleSet of the file as it is now; its version changes with the file."""
+        state = self._state
+        if self.pinned and state[1] is not None:
+            return state[1]
+        signature = self._file_signature()
+        if signature == state[0]:
+            return state[1]
+        with self._lock:
+            if signature != self._state[0]:
+                with open(self.path) as file:
+                    config = json.load(file)
+                self._state = (signature, RuleSet(config, version='-'.join(map(str, signature))))
+            return self._state[1]
+
+    def stale(self):
+        """True when the file changed since the rules in memory were compiled."""
+        signature = self._state[0]
+        try:
+            return signature is not None and self._file_signature() != signature
+        except FileNotFoundError:
+            # Keep the loaded rules until a new file is in place
+            return False
@@ -0,0 +1,277 @@
+"""Production server: a preforking pool of worker processes behind one listening socket.
+
+    python serve.py --bind 0.0.0.0:8000 --workers 4
+    python serve.py --app app:app --workers 2
+
+The master process imports the app, builds every brand's catalog index and
+matcher once and warms their hash tables, then forks the workers. The workers
+inherit those tables as copy-on-write memory that none of them writes to, so
+each extra worker adds its own request memory, not another catalog. Downloads
+and job status go through shared directories (RMS_SHARED_DOWNLOADS=1), so any
+worker can answer any request, and /metrics adds up the counters of every
+worker. /healthz and /readyz are the probes. Compile the catalogs
+(catalog_snapshot.py) to cut the time until the server is ready.
+
+Catalogs and rule files are pinned in the workers. The master checks them every
+--reload-interval seconds and, when one changed (or on SIGHUP), rebuilds it and
+starts a new set of workers before telling the old ones to stop. Old workers
+finish their in-flight requests and queued jobs first, so reloads drop nothing.
+A catalog or rule file that fails to load (a malformed CSV, say) is logged and
+the running workers keep what they have until its files change again.
+SIGTERM or SIGINT stops the server the same way.
+"""
+import time
+
+# Taken before the heavy imports, so time to ready includes them
+STARTED = time.perf_counter()
+
+import argparse
+import gc
+import importlib
+import logging
+import os
+import signal
+import socket
+import threading
+
+# Before the app is imported, so its download store and job queue are shared
+os.environ.setdefault('RMS_SHARED_DOWNLOADS', '1')
+
+from werkzeug.serving import make_server
+
+from brands import catalog_registry
+from metrics import metrics
+
+logger = logging.getLogger('rms.serve')
+
+# Seconds old workers get to finish their requests and jobs before they are killed
+GRACEFUL_TIMEOUT = 120
+# A worker that exits sooner than this after starting is respawned after a pause
+MIN_WORKER_SECONDS = 1.0
+
+
+def preload(registry):
+    """Warms every brand catalog and rule file in this process and pins them, then freezes the GC.
+
+    Files that changed since they were loaded are read again; one that fails
+    to read keeps what it had loaded. Returns the seconds the catalogs took.
+    """
+    files = [file for brand in registry.brands() for file in registry.files(brand)]
+    # Unpinned while warming, so changed files are picked up
+    for file in files:
+        file.pinned = False
+    try:
+        return registry.warm()
+    finally:
+        for file in files:
+            file.pinned = True
+        # Objects alive now are left alone by the cyclic GC, whose bookkeeping
+        # writes would otherwise copy their pages into every worker
+        gc.collect()
+        gc.freeze()
+
+
+def stale_brands(registry):
+    return [brand for brand in registry.brands() if any(file.stale() for file in registry.files(brand))]
+
+
+def file_versions(registry, brand):
+    """mtimes of a brand's catalog and rule files as they are now; a failed reload is retried once they change."""
+    versions = []
+    for file in registry.files(brand):
+        for path in (file.path, getattr(file, 'snapshot_path', None)):
+            try:
+                versions.append(os.stat(path).st_mtime_ns if path else None)
+            except OSError:
+                versions.append(None)
+    return tuple(versions)
+
+
+def create_listener(bind, backlog=1024):
+    host, _, port = bind.rpartition(':')
+    listener = socket.create_server((host or '127.0.0.1', int(port)), backlog=backlog)
+    # Every worker polls the same socket; one that loses the race for a
+    # connection gets EAGAIN instead of blocking in accept()
+    listener.setblocking(False)
+    return listener
+
+
+def run_worker(app, listener, job_queue=None):
+    """Serves requests until SIGTERM, then drains in-flight requests and queued jobs."""
+    # Ctrl-C and SIGHUP can reach the whole process group; the master decides what to do
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGHUP, signal.SIG_IGN)
+
+    host, port = listener.getsockname()[:2]
+    server = make_server(host, port, app, threaded=True, fd=listener.fileno())
+    # server_close() then waits for in-flight requests
+    server.daemon_threads = False
+
+    def stop(signum, frame):
+        # shutdown() waits for serve_forever() to return, so it cannot run in this thread
+        threading.Thread(target=server.shutdown, daemon=True).start()
+
+    signal.signal(signal.SIGTERM, stop)
+    server.serve_forever()
+    if job_queue is not None:
+        job_queue.shutdown(wait=True)
+
+
+class Master:
+    """Forks and supervises the workers and rolls them over when a catalog or rule file changes."""
+
+    def __init__(self, app, listener, workers, job_queue=None, registry=catalog_registry,
+                 reload_interval=5.0, graceful_timeout=GRACEFUL_TIMEOUT):
+        self.app = app
+        self.listener = listener
+        self.worker_count = workers
+        self.job_queue = job_queue
+        self.registry = registry
+        self.reload_interval = reload_interval
+        self.graceful_timeout = graceful_timeout
+        self.generation = 0
+        # pid -> (generation, start time) of the current workers; retiring ones
+        # map pid -> deadline for a graceful exit
+        self.workers = {}
+        self.retiring = {}
+        self._signals = []
+        # brand -> file_versions() of the catalog and rule files a reload failed on
+        self.failed_versions = {}
+
+    def run(self):
+        catalog_seconds = preload(self.registry)
+        # Counters add up across this server's workers, from zero
+        if metrics.shared:
+            metrics.clear_shared_state()
+        for signum in (signal.SIGHUP, signal.SIGTERM, signal.SIGINT):
+            signal.signal(signum, lambda signum, frame: self._signals.append(signum))
+        self._spawn_missing()
+        host, port = self.listener.getsockname()[:2]
+        logger.info('Serving on http://%s:%s with %d workers; ready %.2fs after start (catalogs %.2fs)',
+                    host, port, self.worker_count, time.perf_counter() - STARTED, catalog_seconds)
+
+        last_check = time.monotonic()
+        while True:
+            while self._signals:
+                signum = self._signals.pop(0)
+                if signum == signal.SIGHUP:
+                    self.reload('SIGHUP')
+                else:
+                    self.stop()
+                    return
+            self._reap()
+            if time.monotonic() - last_check >= self.reload_interval:
+                last_check = time.monotonic()
+                brands = [brand for brand in stale_brands(self.registry)
+                          if self.failed_versions.get(brand) != file_versions(self.registry, brand)]
+                if brands:
+                    self.reload(f"catalog or rules change ({', '.join(brands)})")
+            self._spawn_missing()
+            time.sleep(0.2)
+
+    def reload(self, reason):
+        """Reloads the changed catalogs and rule files and replaces every worker with one forked from the new state.
+
+        When a catalog or rule file fails to load, the current workers keep
+        serving and the reload is tried again once that brand's files change
+        (or on SIGHUP).
+        """
+        logger.info('Reloading on %s', reason)
+        gc.unfreeze()
+        try:
+            preload(self.registry)
+        except Exception:
+            # Still stale, since a failed read leaves the loaded catalog in place
+            self.failed_versions = {brand: file_versions(self.registry, brand)
+                                    for brand in stale_brands(self.registry)}
+            logger.exception('Reload failed; generation %d keeps serving until the catalog or rule files '
+                             'change again', self.generation)
+            return
+        self.failed_versions = {}
+        self.generation += 1
+        old_workers = list(self.workers)
+        self.workers = {}
+        # New workers start accepting before the old ones stop
+        self._spawn_missing()
+        for pid in old_workers:
+            self._retire(pid)
+
+    def stop(self):
+        logger.info('Stopping: waiting for workers to finish')
+        for pid in list(self.workers):
+            self._retire(pid)
+        self.workers = {}
+        while self.retiring:
+            self._reap()
+            time.sleep(0.1)
+        self.listener.close()
+
+    def _spawn_missing(self):
+        while len(self.workers) < self.worker_count:
+            pid = os.fork()
+            if pid == 0:
+                status = 0
+                try:
+                    run_worker(self.app, self.listener, self.job_queue)
+                except BaseException:
+                    logger.exception('Worker %d failed', os.getpid())
+                    status = 1
+                finally:
+                    os._exit(status)
+            self.workers[pid] = (self.generation, time.monotonic())
+            logger.info('Started worker %d (generation %d)', pid, self.generation)
+
+    def _retire(self, pid):
+        try:
+            os.kill(pid, signal.SIGTERM)
+        except ProcessLookupError:
+            return
+        self.retiring[pid] = time.monotonic() + self.graceful_timeout
+
+    def _reap(self):
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                break
+            if pid == 0:
+                break
+            if pid in self.retiring:
+                del self.retiring[pid]
+                logger.info('Worker %d stopped', pid)
+            elif pid in self.workers:
+                _, started = self.workers.pop(pid)
+                logger.warning('Worker %d exited unexpectedly (status %d); replacing it',
+                               pid, os.waitstatus_to_exitcode(status))
+                if time.monotonic() - started < MIN_WORKER_SECONDS:
+                    # Don't fork in a tight loop when workers die on startup
+                    time.sleep(MIN_WORKER_SECONDS)
+        now = time.monotonic()
+        for pid, deadline in list(self.retiring.items()):
+            if now >= deadline:
+                logger.warning('Worker %d did not stop within %ss; killing it', pid, self.graceful_timeout)
+                try:
+                    os.kill(pid, signal.SIGKILL)
+                except ProcessLookupError:
+                    pass
+                self.retiring[pid] = float('inf')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--app', default='test:app', help='module:attribute of the Flask app (default: test:app)')
+    parser.add_argument('--bind', default='127.0.0.1:8000', help='host:port to listen on')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--reload-interval', type=float, default=5.0,
+                        help='seconds between checks of the catalog files')
+    parser.add_argument('--graceful-timeout', type=float, default=GRACEFUL_TIMEOUT,
+                        help='seconds a stopping worker gets to finish its requests and jobs')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s [%(process)d] %(name)s: %(message)s')
+    module_name, _, attribute = args.app.partition(':')
+    module = importlib.import_module(module_name)
+    master = Master(getattr(module, attribute or 'app'), create_listener(args.bind), max(1, args.workers),
+                    getattr(module, 'job_queue', None), reload_interval=args.reload_interval,
+                    graceful_timeout=args.graceful_timeout)
+    master.run()
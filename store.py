@@ -0,0 +1,238 @@
+import json
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+from export import BYTES_CHUNK_SIZE, iter_bytes
+
+RESULT_SUFFIX = '.result'
+# How often (seconds) the spill directory is swept for expired results
+DISK_SWEEP_INTERVAL = 60
+
+
+class ResultStore:
+    """Download store with a memory budget, per-entry TTL and LRU eviction.
+
+    Small results live in an in-process LRU; results over spill_threshold are
+    written to spill_dir. With shared=True every result goes to spill_dir, so any
+    worker process pointed at the same directory can serve the download.
+    Counters are per process. A CSV can be stored as its export.compress()
+    body, which then counts against the budget at its compressed size.
+    """
+
+    def __init__(self, memory_budget=64 * 1024 * 1024, spill_threshold=4 * 1024 * 1024,
+                 ttl=15 * 60, spill_dir=None, shared=False):
+        self.memory_budget = memory_budget
+        self.spill_threshold = spill_threshold
+        self.ttl = ttl
+        self.shared = shared
+        self.spill_dir = spill_dir or os.path.join(tempfile.gettempdir(), 'rms-results')
+        os.makedirs(self.spill_dir, exist_ok=True)
+
+        self._entries = OrderedDict()
+        self._memory_used = 0
+        self._lock = threading.Lock()
+        self._last_disk_sweep = 0.0
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.spills = 0
+
+    # --- Public API ---
+
+    def put(self, data, filename, compression=None):
+        """Stores an encoded result and returns its download id.
+
+        With compression (export.compress(data)), its body is stored instead of data.
+        """
+        download_id = os.urandom(16).hex()
+        if compression is not None:
+            data = compression['body']
+            compression = {key: compression[key] for key in ('size', 'crc32', 'adler32')}
+        if self.shared or len(data) > self.spill_threshold:
+            self._write_spill(download_id, data, filename, compression)
+            with self._lock:
+                self.spills += 1
+        else:
+            with self._lock:
+                self._entries[download_id] = {
+                    'data': data,
+                    'filename': filename,
+                    'compression': compression,
+                    'expires': time.monotonic() + self.ttl,
+                }
+                self._memory_used += len(data)
+                self._evict_locked()
+        self._sweep_disk()
+        return download_id
+
+    def filename(self, download_id):
+        """Returns the stored filename without consuming the entry, or None."""
+        if not download_id:
+            return None
+        with self._lock:
+            entry = self._entries.get(download_id)
+            if entry is not None and entry['expires'] > time.monotonic():
+                self._entries.move_to_end(download_id)
+                return entry['filename']
+        path = self._spill_path(download_id)
+        try:
+            with open(path, 'rb') as file:
+                return json.loads(file.readline())['filename']
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def pop(self, download_id):
+        """Removes an entry and returns {'filename', 'size', 'chunks', 'compression'}, or None if missing.
+
+        size counts the stored bytes; compression is None unless the chunks are
+        a compressed body (see export.download_response).
+        """
+        entry = self._pop_memory(download_id) or self._pop_spill(download_id)
+        with self._lock:
+            if entry is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return entry
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'memory_bytes': self._memory_used,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'spills': self.spills,
+            }
+
+    # --- Memory Tier ---
+
+    def _pop_memory(self, download_id):
+        with self._lock:
+            self._evict_locked()
+            entry = self._entries.pop(download_id, None)
+            if entry is None:
+                return None
+            self._memory_used -= len(entry['data'])
+        return {
+            'filename': entry['filename'],
+            'size': len(entry['data']),
+            'chunks': iter_bytes(entry['data']),
+            'compression': entry['compression'],
+        }
+
+    def _evict_locked(self):
+        now = time.monotonic()
+        for download_id in [key for key, entry in self._entries.items() if entry['expires'] <= now]:
+            self._drop_locked(download_id)
+        while self._memory_used > self.memory_budget and self._entries:
+            self._drop_locked(next(iter(self._entries)))
+
+    def _drop_locked(self, download_id):
+        entry = self._entries.pop(download_id)
+        self._memory_used -= len(entry['data'])
+        self.evictions += 1
+
+    # --- Disk Tier ---
+
+    def _spill_path(self, download_id, suffix=RESULT_SUFFIX):
+        # Ids come from the session cookie, so never let them name arbitrary paths
+        if not download_id.isalnum():
+            download_id = 'invalid'
+        return os.path.join(self.spill_dir, download_id + suffix)
+
+    def _write_spill(self, download_id, data, filename, compression=None):
+        # Header line holds the metadata; written to a temp name and renamed so
+        # other processes only ever see complete files.
+        temp_path = self._spill_path(download_id, '.tmp')
+        with open(temp_path, 'wb') as file:
+            file.write(json.dumps({'filename': filename, 'compression': compression}).encode('utf-8') + b'\n')
+            file.write(data)
+        os.replace(temp_path, self._spill_path(download_id))
+
+    def _pop_spill(self, download_id):
+        path = self._spill_path(download_id)
+        claimed_path = self._spill_path(download_id, '.sending')
+        try:
+            if os.path.getmtime(path) + self.ttl <= time.time():
+                return None
+            # Rename is atomic, so exactly one worker process wins the download
+            os.replace(path, claimed_path)
+        except OSError:
+            return None
+
+        with open(claimed_path, 'rb') as file:
+            header = file.readline()
+            size = os.fstat(file.fileno()).st_size - len(header)
+        metadata = json.loads(header)
+        return {
+            'filename': metadata['filename'],
+            'size': size,
+            'chunks': _SpilledBody(claimed_path, len(header)),
+            'compression': metadata.get('compression'),
+        }
+
+    def _sweep_disk(self):
+        now = time.time()
+        if now - self._last_disk_sweep < DISK_SWEEP_INTERVAL:
+            return
+        self._last_disk_sweep = now
+        try:
+            names = os.listdir(self.spill_dir)
+        except OSError:
+            return
+        for name in names:
+            path = os.path.join(self.spill_dir, name)
+            try:
+                if os.path.getmtime(path) + self.ttl <= now:
+                    os.remove(path)
+                    if name.endswith(RESULT_SUFFIX):
+                        with self._lock:
+                            self.evictions += 1
+            except OSError:
+                continue
+
+
+class _SpilledBody:
+    """Chunks of a claimed spill file after its header line; the file is deleted on close().
+
+    The file is opened on the first chunk, and close() deletes it whether the
+    body was read in full, in part or not at all (a HEAD request, or a client
+    that disconnects first), so nothing waits for the TTL sweep.
+    """
+
+    def __init__(self, path, offset):
+        self.path = path
+        self.offset = offset
+        self._file = None
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self.path is None:
+            raise StopIteration
+        if self._file is None:
+            self._file = open(self.path, 'rb')
+            self._file.seek(self.offset)
+        chunk = self._file.read(BYTES_CHUNK_SIZE)
+        if not chunk:
+            self.close()
+            raise StopIteration
+        return chunk
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        if self.path is not None:
+            try:
+                os.remove(self.path)
+            except OSError:
+                pass
+            self.path = None
@@ -1,93 +1,42 @@
-import pandas as pd
-from flask import Flask, request, render_template_string, send_file, redirect, url_for, session, flash
+from flask import Flask, request, render_template, send_file, redirect, url_for, session, flash, jsonify, Response
 import io
+import logging
 import os
 from werkzeug.utils import secure_filename # Used to sanitize filenames
 
-app = Flask(__name__)
+from batch import ArchiveTooLarge, collect_workbooks, generated_filename, review_filename, run_batch, write_batch_zip
+from cache import result_cache
+from brands import catalog_registry
+from delta import SnapshotStore, apply_delta, process_delta, read_template
+from export import available_formats, compress, convert_csv, download_response, iter_csv, output_filename
+from ingest import INPUT_EXTENSIONS, read_workbook
+from jobs import JobQueue
+from metrics import PROMETHEUS_CONTENT_TYPE, metrics
+import pages
+from processing import process_data, split_review, unmatched_count
+from store import ResultStore
+from uploads import SLOT_TIMEOUT, UploadsBusy, upload_spool
+
+app = Flask(__name__, template_folder='web')
+pages.init_app(app)
 # IMPORTANT: Sessions require a secret key
 app.secret_key = 'your_super_secret_key_here' 
-app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024 
-
-# Global variable to temporarily store generated data in memory 
-download_data = {}
+# Uploads past a small threshold are spooled to disk; RMS_MAX_UPLOAD_MB sets the cap (see uploads.py)
+app.config['MAX_CONTENT_LENGTH'] = upload_spool.max_upload_bytes
+app.request_class = upload_spool.request_class(app.request_class)
 
+# Generated CSVs waiting for download: bounded, TTL-evicted, spills large results to disk.
+# Set RMS_SHARED_DOWNLOADS=1 when running several worker processes (serve.py does) so
+# every result and job status goes to a shared directory and any worker can serve it.
+shared_state = os.environ.get('RMS_SHARED_DOWNLOADS') == '1'
+download_store = ResultStore(shared=shared_state)
 
-def process_data(df_imported, df_basis):
-    
-    df_imported.rename(columns={
-        'Category Name': 'Category Name (Old)',
-        'Rate': 'Rate (Original)'
-    }, inplace=True)
-
+# Last full template per branch, the default baseline for delta exports
+snapshot_store = SnapshotStore(os.environ.get('RMS_SNAPSHOT_DIR'))
 
-    df_processed = df_imported[['Item Name', 'Category Name (Old)', 'Rate (Original)']].copy()
+# Background worker pool for uploads submitted through /jobs
+job_queue = JobQueue(shared=shared_state)
 
-    # --- Remove Duplicated Item Names ---
-    df_processed.drop_duplicates(subset=['Item Name'], keep='first', inplace=True)
-    
-    # --- Prepare Basis Data ---
-    df_basis_map = df_basis[[
-        'Pos Product Name', 
-        'Product Id', 
-        'Pos Categories'
-    ]].copy()
-    
-    df_basis_map.rename(columns={
-        'Pos Product Name': 'Item Name',
-        'Pos Categories': 'Category Name (New)'
-    }, inplace=True)
-    
-    df_basis_map.drop_duplicates(subset=['Item Name'], keep='first', inplace=True)
-    
-    # --- Merge Data ---
-    df_processed = pd.merge(
-        df_processed, 
-        df_basis_map, 
-        on='Item Name', 
-        how='left'
-    )
- 
-    
-    # Check for items that will become 'UNCATEGORIZED' before filling NaNs.
-    has_uncategorized_items = df_processed['Category Name (New)'].isnull().any()
-    
-    df_processed['Category Name (New)'].fillna('UNCATEGORIZED', inplace=True) 
-    
-    
-    # --- Rate and Final Column Setup ---
-    df_processed['Rate (Base Price)'] = (df_processed['Rate (Original)'] / 1.12).round(2)
-    
-    df_processed.sort_values(by='Product Id', inplace=True, na_position='last')
-    
-    df_processed['Featured Product'] = 'N'
-    df_processed['Pos Point Short Name'] = 'RMS'
-    df_processed['Unit Short Name'] = 'Unit'
-    df_processed['Status'] = 'A'
-
-    
-    remaining_placeholder_cols = [
-        'Description', 'Taxes Short Name', 'Pos Attributes', 
-        'NC value(%)', 'Kitchen Code'
-    ]
-    for col in remaining_placeholder_cols:
-        df_processed[col] = ''
-    
- 
-    df_final = df_processed[[
-        'Featured Product', 'Pos Point Short Name', 'Item Name', 'Product Id', 
-        'Description', 'Category Name (New)', 'Taxes Short Name', 'Pos Attributes', 
-        'Rate (Base Price)', 'NC value(%)', 'Unit Short Name', 'Kitchen Code', 'Status'
-    ]].copy()
-
-    df_final.rename(columns={
-        'Item Name': 'Pos Product Name',         
-        'Category Name (New)': 'Pos Categories', 
-        'Rate (Base Price)': 'Price'              
-    }, inplace=True)
-
-    # Return the final DataFrame AND the status of UNCATEGORIZED items
-    return df_final, has_uncategorized_items
 
 @app.route('/', methods=['GET', 'POST'])
 def index():
@@ -100,7 +49,9 @@ def index():
         if file.filename == '':
             return "Error: No selected file", 400
         
-        if file and file.filename.endswith(('.xlsx', '.xls')):
+        if file and file.filename.lower().endswith(INPUT_EXTENSIONS):
+            trace = metrics.trace(route='index', file=file.filename, bytes=request.content_length or 0,
+                                  brand=request.values.get('brand'))
             try:
                 # --- NEW FILENAME LOGIC ---
                 uploaded_filename = secure_filename(file.filename)
@@ -109,36 +60,43 @@ def index():
                 base_name = os.path.splitext(uploaded_filename)[0]
                 
                 # 2. Define the new filename (basename + '.csv')
-                generated_filename = base_name + '.csv'
+                download_name = base_name + '.csv'
                 
                 # --- End NEW FILENAME LOGIC ---
                 
-                df_imported = pd.read_excel(file)
+                brand = _selected_brand()
+                if brand is None:
+                    trace.finish('error', error='unknown brand')
+                    return "Error: Unknown brand", 400
+                output_format = _output_format()
+                if output_format is None:
+                    trace.finish('error', error='unsupported output format')
+                    return "Error: Unsupported output format", 400
+                catalog, _ = catalog_registry.get(brand)
+                if not catalog.exists():
+                    trace.finish('error', error='basis file missing')
+                    return f"Error: Basis file '{catalog.path}' not found. Please save 'PosProductDetails-RMS (1).csv' as 'basis_data.csv' in the same folder as 'app.py'.", 500
 
-                basis_file_name = 'basis_data.csv' 
-                if not os.path.exists(basis_file_name):
-                    return f"Error: Basis file '{basis_file_name}' not found. Please save 'PosProductDetails-RMS (1).csv' as 'basis_data.csv' in the same folder as 'app.py'.", 500
-                
-                df_basis = pd.read_csv(basis_file_name)
-                
-                # Unpack both the DataFrame and the status
-                df_exported, has_uncategorized = process_data(df_imported, df_basis)
-                
-                # 1. Convert DataFrame to CSV string
-                output = io.StringIO()
-                df_exported.to_csv(output, index=False)
-                output.seek(0)
-                csv_data = output.getvalue().encode('utf-8')
-
-                # 2. Store the CSV data and filename globally 
-                download_id = os.urandom(16).hex()
-                session['download_id'] = download_id
+                # 1. Generate the CSV (or only the changes since the branch's last template),
+                #    reusing it if this exact workbook was converted before
+                #    Large uploads are parsed from their spooled file, a few at a time
+                with upload_spool.slot(SLOT_TIMEOUT):
+                    result, download_name = generate_download(
+                        upload_spool.open(file), download_name, trace, brand=brand,
+                        delta=request.form.get('delta') == '1', previous=_previous_template(),
+                        refresh=request.values.get('refresh') == '1')
+                    has_uncategorized = result['uncategorized']
+                    data, download_name, compression = encode_download(result, download_name, output_format, trace)
+
+                # 2. Store the CSV data and filename in the download store
+                with trace.stage('store'):
+                    session['download_id'] = download_store.put(data, download_name, compression)
+                    review_id = None
+                    if result['review'] is not None:
+                        review_id = download_store.put(result['review'], review_filename(download_name))
+                    _attach_review(review_id, result['needs_review'])
                 
-                # Store both data and the desired filename
-                download_data[download_id] = {
-                    'data': csv_data, 
-                    'filename': generated_filename
-                }
+                trace.finish('ok', rows=result['rows'], unmatched=result['unmatched'])
                 
                 # 3. Use Flash to store the uncategorized status
                 if has_uncategorized:
@@ -149,7 +107,11 @@ def index():
                 # 4. Redirect immediately to the GET route
                 return redirect(url_for('index', success='true'))
 
+            except UploadsBusy as e:
+                trace.finish('error', error=e)
+                return f"Error: {e}. Please try again in a minute.", 503
             except Exception as e:
+                trace.finish('error', error=e)
                 return f"An error occurred during file processing: {e}", 500
 
     # GET Request Logic (Template Rendering)
@@ -164,158 +126,27 @@ def index():
             uncategorized_message = True
             break
 
-    # Conditional message for UNCATEGORIZED items
-    uncategorized_warning_html = ""
-    if uncategorized_message:
-        uncategorized_warning_html = """
-            <div class="warning-prompt">
-                ⚠️ **The generated template has item that is uncategorized. Please review the template first before importing in HLX.**
-            </div>
-        """
-        
+    # Normalized and fuzzy matches stay flagged until their review list is downloaded
+    review_count = session.get('review_count', 0) if session.get('review_id') else 0
+
     # Get the generated filename from the stored data for display/download link
-    current_download_data = download_data.get(session.get('download_id'), {})
-    download_filename = current_download_data.get('filename', 'monggoloid.csv')
+    download_filename = download_store.filename(session.get('download_id')) or 'monggoloid.csv'
     download_link = url_for('download_template') if session.get('download_id') else '#'
 
-
-    html_template = f"""
-    <!doctype html>
-    <title> Branch POS template </title>
-    <style>
-        body {{ font-family: Arial, sans-serif; margin: 50px; background-color: #f4f4f9; color: #333; }}
-        .container {{ background: white; padding: 30px; border-radius: 8px; box-shadow: 0 4px 8px rgba(0,0,0,0.1); max-width: 600px; margin: auto; }}
-        
-        h1 {{ 
-            color: #007bff; 
-            border-bottom: 2px solid #eee; 
-            padding-bottom: 10px; 
-            text-align: center; 
-        }}
-        
-        form {{ display: flex; flex-direction: column; }} 
-        
-        input[type="file"] {{ 
-            border: 1px solid #ccc; 
-            padding: 10px; 
-            border-radius: 4px; 
-            margin-bottom: 20px; 
-        }}
-        
-        .download-button {{ 
-            background-color: #007bff; 
-            color: white; 
-            padding: 12px 20px; 
-            border: none; 
-            border-radius: 4px; 
-            cursor: pointer; 
-            font-size: 16px; 
-            text-align: center;
-            text-decoration: none;
-            display: block;
-            margin: 10px 0;
-            transition: background-color 0.3s;
-        }}
-        .download-button:hover {{ background-color: #0056b3; }}
-        
-        .success-prompt {{
-            background-color: #d4edda;
-            color: #155724;
-            padding: 15px;
-            margin-bottom: 20px;
-            border: 1px solid #c3e6cb;
-            border-radius: 5px;
-            text-align: center;
-            font-weight: bold;
-        }}
-        
-        .warning-prompt {{
-            background-color: #fff3cd; 
-            color: #856404;
-            padding: 15px;
-            margin-bottom: 20px;
-            border: 1px solid #ffeeba;
-            border-radius: 5px;
-            text-align: center;
-            font-weight: bold;
-        }}
-        
-        #success-view {{
-            display: flex;
-            flex-direction: column;
-            align-items: center; 
-        }}
-        .reset-button {{
-            background-color: #28a745; 
-            width: auto; 
-            margin-top: 10px; 
-        }}
-        .reset-button:hover {{
-            background-color: #218838; 
-        }}
-        
-        button {{ 
-            background-color: #28a745; 
-            color: white; 
-            padding: 12px 20px; 
-            border: none; 
-            border-radius: 4px; 
-            cursor: pointer; 
-            font-size: 16px; 
-            transition: background-color 0.3s; 
-        }}
-        button:hover {{ background-color: #218838; }}
-
-        .note {{ background-color: #fff3cd; color: #856404; padding: 10px; border: 1px solid #ffeeba; border-radius: 4px; margin-top: 15px; }}
-        
-    </style>
-    <div class="container">
-        <h1>POS Template Generator</h1>
-        
-        <div id="success-view" style="display: {'block' if success_message == 'true' else 'none'};">
-            {uncategorized_warning_html}
-            <div class="success-prompt">
-                ✅ File successfully generated!
-            </div>
-            
-            <a href="{download_link}" class="download-button" download="{download_filename}" id="download-btn">
-                Download Generated CSV: <strong>{download_filename}</strong>
-            </a>
-
-            <button class="reset-button" onclick="window.location.href = window.location.pathname;">
-                Generate New Template
-            </button>
-        </div>
-
-        <form id="upload-form" method="POST" enctype="multipart/form-data" action="/" style="display: {'none' if success_message == 'true' else 'flex'};">
-            <input type="file" name="file" required>
-            
-            <button type="submit">Proceed and Generate New CSV File</button>
-        </form>
-        
-        <div class="note">
-            <strong>Generated template note:</strong> The generated CSV file automatically put values on those required columns for importing POS products in HLX. Please double check generated file and modify columns if needed.
-        </div>
-    </div>
-    <script>
-        document.querySelector('#upload-form').onsubmit = function() {{
-            const fileInput = document.querySelector('input[type="file"]');
-            if (fileInput.files.length > 0) {{
-                // Disable button and show a loading state
-                const button = document.querySelector('#upload-form button[type="submit"]');
-                button.disabled = true;
-                button.textContent = 'Processing... Please wait.';
-            }}
-            return true;
-        }};
-
-        const isSuccess = '{{ success_message }}' === 'true';
-        if (isSuccess) {{
-            window.scrollTo(0, 0);
-        }}
-    </script>
-    """
-    return render_template_string(html_template)
+    # The template is compiled once (web/index.html); only these values change per request
+    labels = {'csv': 'CSV (HLX import)', 'parquet': 'Parquet', 'arrow': 'Arrow IPC'}
+    return render_template(
+        'index.html',
+        success=success_message == 'true',
+        uncategorized=uncategorized_message,
+        review_count=review_count,
+        review_link=url_for('download_review') if review_count else '#',
+        download_link=download_link,
+        download_filename=download_filename,
+        brands=catalog_registry.brands(),
+        default_brand=catalog_registry.default_brand,
+        formats=[(name, labels[name]) for name in available_formats()],
+    )
 
 # ----------------------------------------------------------------------
 
@@ -323,29 +154,377 @@ def index():
 def download_template():
     """Handles the dedicated file download request."""
     download_id = session.get('download_id')
+    file_info = download_store.pop(download_id) if download_id else None
     
-    if not download_id or download_id not in download_data:
-        # If the file data isn't found, redirect back
+    if file_info is None:
+        # If the file data isn't found (never stored, expired or evicted), redirect back
         return redirect(url_for('index'))
 
-    
-    file_info = download_data[download_id]
-    csv_data = file_info['data']
-    filename = file_info['filename']
-    
-    
-    del download_data[download_id]
     session.pop('download_id', None)
     
+    # CSVs are stored compressed and sent gzip- or deflate-encoded when the client accepts it
+    return download_response(file_info['chunks'], file_info['filename'], file_info['size'],
+                             file_info['compression'])
+
+
+@app.route('/download/review', methods=['GET'])
+def download_review():
+    """Sends the items of the last result that were matched by a normalized or fuzzy name."""
+    review_id = session.get('review_id')
+    file_info = download_store.pop(review_id) if review_id else None
+
+    if file_info is None:
+        return redirect(url_for('index'))
+
+    _attach_review(None)
+    return download_response(file_info['chunks'], file_info['filename'], file_info['size'],
+                             file_info['compression'])
+
+
+def _attach_review(review_id, count=0):
+    """Points this session at a stored review list (see processing.split_review), or clears it."""
+    if review_id is None:
+        session.pop('review_id', None)
+        session.pop('review_count', None)
+    else:
+        session['review_id'] = review_id
+        session['review_count'] = count
+
+# ----------------------------------------------------------------------
+
+@app.route('/batch', methods=['POST'])
+def batch_upload():
+    """Processes many branch workbooks (or one ZIP of them) and returns a ZIP of CSVs."""
+    files = [file for file in request.files.getlist('files') if file and file.filename]
+    if not files:
+        return "Error: No selected file", 400
+    # Spooled uploads and the ZIP members unpacked from them are read from disk; the run takes one upload slot
+    try:
+        with upload_spool.slot(SLOT_TIMEOUT):
+            uploads = [upload_spool.open(file) for file in files]
+            return _run_batch_upload([(upload.filename, upload.source()) for upload in uploads])
+    except UploadsBusy as e:
+        return f"Error: {e}. Please try again in a minute.", 503
+
+
+def _run_batch_upload(uploads):
+    """Runs /batch over (filename, source) pairs; see batch.collect_workbooks."""
+    try:
+        workbooks = collect_workbooks(uploads, spool=upload_spool)
+    except ArchiveTooLarge as e:
+        return f"Error: {e}", 413
+    except Exception as e:
+        return f"An error occurred while reading the uploaded files: {e}", 400
+
+    if not workbooks:
+        return "Error: No .xlsx, .xls, .csv or .parquet files found in the upload", 400
+
+    brand = _selected_brand()
+    if brand is None:
+        return "Error: Unknown brand", 400
+    catalog, options = catalog_registry.get(brand)
+    if not catalog.exists():
+        return f"Error: Basis file '{catalog.path}' not found. Please save 'PosProductDetails-RMS (1).csv' as 'basis_data.csv' in the same folder as 'app.py'.", 500
+
+    results = run_batch(workbooks, catalog.get_index(), catalog.get_matcher(), options=options)
+
     return send_file(
-        io.BytesIO(csv_data), 
-        mimetype='text/csv',
+        write_batch_zip(results),
+        mimetype='application/zip',
         as_attachment=True,
-        download_name=filename 
+        download_name='branch_templates.zip'
     )
 
 # ----------------------------------------------------------------------
 
+def _no_report(stage):
+    pass
+
+
+def convert_upload(upload, trace, report=_no_report, refresh=False, brand=None, branch=None):
+    """Parses, matches and exports one uploaded workbook (an uploads.Upload), going through result_cache.
+
+    Returns {'data', 'compression', 'rows', 'unmatched', 'uncategorized',
+    'needs_review', 'review'}, where compression is export.compress(data),
+    cached with it so repeated downloads of a result are compressed once, and
+    review is the CSV of items matched by a normalized or fuzzy name (None when
+    there are none). refresh=True skips the cache lookup but still stores the
+    fresh result.
+    """
+    catalog, options = catalog_registry.get(brand)
+    rules = options['rules']
+    digest = upload.digest()
+    version = catalog.version()
+    if rules is not None:
+        # Rule file edits invalidate like catalog edits; branch rules make the name part of the key
+        version = f'{version}:{rules.version}'
+        if rules.branch_specific:
+            digest = f'{digest}:{branch}'
+    result = None if refresh else result_cache.get(digest, version, brand)
+    if result is not None:
+        trace.fields['cache'] = 'hit'
+        return result
+    trace.fields['cache'] = 'miss'
+
+    report('parsing')
+    with trace.stage('read'):
+        df_imported = read_workbook(upload.source())
+
+    report('matching')
+    with trace.stage('catalog'):
+        catalog_index = catalog.get_index()
+        matcher = catalog.get_matcher()
+    df_exported, has_uncategorized = process_data(df_imported, catalog_index, matcher, stage=trace.stage, lean=True,
+                                                  match_details=True, branch=branch, **options)
+    df_exported, df_review = split_review(df_exported)
+
+    report('exporting')
+    with trace.stage('export'):
+        # Encode the DataFrame as CSV chunk by chunk (one copy, no StringIO)
+        csv_data = b''.join(iter_csv(df_exported))
+        review = b''.join(iter_csv(df_review)) if len(df_review) else None
+    with trace.stage('compress'):
+        compression = compress(csv_data)
+
+    result = {
+        'data': csv_data,
+        'compression': compression,
+        'rows': len(df_imported),
+        'unmatched': unmatched_count(df_exported, rules),
+        'uncategorized': bool(has_uncategorized),
+        'needs_review': len(df_review),
+        'review': review,
+    }
+    result_cache.put(digest, version, scope=brand, **result)
+    return result
+
+
+def convert_delta(upload, df_previous, trace, report=_no_report, brand=None, branch=None):
+    """Exports only the items added, re-priced or removed since df_previous.
+
+    Returns the same keys as convert_upload plus 'snapshot', the full template
+    after the change, for the branch's snapshot. Only added items can need review.
+    """
+    catalog, options = catalog_registry.get(brand)
+    report('parsing')
+    with trace.stage('read'):
+        df_imported = read_workbook(upload.source())
+
+    report('matching')
+    with trace.stage('catalog'):
+        catalog_index = catalog.get_index()
+        matcher = catalog.get_matcher()
+    with trace.stage('delta'):
+        df_changes, has_uncategorized = process_delta(df_imported, df_previous, catalog_index, matcher,
+                                                      stage=trace.stage, branch=branch, match_details=True,
+                                                      **options)
+    df_changes, df_review = split_review(df_changes)
+
+    report('exporting')
+    with trace.stage('export'):
+        csv_data = b''.join(iter_csv(df_changes))
+        review = b''.join(iter_csv(df_review)) if len(df_review) else None
+        snapshot = b''.join(iter_csv(apply_delta(df_previous, df_changes)))
+    with trace.stage('compress'):
+        compression = compress(csv_data)
+
+    added = df_changes[df_changes['Change'] == 'added']
+    trace.fields['changes'] = len(df_changes)
+    return {
+        'data': csv_data,
+        'compression': compression,
+        'rows': len(df_imported),
+        'unmatched': unmatched_count(added, options['rules']),
+        'uncategorized': has_uncategorized,
+        'needs_review': len(df_review),
+        'review': review,
+        'snapshot': snapshot,
+    }
+
+
+def generate_download(upload, download_name, trace, report=_no_report, delta=False, previous=None, refresh=False,
+                      brand=None):
+    """Runs a full or delta conversion and keeps the branch snapshot current.
+
+    Delta mode compares against `previous` (an uploaded template CSV) or, when
+    that is missing, the snapshot stored for this brand and download_name; with
+    neither it falls back to the full template. Returns (result, download filename).
+    """
+    brand = brand or catalog_registry.default_brand
+    branch = os.path.splitext(download_name)[0]
+    snapshot_name = f'{brand}-{download_name}'
+    df_previous = None
+    if previous:
+        df_previous = read_template(io.BytesIO(previous))
+    elif delta:
+        df_previous = snapshot_store.load(snapshot_name)
+
+    if df_previous is None:
+        result = convert_upload(upload, trace, report, refresh, brand, branch)
+        snapshot_store.save(snapshot_name, result['data'])
+        return result, download_name
+
+    result = convert_delta(upload, df_previous, trace, report, brand, branch)
+    snapshot_store.save(snapshot_name, result.pop('snapshot'))
+    return result, os.path.splitext(download_name)[0] + '_changes.csv'
+
+
+def encode_download(result, download_name, output_format, trace):
+    """Returns (bytes, filename, compression) of a generated CSV re-encoded as output_format.
+
+    The result cache and branch snapshots always hold CSV; other formats are
+    encoded from it at the end and have no compression (None).
+    """
+    if output_format == 'csv':
+        return result['data'], download_name, result['compression']
+    with trace.stage('encode'):
+        return convert_csv(result['data'], output_format), output_filename(download_name, output_format), None
+
+
+def run_upload_job(report, upload, download_name, delta=False, previous=None, brand=None, output_format='csv'):
+    """Parses, matches and exports one uploaded workbook on the job queue, then deletes its spooled file."""
+    trace = metrics.trace(route='jobs', file=download_name, bytes=upload.size, brand=brand)
+    try:
+        # Queued jobs wait for a slot instead of failing
+        with upload_spool.slot():
+            result, download_name = generate_download(upload, download_name, trace, report, delta, previous,
+                                                      brand=brand)
+            data, download_name, compression = encode_download(result, download_name, output_format, trace)
+        with trace.stage('store'):
+            download_id = download_store.put(data, download_name, compression)
+            review_id = None
+            if result['review'] is not None:
+                review_id = download_store.put(result['review'], review_filename(download_name))
+    except Exception as e:
+        trace.finish('error', error=e)
+        raise
+    finally:
+        upload.cleanup()
+
+    trace.finish('ok', rows=result['rows'], unmatched=result['unmatched'])
+    return {
+        'download_id': download_id,
+        'filename': download_name,
+        'uncategorized': result['uncategorized'],
+        'review_id': review_id,
+        'needs_review': result['needs_review'],
+    }
+
+
+def _selected_brand():
+    """The brand picked for this upload (default when none is given), or None if unknown."""
+    brand = request.values.get('brand') or catalog_registry.default_brand
+    return brand if brand in catalog_registry.brands() else None
+
+
+def _output_format():
+    """The download format picked for this upload ('csv' when none is given), or None if unsupported."""
+    output_format = request.values.get('format') or 'csv'
+    return output_format if output_format in available_formats() else None
+
+
+def _previous_template():
+    """Bytes of the optional previous template uploaded for a delta export, or None."""
+    previous = request.files.get('previous')
+    if previous is None or previous.filename == '':
+        return None
+    return previous.read()
+
+
+@app.route('/jobs', methods=['POST'])
+def submit_job():
+    """Queues an upload and returns its job id right away."""
+    if 'file' not in request.files:
+        return "Error: No file part", 400
+
+    file = request.files['file']
+
+    if file.filename == '':
+        return "Error: No selected file", 400
+
+    if not file.filename.lower().endswith(INPUT_EXTENSIONS):
+        return "Error: Only .xlsx, .xls, .csv and .parquet files are supported", 400
+
+    output_format = _output_format()
+    if output_format is None:
+        return "Error: Unsupported output format", 400
+
+    brand = _selected_brand()
+    if brand is None:
+        return "Error: Unknown brand", 400
+    catalog, _ = catalog_registry.get(brand)
+    if not catalog.exists():
+        return f"Error: Basis file '{catalog.path}' not found. Please save 'PosProductDetails-RMS (1).csv' as 'basis_data.csv' in the same folder as 'app.py'.", 500
+
+    # The job owns the spooled upload from here and deletes it when it finishes
+    job_id = job_queue.submit(run_upload_job, upload_spool.claim(file), generated_filename(file.filename),
+                              request.form.get('delta') == '1', _previous_template(), brand, output_format)
+    return jsonify({'job_id': job_id, 'status_url': url_for('job_status', job_id=job_id)}), 202
+
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def job_status(job_id):
+    """Reports a job's stage and, once it is done, hands off to the /download flow."""
+    job = job_queue.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Unknown or expired job'}), 404
+
+    payload = {key: job[key] for key in ('job_id', 'status', 'stage', 'progress', 'error')}
+
+    if job['status'] == 'done':
+        # Attach the result to this session once, the same way a direct upload does
+        if session.get('download_id') != job['download_id']:
+            session['download_id'] = job['download_id']
+            _attach_review(job['review_id'], job['needs_review'])
+            if job['uncategorized']:
+                flash('uncategorized_warning', 'warning')
+            else:
+                flash('success_message', 'success')
+        payload['filename'] = job['filename']
+        payload['needs_review'] = job['needs_review']
+        payload['redirect'] = url_for('index', success='true')
+
+    return jsonify(payload)
+
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    """Prometheus scrape endpoint."""
+    return Response(metrics.render(), mimetype=PROMETHEUS_CONTENT_TYPE)
+
+
+@app.route('/healthz', methods=['GET'])
+def healthz():
+    """Liveness probe: the process is up and answering requests."""
+    return jsonify({'status': 'ok', 'pid': os.getpid()})
+
+
+@app.route('/readyz', methods=['GET'])
+def readyz():
+    """Readiness probe: 503 until every brand's basis catalog is in place."""
+    ready, brands = catalog_registry.readiness()
+    return jsonify({'ready': ready, 'brands': brands}), 200 if ready else 503
+
+
+def _download_store_gauges():
+    stats = download_store.stats()
+    return {
+        'rms_download_store_entries': ('Results held in memory by the download store.', stats['entries']),
+        'rms_download_store_bytes': ('Bytes held in memory by the download store.', stats['memory_bytes']),
+        'rms_download_store_hits': ('Downloads served from the store.', stats['hits']),
+        'rms_download_store_misses': ('Downloads that found no stored result.', stats['misses']),
+        'rms_download_store_evictions': ('Results dropped by TTL or memory budget.', stats['evictions']),
+        'rms_download_store_spills': ('Results written to the spill directory.', stats['spills']),
+    }
+
+
+metrics.add_collector(_download_store_gauges)
+metrics.add_collector(result_cache.gauges)
+metrics.add_collector(catalog_registry.gauges)
+metrics.add_collector(upload_spool.gauges)
+
+# ----------------------------------------------------------------------
+
 if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
     print("Running Flask app. Open your browser to http://127.0.0.1:5000/")
     app.run(debug=True)
\ No newline at end of file
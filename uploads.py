@@ -0,0 +1,210 @@
+"""Disk-backed uploads with a bound on how many are processed at once.
+
+Request bodies up to spool_threshold stay in memory. Larger file parts are
+written to a temp file in spool_dir as they arrive, and the parser gets the
+path rather than a buffer (see ingest.read_workbook), so a large workbook costs
+disk while it waits, not RAM. A spooled file is deleted when its request ends,
+unless a job claims it; the job then deletes it when it finishes.
+
+What an upload costs in memory is the parse and match, so max_in_flight caps
+how many uploads a process works on at the same time; the others wait for a
+slot. The upload size limit (max_upload_bytes, the apps' MAX_CONTENT_LENGTH)
+is set on its own, so large files can be accepted without letting memory
+grow with the number of them.
+"""
+import hashlib
+import io
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+from flask import Request, has_request_context, request
+
+SPOOL_PREFIX = 'upload-'
+# How often (seconds) the spool directory is swept for files left behind
+SPOOL_SWEEP_INTERVAL = 60
+# Spooled files older than this belonged to a process that died; removed by the sweep
+SPOOL_TTL = 6 * 60 * 60
+# Seconds a direct upload waits for a slot before it is answered with 503
+SLOT_TIMEOUT = 60
+
+
+class UploadsBusy(Exception):
+    """No upload slot became free in time."""
+
+
+class Upload:
+    """One uploaded file: its bytes when small, else the path of its spooled copy."""
+
+    def __init__(self, filename, data=None, path=None):
+        self.filename = filename
+        self.data = data
+        self.path = path
+        self.size = len(data) if path is None else os.path.getsize(path)
+
+    def source(self):
+        """What to hand ingest.read_workbook: the spooled path, or a buffer over the bytes."""
+        return self.path if self.path is not None else io.BytesIO(self.data)
+
+    def read(self):
+        if self.path is None:
+            return self.data
+        with open(self.path, 'rb') as file:
+            return file.read()
+
+    def digest(self):
+        """Same as cache.ResultCache.digest of the bytes, read in blocks when spooled."""
+        if self.path is None:
+            return hashlib.blake2b(self.data, digest_size=20).hexdigest()
+        digest = hashlib.blake2b(digest_size=20)
+        with open(self.path, 'rb') as file:
+            for block in iter(lambda: file.read(1024 * 1024), b''):
+                digest.update(block)
+        return digest.hexdigest()
+
+    def cleanup(self):
+        if self.path is not None:
+            try:
+                os.remove(self.path)
+            except OSError:
+                pass
+
+
+class UploadSpool:
+    """Spools large uploads to disk and hands out processing slots."""
+
+    def __init__(self, spool_threshold=1024 * 1024, spool_dir=None, max_upload_bytes=256 * 1024 * 1024,
+                 max_in_flight=4):
+        self.spool_threshold = spool_threshold
+        self.spool_dir = os.path.abspath(spool_dir or os.path.join(tempfile.gettempdir(), 'rms-uploads'))
+        os.makedirs(self.spool_dir, exist_ok=True)
+        self.max_upload_bytes = max_upload_bytes
+        self.max_in_flight = max_in_flight
+        self._slots = threading.BoundedSemaphore(max_in_flight)
+        self._lock = threading.Lock()
+        self._last_sweep = 0.0
+
+        self.in_flight = 0
+        self.spooled = 0
+        self.rejected = 0
+
+    # --- Requests ---
+
+    def request_class(self, base=Request):
+        """A Flask request class whose large file parts are spooled here (set as app.request_class)."""
+        spool = self
+
+        class SpooledRequest(base):
+            def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+                # Decided on the whole body, like werkzeug's own stream factory
+                if total_content_length is not None and total_content_length <= spool.spool_threshold:
+                    return io.BytesIO()
+                stream = spool._spool_file()
+                self.__dict__.setdefault('spooled_paths', []).append(stream.name)
+                return stream
+
+            def close(self):
+                super().close()
+                # Whatever no job claimed goes with the request
+                for path in self.__dict__.get('spooled_paths', []):
+                    try:
+                        os.remove(path)
+                    except OSError:
+                        pass
+
+        return SpooledRequest
+
+    def open(self, file):
+        """The Upload of a request's FileStorage, valid until the request ends."""
+        path = getattr(file.stream, 'name', None)
+        if isinstance(path, str) and os.path.dirname(path) == self.spool_dir:
+            file.stream.flush()
+            return Upload(file.filename, path=path)
+        return Upload(file.filename, data=file.read())
+
+    def claim(self, file):
+        """Like open(), but the spooled file outlives the current request; call Upload.cleanup() when done."""
+        upload = self.open(file)
+        if upload.path is not None:
+            request.__dict__.get('spooled_paths', []).remove(upload.path)
+        return upload
+
+    def store(self, filename, blocks):
+        """Writes byte blocks to a new spool file, deleted with the current request like a spooled upload."""
+        stream = self._spool_file()
+        if has_request_context():
+            request.__dict__.setdefault('spooled_paths', []).append(stream.name)
+        with stream:
+            for block in blocks:
+                stream.write(block)
+        return Upload(filename, path=stream.name)
+
+    # --- Processing Slots ---
+
+    @contextmanager
+    def slot(self, timeout=None):
+        """Holds one of the max_in_flight slots, waiting up to timeout seconds (None: no limit).
+
+        Raises UploadsBusy if none frees up in time.
+        """
+        if not self._slots.acquire(timeout=timeout):
+            with self._lock:
+                self.rejected += 1
+            raise UploadsBusy(f'All {self.max_in_flight} upload slots are busy')
+        with self._lock:
+            self.in_flight += 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+            self._slots.release()
+
+    def gauges(self):
+        """metrics collector for the upload counters."""
+        with self._lock:
+            return {
+                'rms_uploads_in_flight': ('Uploads being processed now.', self.in_flight),
+                'rms_uploads_max_in_flight': ('Uploads processed at once before others wait.',
+                                              self.max_in_flight),
+                'rms_uploads_spooled': ('Uploads written to the spool directory.', self.spooled),
+                'rms_uploads_rejected': ('Uploads turned away because no slot freed up.', self.rejected),
+            }
+
+    # --- Spool Directory ---
+
+    def _spool_file(self):
+        self._sweep()
+        with self._lock:
+            self.spooled += 1
+        return tempfile.NamedTemporaryFile(mode='w+b', prefix=SPOOL_PREFIX, dir=self.spool_dir, delete=False)
+
+    def _sweep(self):
+        now = time.time()
+        if now - self._last_sweep < SPOOL_SWEEP_INTERVAL:
+            return
+        self._last_sweep = now
+        try:
+            names = os.listdir(self.spool_dir)
+        except OSError:
+            return
+        for name in names:
+            path = os.path.join(self.spool_dir, name)
+            try:
+                if name.startswith(SPOOL_PREFIX) and os.path.getmtime(path) + SPOOL_TTL <= now:
+                    os.remove(path)
+            except OSError:
+                continue
+
+
+# Shared instance used by the web apps. RMS_MAX_UPLOAD_MB caps one upload,
+# RMS_MAX_UPLOADS the uploads processed at once per process, RMS_SPOOL_THRESHOLD_KB
+# the request size kept in memory; RMS_UPLOAD_DIR is where larger ones go.
+upload_spool = UploadSpool(
+    spool_threshold=int(os.environ.get('RMS_SPOOL_THRESHOLD_KB', '1024')) * 1024,
+    spool_dir=os.environ.get('RMS_UPLOAD_DIR'),
+    max_upload_bytes=int(os.environ.get('RMS_MAX_UPLOAD_MB', '256')) * 1024 * 1024,
+    max_in_flight=int(os.environ.get('RMS_MAX_UPLOADS', '4')),
+)
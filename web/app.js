@@ -0,0 +1,18 @@
+// This file is static and cached, so the success state comes from the URL
+const isSuccess = new URLSearchParams(window.location.search).get('success') === 'true';
+
+document.querySelector('#upload-form').onsubmit = function() {
+    const fileInput = document.querySelector('input[type="file"]');
+    if (fileInput.files.length > 0) {
+        document.querySelector('#upload-form button[type="submit"]').disabled = true;
+
+        setTimeout(() => {
+            window.location.href = window.location.pathname + '?success=true';
+        }, 2000);
+    }
+    return true;
+};
+
+if (isSuccess) {
+    window.scrollTo(0, 0);
+}
@@ -0,0 +1,43 @@
+document.querySelector('#upload-form').onsubmit = function(event) {
+    const fileInput = document.querySelector('#upload-form input[type="file"]');
+    if (fileInput.files.length === 0) {
+        return true;
+    }
+    // Queue the upload as a job and poll its progress instead of holding the request open
+    event.preventDefault();
+    const button = document.querySelector('#upload-form button[type="submit"]');
+    button.disabled = true;
+    button.textContent = 'Uploading... Please wait.';
+
+    fetch('/jobs', { method: 'POST', body: new FormData(this) })
+        .then(response => response.ok ? response.json() : response.text().then(text => { throw new Error(text); }))
+        .then(job => pollJob(job.status_url, button))
+        .catch(error => {
+            button.disabled = false;
+            button.textContent = 'Proceed and Generate New CSV File';
+            alert(error.message);
+        });
+    return false;
+};
+
+function pollJob(statusUrl, button) {
+    return fetch(statusUrl)
+        .then(response => response.json())
+        .then(job => {
+            if (job.status === 'done') {
+                window.location.href = job.redirect;
+                return;
+            }
+            if (job.status === 'error') {
+                throw new Error('An error occurred during file processing: ' + job.error);
+            }
+            button.textContent = 'Processing... (' + job.stage + ')';
+            return new Promise(resolve => setTimeout(resolve, 500)).then(() => pollJob(statusUrl, button));
+        });
+}
+
+// This file is static and cached, so the success state comes from the URL
+const isSuccess = new URLSearchParams(window.location.search).get('success') === 'true';
+if (isSuccess) {
+    window.scrollTo(0, 0);
+}